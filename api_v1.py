@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+Версионированный JSON API (v1) для трехэтапного процесса анализа.
+
+Ресурсы:
+    POST   /api/v1/datasets                       - загрузка файла (multipart: 'file'; 'sheets', 'join_key', 'columns')
+    GET    /api/v1/datasets/<id>                  - метаданные набора данных
+    DELETE /api/v1/datasets/<id>                  - удаление набора данных и файла
+    GET    /api/v1/datasets/<id>/profile          - отчет о полноте (пагинация offset/limit)
+    POST   /api/v1/datasets/<id>/suggestions      - этап 0: предложения LLM {"query"}
+    GET    /api/v1/suggestions/<id>
+    POST   /api/v1/datasets/<id>/plans            - этап 1: план {"query", "confirmed_columns", "clarifications"}
+    GET    /api/v1/plans/<id>
+    POST   /api/v1/plans/<id>/results             - этап 2: выполнение плана
+    GET    /api/v1/results/<id>                   - результаты (пагинация или NDJSON-поток)
+
+Идемпотентные GET отдают ETag и отвечают 304 на If-None-Match.
+Сообщения, которые HTML-интерфейс показывает через flash, возвращаются в поле "messages".
+Этапы 0 и 1 - представления-генераторы utils.flow: под ASGI (asgi.py) они ждут LLM асинхронно.
+"""
+import hashlib
+import json
+from flask import (Blueprint, Response, current_app, get_flashed_messages, request,
+                   stream_with_context, url_for)
+
+from utils.data_loader import save_uploaded_file, parse_workbook_data, list_sheet_names, cleanup_file
+from utils.dataset_store import (register_dataset, get_dataset, drop_dataset, dataset_lock, track_stored_datasets,
+                                 put_artifact, update_artifact, get_artifact)
+from utils.flow import flow_view, initial_assessment, plan_proposal, Offload
+from utils.pipeline import (profile_dataframe, summarize_results, validate_strata_column, resolve_suggested_columns, resolve_plan_columns)
+from utils.preview import run_preview, start_exact_run
+from utils.plot_utils import plot_output, PLOT_FORMAT, PLOT_FORMATS
+from utils.scheduler import run_plan, SchedulerBusy, QuotaExceeded
+from utils.metrics import record_cache
+from utils.speculation import start_speculative_plan, take_speculative_plan
+
+api_v1 = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+DEFAULT_PAGE_LIMIT = 50
+MAX_PAGE_LIMIT = 500
+
+
+# --- Вспомогательные функции ---
+
+def _json_default(obj):
+    """Приводит numpy-скаляры и прочие нестандартные типы к JSON-совместимым."""
+    if hasattr(obj, 'item'):
+        return obj.item()
+    return str(obj)
+
+
+def _json_response(payload, status: int = 200, conditional: bool = False, headers: dict | None = None) -> Response:
+    """
+    Формирует JSON-ответ. Для conditional=True добавляет ETag и
+    обрабатывает If-None-Match (304 Not Modified).
+    """
+    body = json.dumps(payload, ensure_ascii=False, default=_json_default)
+    response = Response(body, status=status, mimetype='application/json')
+    if conditional:
+        response.set_etag(hashlib.sha256(body.encode('utf-8')).hexdigest()[:32])
+        response.headers['Cache-Control'] = 'no-cache'
+        response.make_conditional(request)
+    for key, value in (headers or {}).items():
+        response.headers[key] = value
+    return response
+
+
+def _error(message: str, status: int) -> Response:
+    return _json_response({"error": message, "messages": _drain_messages()}, status=status)
+
+
+def _drain_messages() -> list[dict]:
+    """Забирает накопленные flash-сообщения, чтобы вернуть их клиенту API."""
+    return [{"category": category, "message": message}
+            for category, message in get_flashed_messages(with_categories=True)]
+
+
+def _page_args() -> tuple[int, int]:
+    """Читает параметры пагинации offset/limit из строки запроса."""
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', DEFAULT_PAGE_LIMIT, type=int)
+    return offset, min(max(limit, 1), MAX_PAGE_LIMIT)
+
+
+def _paginate(items: list, endpoint: str, **url_values) -> tuple[dict, dict]:
+    """Возвращает (блок пагинации для тела ответа, заголовки Link)."""
+    offset, limit = _page_args()
+    page = {"offset": offset, "limit": limit, "total": len(items), "items": items[offset:offset + limit]}
+    links = []
+    if offset + limit < len(items):
+        links.append(f'<{url_for(endpoint, offset=offset + limit, limit=limit, **url_values)}>; rel="next"')
+    if offset > 0:
+        links.append(f'<{url_for(endpoint, offset=max(offset - limit, 0), limit=limit, **url_values)}>; rel="prev"')
+    return page, ({"Link": ", ".join(links)} if links else {})
+
+
+@api_v1.record_once
+def _track_stored_datasets(state):
+    track_stored_datasets()
+
+
+def _dataset_frame(dataset: dict):
+    """Возвращает DataFrame набора данных, загружая его при первом обращении (один раз на процесс)."""
+    record_cache('dataset_frame', dataset["df"] is not None)
+    if dataset["df"] is None:
+        with dataset_lock(dataset["id"]):
+            if dataset["df"] is None:
+                dataset["df"] = parse_workbook_data(dataset["filepath"], dataset["load_options"])
+    return dataset["df"]
+
+
+def _dataset_profile(dataset: dict) -> dict | None:
+    record_cache('dataset_profile', dataset["profile"] is not None)
+    if dataset["profile"] is None:
+        df = _dataset_frame(dataset)
+        if df is None:
+            return None
+        with dataset_lock(dataset["id"]):
+            if dataset["profile"] is None:
+                dataset["profile"] = profile_dataframe(df)
+    return dataset["profile"]
+
+
+def _dataset_payload(dataset: dict) -> dict:
+    df = dataset["df"]
+    return {
+        "id": dataset["id"],
+        "filename": dataset["filename"],
+        "sha256": dataset["sha256"],
+        "sheets": dataset["sheet_names"],
+        "created_at": dataset["created_at"],
+        "load_options": dataset["load_options"],
+        "n_rows": int(len(df)) if df is not None else None,
+        "columns": df.columns.tolist() if df is not None else None,
+        "links": {
+            "self": url_for('api_v1.dataset_detail', dataset_id=dataset["id"]),
+            "profile": url_for('api_v1.dataset_profile', dataset_id=dataset["id"]),
+            "suggestions": url_for('api_v1.create_suggestions', dataset_id=dataset["id"]),
+            "plans": url_for('api_v1.create_plan', dataset_id=dataset["id"]),
+        },
+    }
+
+
+# --- Наборы данных ---
+
+def _load_options_from_form(sheet_names: list[str]) -> tuple[dict | None, str | None]:
+    """
+    Параметры загрузки из multipart-полей: 'sheets' (повторяемое), 'join_key',
+    'columns' (JSON {лист: [столбцы]}). Возвращает (options или None, текст ошибки или None).
+    """
+    sheets = request.form.getlist('sheets')
+    if not sheets:
+        return None, None
+    unknown = [name for name in sheets if name not in sheet_names]
+    if unknown:
+        return None, f"Листы не найдены в книге: {', '.join(unknown)}. Доступны: {', '.join(sheet_names)}."
+    try:
+        columns = json.loads(request.form.get('columns') or '{}')
+    except ValueError as e:
+        return None, f"'columns' должен быть JSON-объектом {{лист: [столбцы]}}: {e}"
+    if not isinstance(columns, dict):
+        return None, "'columns' должен быть JSON-объектом {лист: [столбцы]}."
+    join_key = (request.form.get('join_key') or '').strip() or None
+    return {"sheets": sheets, "join_key": join_key if len(sheets) > 1 else None,
+            "columns": {name: [str(c) for c in cols] for name, cols in columns.items() if name in sheets and cols}}, None
+
+
+@api_v1.route('/datasets', methods=['POST'])
+def create_dataset():
+    """
+    Загружает Excel файл и регистрирует его как набор данных.
+    Необязательные поля: 'sheets', 'join_key', 'columns' - выбор листов книги.
+    """
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return _error("Файл не был загружен (ожидается multipart поле 'file').", 400)
+
+    filepath = save_uploaded_file(file)
+    if not filepath:
+        return _error("Не удалось сохранить файл.", 500)
+
+    sheet_names = list_sheet_names(filepath) or []
+    load_options, options_error = _load_options_from_form(sheet_names)
+    if options_error:
+        cleanup_file(filepath)
+        return _error(options_error, 400)
+
+    dataset = register_dataset(filepath, file.filename, load_options, sheet_names)
+    if _dataset_frame(dataset) is None:
+        drop_dataset(dataset["id"])
+        return _error("Не удалось прочитать данные из файла.", 422)
+
+    payload = _dataset_payload(dataset)
+    payload["messages"] = _drain_messages()
+    return _json_response(payload, status=201, headers={"Location": payload["links"]["self"]})
+
+
+@api_v1.route('/datasets/<dataset_id>', methods=['GET'])
+def dataset_detail(dataset_id):
+    dataset = get_dataset(dataset_id)
+    if dataset is None:
+        return _error("Набор данных не найден.", 404)
+    _dataset_frame(dataset)
+    return _json_response(_dataset_payload(dataset), conditional=True)
+
+
+@api_v1.route('/datasets/<dataset_id>', methods=['DELETE'])
+def delete_dataset(dataset_id):
+    if drop_dataset(dataset_id) is None:
+        return _error("Набор данных не найден.", 404)
+    return Response(status=204)
+
+
+@api_v1.route('/datasets/<dataset_id>/profile', methods=['GET'])
+def dataset_profile(dataset_id):
+    """Отчет о полноте данных по столбцам (с пагинацией)."""
+    dataset = get_dataset(dataset_id)
+    if dataset is None:
+        return _error("Набор данных не найден.", 404)
+    profile = _dataset_profile(dataset)
+    if profile is None:
+        return _error("Не удалось построить профиль набора данных.", 422)
+
+    report = profile["completeness_report"]
+    rows = []
+    if report and report.get('report_df') is not None:
+        rows = [{"column": rec['Столбец'],
+                 "missing_count": int(rec['Кол-во пропусков']),
+                 "missing_pct": round(float(rec['% пропусков']), 2)}
+                for rec in report['report_df'].to_dict('records')]
+
+    page, link_headers = _paginate(rows, 'api_v1.dataset_profile', dataset_id=dataset_id)
+    payload = {
+        "dataset_id": dataset_id,
+        "columns_to_display": profile["columns_to_display"],
+        "missing_info": profile["missing_info_str"],
+        "columns": page,
+    }
+    return _json_response(payload, conditional=True, headers=link_headers)
+
+
+# --- Этап 0: предложения LLM ---
+
+@api_v1.route('/datasets/<dataset_id>/suggestions', methods=['POST'])
+@flow_view
+def create_suggestions(dataset_id):
+    dataset = get_dataset(dataset_id)
+    if dataset is None:
+        return _error("Набор данных не найден.", 404)
+    body = request.get_json(silent=True) or {}
+    query = str(body.get('query', '')).strip()
+    if not query:
+        return _error("Необходимо указать 'query'.", 400)
+
+    profile = yield Offload(_dataset_profile, dataset)
+    if profile is None:
+        return _error("Не удалось построить профиль набора данных.", 422)
+
+    llm_suggestions = yield initial_assessment(query, profile["columns_to_display"], profile["missing_info_str"],
+                                               column_profile=profile["column_profile"])
+    if not llm_suggestions:
+        return _error("Не удалось связаться с LLM. Попробуйте позже.", 502)
+    if llm_suggestions.get("error"):
+        return _json_response({"error": llm_suggestions["error"],
+                               "raw_response": llm_suggestions.get("raw_response"),
+                               "messages": _drain_messages()}, status=502)
+
+    llm_suggestions = resolve_suggested_columns(llm_suggestions, profile["columns_to_display"])
+    artifact = put_artifact('suggestions', dataset_id, {
+        "query": query,
+        "suggested_columns": llm_suggestions.get("suggested_columns", []),
+        "questions_to_user": llm_suggestions.get("questions_to_user", []),
+    })
+    start_speculative_plan(f"api:{dataset_id}", query, artifact["suggested_columns"])
+    location = url_for('api_v1.suggestion_detail', suggestion_id=artifact["id"])
+    return _json_response({**artifact, "messages": _drain_messages()}, status=201, headers={"Location": location})
+
+
+@api_v1.route('/suggestions/<suggestion_id>', methods=['GET'])
+def suggestion_detail(suggestion_id):
+    artifact = get_artifact('suggestions', suggestion_id)
+    if artifact is None:
+        return _error("Предложения не найдены.", 404)
+    return _json_response(artifact, conditional=True)
+
+
+# --- Этап 1: план анализа ---
+
+@api_v1.route('/datasets/<dataset_id>/plans', methods=['POST'])
+@flow_view
+def create_plan(dataset_id):
+    dataset = get_dataset(dataset_id)
+    if dataset is None:
+        return _error("Набор данных не найден.", 404)
+    body = request.get_json(silent=True) or {}
+    query = str(body.get('query', '')).strip()
+    confirmed_columns = body.get('confirmed_columns')
+    clarifications = str(body.get('clarifications') or '').strip()
+    if not query:
+        return _error("Необходимо указать 'query'.", 400)
+    if not isinstance(confirmed_columns, list) or not confirmed_columns:
+        return _error("'confirmed_columns' должен быть непустым списком.", 400)
+
+    proposed_plan = yield Offload(take_speculative_plan, f"api:{dataset_id}", query, confirmed_columns, clarifications)
+    if proposed_plan is None:
+        proposed_plan = yield plan_proposal(query, confirmed_columns, clarifications)
+    if isinstance(proposed_plan, dict) and proposed_plan.get('error'):
+        return _json_response({"error": proposed_plan['error'],
+                               "raw_response": proposed_plan.get("raw_response"),
+                               "messages": _drain_messages()}, status=502)
+    if not isinstance(proposed_plan, list):
+        current_app.logger.error(f"API: неожиданный формат плана от LLM: {type(proposed_plan)}")
+        return _error("LLM вернула план в неожиданном формате.", 502)
+    df = yield Offload(_dataset_frame, dataset)
+    if df is not None:
+        proposed_plan = resolve_plan_columns(proposed_plan, df.columns)
+
+    artifact = put_artifact('plans', dataset_id, {
+        "query": query,
+        "confirmed_columns": confirmed_columns,
+        "clarifications": clarifications,
+        "proposed_plan": proposed_plan,
+    })
+    location = url_for('api_v1.plan_detail', plan_id=artifact["id"])
+    return _json_response({**artifact, "messages": _drain_messages()}, status=201, headers={"Location": location})
+
+
+@api_v1.route('/plans/<plan_id>', methods=['GET'])
+def plan_detail(plan_id):
+    artifact = get_artifact('plans', plan_id)
+    if artifact is None:
+        return _error("План не найден.", 404)
+    return _json_response(artifact, conditional=True)
+
+
+# --- Этап 2: выполнение плана ---
+
+@api_v1.route('/plans/<plan_id>/results', methods=['POST'])
+def create_results(plan_id):
+    plan = get_artifact('plans', plan_id)
+    if plan is None:
+        return _error("План не найден.", 404)
+    dataset = get_dataset(plan["dataset_id"])
+    if dataset is None:
+        return _error("Набор данных плана больше не доступен.", 410)
+    df = _dataset_frame(dataset)
+    if df is None:
+        return _error("Не удалось прочитать данные из файла.", 422)
+
+    body = request.get_json(silent=True) or {}
+    strata_variable = body.get('strata_variable') or None
+    if strata_variable is not None and not isinstance(strata_variable, str):
+        return _error("'strata_variable' должен быть строкой.", 400)
+    if strata_variable:
+        strata_error = validate_strata_column(df, strata_variable)
+        if strata_error:
+            return _error(strata_error, 422)
+
+    # Формат графиков (data URI): png по умолчанию для совместимости, webp/svg/auto - компактнее
+    plot_format = body.get('plot_format') or PLOT_FORMAT
+    if plot_format not in PLOT_FORMATS:
+        return _error(f"'plot_format' должен быть одним из: {', '.join(PLOT_FORMATS)}.", 400)
+
+    proposed_plan = plan["proposed_plan"]
+    with plot_output(format=plot_format, tiers=False, thumbnails=False):
+        try:
+            if body.get('preview'):
+                return _create_preview_results(plan_id, dataset, df, proposed_plan, strata_variable)
+
+            # Через очередь с квотой на клиента и лимитами времени/памяти (utils.scheduler)
+            final_results = run_plan(df, proposed_plan, strata_variable)
+        except SchedulerBusy as e:
+            response = _error(str(e), 429 if isinstance(e, QuotaExceeded) else 503)
+            response.headers["Retry-After"] = str(e.retry_after)
+            return response
+    summary_message, summary_category = summarize_results(final_results, len(proposed_plan))
+    current_app.logger.info(f"API: {summary_message}")
+
+    artifact = put_artifact('results', dataset["id"], {
+        "plan_id": plan_id,
+        "strata_variable": strata_variable,
+        "status": "complete",
+        "summary": {"message": summary_message, "category": summary_category},
+        "steps": final_results,
+        "messages": _drain_messages(),
+    })
+    location = url_for('api_v1.result_detail', result_id=artifact["id"])
+    # Тело ответа без шагов: они могут быть большими (графики), клиент забирает их постранично
+    payload = {k: v for k, v in artifact.items() if k != "steps"}
+    payload["n_steps"] = len(final_results)
+    payload["links"] = {"self": location}
+    return _json_response(payload, status=201, headers={"Location": location})
+
+
+def _create_preview_results(plan_id: str, dataset: dict, df, proposed_plan: list, strata_variable: str | None) -> Response:
+    """
+    Предпросмотр: шаги плана на выборке возвращаются сразу (202), ресурс результатов
+    создается в статусе "running" и заполняется точным расчетом в фоне.
+    SchedulerBusy (очередь точных расчетов заполнена) передается вызывающему.
+    """
+    artifact = put_artifact('results', dataset["id"], {
+        "plan_id": plan_id,
+        "strata_variable": strata_variable,
+        "status": "running",
+        "summary": None,
+        "steps": [],
+        "messages": [],
+    })
+
+    def on_done(outcome):
+        # Ресурс в хранилище обновляется целиком по завершении расчета
+        if outcome["status"] == "done":
+            update_artifact(artifact, steps=outcome["results"], summary=outcome["summary"],
+                            messages=outcome["messages"], status="complete")
+        else:
+            update_artifact(artifact, status="error", error=outcome["error"])
+
+    try:
+        start_exact_run(df, proposed_plan, strata_variable, on_done=on_done)
+    except SchedulerBusy as e:
+        update_artifact(artifact, status="error", error=str(e))
+        raise
+    preview = run_preview(df, proposed_plan, strata_variable)
+    location = url_for('api_v1.result_detail', result_id=artifact["id"])
+    payload = {
+        "id": artifact["id"],
+        "status": "running",
+        "preview": {
+            "approximate": True,
+            "sample_rows": preview["sample_rows"],
+            "total_rows": preview["total_rows"],
+            "sample_strata": preview["sample_strata"],
+            "steps": preview["results"],
+        },
+        "messages": _drain_messages(),
+        "links": {"self": location},
+    }
+    return _json_response(payload, status=202, headers={"Location": location})
+
+
+@api_v1.route('/results/<result_id>', methods=['GET'])
+def result_detail(result_id):
+    """
+    Результаты выполнения плана. По умолчанию - постранично (offset/limit).
+    При Accept: application/x-ndjson шаги отдаются потоком, по одному JSON на строку.
+    """
+    artifact = get_artifact('results', result_id)
+    if artifact is None:
+        return _error("Результаты не найдены.", 404)
+    if artifact.get("status") == "running":
+        return _json_response({"id": artifact["id"], "status": "running"}, status=202, headers={"Retry-After": "1"})
+    if artifact.get("status") == "error":
+        return _json_response({"id": artifact["id"], "status": "error", "error": artifact.get("error")}, status=500)
+
+    if request.accept_mimetypes.best == 'application/x-ndjson':
+        def generate():
+            for index, step in enumerate(artifact["steps"]):
+                yield json.dumps({"index": index, **step}, ensure_ascii=False, default=_json_default) + "\n"
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    page, link_headers = _paginate(artifact["steps"], 'api_v1.result_detail', result_id=result_id)
+    payload = {k: v for k, v in artifact.items() if k != "steps"}
+    payload["steps"] = page
+    return _json_response(payload, conditional=True, headers=link_headers)
@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 import os
-import json
 import traceback # Import traceback for better error logging
-import pandas as pd # Импортируем pandas для проверки типа
+import uuid
+import gzip
 # Добавляем session и logging
 from flask import Flask, request, render_template, flash, redirect, url_for, jsonify, session
 from dotenv import load_dotenv
@@ -12,12 +12,22 @@ import logging # Импортируем стандартный логгер
 load_dotenv()
 
 # Импортируем утилиты
-# Добавляем get_data_completeness_report
-from utils.data_loader import save_uploaded_file, load_data_from_path, cleanup_file, get_data_completeness_report
+from utils.data_loader import (save_uploaded_file, cleanup_file, read_header_columns,
+                               list_sheet_names, read_sheet_headers, load_workbook_data)
 # Используем НОВЫЕ функции для Gemini
-from utils.llm_handler import get_initial_assessment, get_detailed_plan_proposal #, summarize_results (опционально)
-from utils.stats_processor import get_descriptive_stats, perform_t_test, perform_chi_square
-# dataframe_to_html импортируется внутри get_data_completeness_report и stats_processor теперь
+# Вызовы LLM идут через шаги utils.flow: синхронно под WSGI, через generate_content_async под ASGI (asgi.py)
+from utils.flow import flow_view, initial_assessment, plan_proposal, Offload, Wait
+# Профилирование и выполнение плана вынесены в utils.pipeline (общие с JSON API)
+from utils.pipeline import (profile_dataframe, summarize_results, merge_suggestions_with_profile, validate_strata_column,
+                            resolve_plan_columns)
+from utils.preview import run_preview, start_exact_run, get_exact_run, discard_exact_run
+from utils.plot_utils import plot_output, get_stored_plot, PLOT_URL_PREFIX
+from utils.scheduler import run_plan, SchedulerBusy
+from utils.prompt_builder import header_column_profile
+from utils.background import submit_in_request_context, PoolBusy
+from utils.speculation import start_speculative_plan, take_speculative_plan, discard_speculative_plan
+from api_v1 import api_v1
+from utils import metrics, profiling, llm_backends, janitor, fragments
 
 # --- Настройка Flask ---
 app = Flask(__name__)
@@ -25,6 +35,30 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'your-very-secret-key-please-change-it') # Замените на надежный ключ
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 # 16 MB Max Upload Size
+# Бюджет токенов на описание столбцов в промпте этапа 0 (широкие таблицы обрезаются по релевантности)
+app.config['LLM_COLUMN_TOKEN_BUDGET'] = int(os.getenv('LLM_COLUMN_TOKEN_BUDGET', 2000))
+# Этап 0: запрос к LLM по одним заголовкам параллельно с полным разбором файла
+app.config['START_PIPELINE_CONCURRENT'] = os.getenv('START_PIPELINE_CONCURRENT', 'True').lower() == 'true'
+# Спекулятивный план: запрашивается в фоне, пока пользователь проверяет предложенные столбцы
+app.config['SPECULATIVE_PLANNING'] = os.getenv('SPECULATIVE_PLANNING', 'True').lower() == 'true'
+
+# JSON API (v1) для трехэтапного процесса
+app.register_blueprint(api_v1)
+
+# Бэкенд LLM: Gemini или локальная заглушка для нагрузочных тестов (LLM_BACKEND)
+llm_backends.init_app(app)
+
+# Метрики Prometheus (/metrics) и заголовок Server-Timing
+metrics.init_app(app)
+
+# Профилирование медленных запросов по требованию (/admin/profiles)
+profiling.init_app(app)
+
+# Кеш фрагментов страниц и предварительная компиляция шаблонов
+fragments.init_app(app)
+
+# Фоновая очистка загрузок, наборов данных и графиков: сроки жизни и квота на диске
+janitor.init_app(app)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -39,25 +73,138 @@ if not os.path.exists(app.config['UPLOAD_FOLDER']):
         app.logger.critical(f"Не удалось создать папку для загрузок '{app.config['UPLOAD_FOLDER']}': {e}")
         # Можно здесь завершить приложение, если папка критична
 
+def _load_and_profile(filepath: str, load_options: dict | None = None):
+    """Полный разбор файла и отчет о полноте. Возвращает (df, profile) или (df, None)."""
+    df = load_workbook_data(filepath, load_options) # Должен использовать header=0, skiprows=[1]
+    if df is None or df.columns.empty:
+        return df, None
+    return df, profile_dataframe(df)
+
+
+def _parse_load_options(form, sheet_names: list[str]) -> dict:
+    """Параметры загрузки из формы выбора листов: листы, ключ соединения, столбцы по листам."""
+    sheets = [name for name in form.getlist('sheets') if name in sheet_names]
+    columns = {name: form.getlist(f'columns:{name}') for name in sheets if form.getlist(f'columns:{name}')}
+    join_key = form.get('join_key', '').strip() or None
+    return {"sheets": sheets, "join_key": join_key if len(sheets) > 1 else None, "columns": columns}
+
+
+def _join_key_candidates(sheet_headers: dict[str, list[str]]) -> list[str]:
+    """Столбцы, которые есть на всех листах (кандидаты в ключ пациента), в порядке первого листа."""
+    header_lists = [headers for headers in sheet_headers.values() if headers]
+    if len(header_lists) < 2:
+        return []
+    common = set(header_lists[0]).intersection(*map(set, header_lists[1:]))
+    return [col for col in header_lists[0] if col in common]
+
+
+def _run_initial_stage(uploaded_filepath: str, query: str, filename: str, load_options: dict | None):
+    """
+    Этап 0 после сохранения файла: разбор (выбранных листов), отчет о полноте,
+    запрос к LLM и страница подтверждения столбцов. Генератор шагов utils.flow.
+    """
+    # 3. Быстрый путь: по строке заголовков сразу запрашиваем LLM, а полный разбор
+    #    и отчет о полноте выполняются параллельно в фоновом потоке
+    #    (только для одного листа: при выборе листов заголовки известны после объединения)
+    concurrent = app.config['START_PIPELINE_CONCURRENT'] and not load_options
+    header_columns = (yield Offload(read_header_columns, uploaded_filepath)) if concurrent else None
+    llm_suggestions, parse_future = None, None
+    if header_columns:
+        try:
+            parse_future = submit_in_request_context("parse", _load_and_profile, uploaded_filepath)
+        except PoolBusy as e:
+            app.logger.warning(f"{e} Разбор файла выполняется до запроса к LLM.")
+    if parse_future is not None:
+        llm_suggestions = yield initial_assessment(
+            query, header_columns,
+            "Информация о пропусках рассчитывается параллельно и на этом шаге недоступна.",
+            column_profile=header_column_profile(header_columns))
+        df, profile = yield Wait(parse_future)
+    else:
+        df, profile = yield Offload(_load_and_profile, uploaded_filepath, load_options)
+    if df is None: cleanup_file(uploaded_filepath); return redirect(url_for('index'))
+
+    column_names_original = df.columns.tolist()
+    if not column_names_original:
+         flash(f'В файле "{filename}" не найдено заголовков столбцов или файл пуст.', 'danger')
+         cleanup_file(uploaded_filepath); return redirect(url_for('index'))
+    session['column_names_original'] = column_names_original
+
+    # 4. Анализ полноты данных и фильтрация столбцов
+    completeness_report = profile['completeness_report']
+    completeness_html_for_template = profile['completeness_html']
+    missing_info_str_for_llm = profile['missing_info_str']
+    columns_to_display = profile['columns_to_display']
+
+    if not columns_to_display and completeness_report: # Показываем предупреждение только если отчет был, но все отфильтровалось
+         flash("Внимание: Все столбцы в файле имеют 100% пропусков или не удалось прочитать данные.", "warning")
+
+    # 5. Сохранение в сессию
+    session['analysis_id'] = uuid.uuid4().hex
+    session['filepath'] = uploaded_filepath
+    session['load_options'] = load_options
+    session['original_query'] = query
+    session['columns_to_display'] = columns_to_display
+    session['completeness_html'] = completeness_html_for_template
+    session['missing_info_str'] = missing_info_str_for_llm
+    # Для повторной отрисовки страницы без разбора файла: % пропусков в порядке columns_to_display
+    session['dataset_hash'] = profile['dataset_hash']
+    session['columns_missing_pct'] = [profile['missing_pct'].get(col) for col in columns_to_display]
+
+    # 6. Запрос к LLM (если не был выполнен параллельно) и слияние с профилем данных
+    #    Имена столбцов из ответа сопоставляются с данными локально (utils.column_index)
+    if llm_suggestions is None:
+        llm_suggestions = yield initial_assessment(query, columns_to_display, missing_info_str_for_llm,
+                                                   column_profile=profile['column_profile'])
+    llm_suggestions = merge_suggestions_with_profile(llm_suggestions, columns_to_display)
+
+    if not llm_suggestions:
+         flash("Не удалось связаться с LLM. Попробуйте позже.", "danger")
+         cleanup_file(uploaded_filepath); session.clear(); return redirect(url_for('index'))
+    elif llm_suggestions.get("error"):
+         flash(f"Ошибка LLM: {llm_suggestions['error']}", "warning")
+
+    session['llm_suggestions'] = llm_suggestions
+
+    # Пока пользователь проверяет столбцы, в фоне готовим план для предложенного набора
+    if not llm_suggestions.get("error"):
+        start_speculative_plan(session['analysis_id'], query, llm_suggestions.get("suggested_columns", []))
+
+    # 7. Рендеринг страницы подтверждения
+    return render_template('confirm_columns.html',
+                           original_query=query,
+                           completeness_html=completeness_html_for_template,
+                           dataset_hash=profile['dataset_hash'],
+                           missing_pct=profile['missing_pct'],
+                           llm_suggestions=llm_suggestions,
+                           all_columns=columns_to_display)
+
 # --- Маршруты ---
 
 @app.route('/', methods=['GET'])
 def index():
     """Отображает главную страницу и очищает сессию от предыдущего анализа."""
-    keys_to_clear = ['filepath', 'original_query', 'column_names_original', 'columns_to_display',
-                     'completeness_html', 'missing_info_str', 'llm_suggestions',
+    keys_to_clear = ['analysis_id', 'filepath', 'load_options', 'original_query', 'column_names_original', 'columns_to_display',
+                     'completeness_html', 'missing_info_str', 'dataset_hash', 'columns_missing_pct', 'llm_suggestions',
                      'confirmed_columns', 'user_clarifications', 'proposed_plan',
                      'final_results']
+    discard_speculative_plan(session.get('analysis_id'))
+    discard_exact_run(session.pop('exact_job_id', None))
+    pending_upload = session.pop('pending_upload', None)
+    if pending_upload:
+        cleanup_file(pending_upload.get('filepath'))
     for key in keys_to_clear:
         session.pop(key, None)
     app.logger.info("Сессия очищена для нового анализа.")
     return render_template('index.html')
 
 @app.route('/analyze/start', methods=['POST'])
+@flow_view
 def start_analysis():
     """
     Этап 0: Принимает файл и запрос, проводит первичный анализ,
            запрашивает у LLM оценку и вопросы, рендерит страницу подтверждения.
+           Для книги с несколькими листами сначала показывает выбор листов.
     """
     uploaded_filepath = None
     try:
@@ -68,87 +215,64 @@ def start_analysis():
         if file.filename == '': flash('Не выбран файл для загрузки.', 'warning'); return redirect(url_for('index'))
         if not query: flash('Необходимо ввести запрос для анализа.', 'warning'); return redirect(url_for('index'))
 
-        # 2. Сохранение и загрузка данных
+        # 2. Сохранение файла
         uploaded_filepath = save_uploaded_file(file)
         if not uploaded_filepath: return redirect(url_for('index'))
-        df = load_data_from_path(uploaded_filepath) # Должен использовать header=0, skiprows=[1]
-        if df is None: cleanup_file(uploaded_filepath); return redirect(url_for('index'))
-
-        column_names_original = df.columns.tolist()
-        if not column_names_original:
-             flash(f'В файле "{file.filename}" не найдено заголовков столбцов или файл пуст.', 'danger')
-             cleanup_file(uploaded_filepath); return redirect(url_for('index'))
-        session['column_names_original'] = column_names_original
-
-        # 3. Анализ полноты данных
-        completeness_report = get_data_completeness_report(df)
-
-        # 4. Извлечение данных И ФИЛЬТРАЦИЯ СТОЛБЦОВ
-        completeness_html_for_template = "<p class='text-warning'>Не удалось рассчитать отчет о полноте.</p>"
-        missing_info_str_for_llm = "Не удалось получить информацию о пропусках."
-        report_df_full = None
-        columns_to_display = column_names_original[:]
-        report_df_filtered_for_template = None
-
-        if completeness_report:
-             completeness_html_for_template = completeness_report.get('html_table', completeness_html_for_template)
-             missing_info_str_for_llm = completeness_report.get('missing_info_str', missing_info_str_for_llm)
-             report_df_full = completeness_report.get('report_df')
-
-             if report_df_full is not None:
-                 app.logger.info(f"Полный отчет о полноте данных:\n{report_df_full.to_string()}")
-                 report_df_filtered = report_df_full[report_df_full['% пропусков'] < 100.0]
-                 if not report_df_filtered.empty:
-                    columns_to_display = report_df_filtered['Столбец'].tolist()
-                    report_df_filtered_for_template = report_df_filtered
-                 else:
-                    app.logger.warning("Внимание: Все столбцы имеют 100% пропусков.")
-                    columns_to_display = []
-                    report_df_filtered_for_template = pd.DataFrame(columns=['Столбец', 'Кол-во пропусков', '% пропусков'])
-                 app.logger.info(f"Столбцы для отображения и LLM ({len(columns_to_display)}): {columns_to_display}")
-             else:
-                 app.logger.warning("Отчет о полноте не содержит DataFrame.")
-        else:
-             app.logger.warning("Не удалось создать отчет о полноте данных.")
 
-        if not columns_to_display and completeness_report: # Показываем предупреждение только если отчет был, но все отфильтровалось
-             flash("Внимание: Все столбцы в файле имеют 100% пропусков или не удалось прочитать данные.", "warning")
+        # Несколько листов: пользователь выбирает листы, ключ соединения и столбцы
+        sheet_names = yield Offload(list_sheet_names, uploaded_filepath)
+        if sheet_names and len(sheet_names) > 1:
+            sheet_headers = yield Offload(read_sheet_headers, uploaded_filepath, sheet_names)
+            session['pending_upload'] = {"filepath": uploaded_filepath, "query": query, "filename": file.filename}
+            return render_template('select_sheets.html', original_query=query, filename=file.filename,
+                                   sheet_headers=sheet_headers, join_key_candidates=_join_key_candidates(sheet_headers))
 
-        # 5. Сохранение в сессию
-        session['filepath'] = uploaded_filepath
-        session['original_query'] = query
-        session['columns_to_display'] = columns_to_display
-        session['completeness_html'] = completeness_html_for_template
-        session['missing_info_str'] = missing_info_str_for_llm
+        return (yield from _run_initial_stage(uploaded_filepath, query, file.filename, None))
 
-        # 6. Запрос к LLM
-        llm_suggestions = get_initial_assessment(query, columns_to_display, missing_info_str_for_llm)
+    except Exception as e:
+        error_traceback = traceback.format_exc()
+        app.logger.error(f"Критическая ошибка в /analyze/start: {e}\n{error_traceback}")
+        flash(f'Произошла внутренняя ошибка сервера на этапе 0: {e}', 'danger')
+        cleanup_file(uploaded_filepath or session.get('filepath'))
+        session.clear()
+        return redirect(url_for('index'))
 
-        if not llm_suggestions:
-             flash("Не удалось связаться с LLM. Попробуйте позже.", "danger")
-             cleanup_file(uploaded_filepath); session.clear(); return redirect(url_for('index'))
-        elif llm_suggestions.get("error"):
-             flash(f"Ошибка LLM: {llm_suggestions['error']}", "warning")
 
-        session['llm_suggestions'] = llm_suggestions
+@app.route('/analyze/select_sheets', methods=['POST'])
+@flow_view
+def select_sheets():
+    """Этап 0 (продолжение): выбранные листы, ключ соединения и столбцы -> разбор и запрос к LLM."""
+    pending_upload = session.pop('pending_upload', None)
+    uploaded_filepath = (pending_upload or {}).get('filepath')
+    try:
+        if not pending_upload or not uploaded_filepath:
+            flash("Ошибка сессии: Не найден загруженный файл. Начните анализ заново.", "danger")
+            return redirect(url_for('index'))
 
-        # 7. Рендеринг страницы подтверждения
-        return render_template('confirm_columns.html',
-                               original_query=query,
-                               completeness_html=completeness_html_for_template,
-                               report_df=report_df_filtered_for_template,
-                               llm_suggestions=llm_suggestions,
-                               all_columns=columns_to_display)
+        sheet_names = yield Offload(list_sheet_names, uploaded_filepath)
+        load_options = _parse_load_options(request.form, sheet_names or [])
+        if not load_options["sheets"]:
+            flash("Необходимо выбрать хотя бы один лист.", "warning")
+            sheet_headers = yield Offload(read_sheet_headers, uploaded_filepath, sheet_names)
+            session['pending_upload'] = pending_upload
+            return render_template('select_sheets.html', original_query=pending_upload['query'],
+                                   filename=pending_upload['filename'], sheet_headers=sheet_headers,
+                                   join_key_candidates=_join_key_candidates(sheet_headers))
+        app.logger.info(f"Выбраны листы: {load_options['sheets']}, ключ: {load_options['join_key'] or 'нет'}")
+
+        return (yield from _run_initial_stage(uploaded_filepath, pending_upload['query'],
+                                              pending_upload['filename'], load_options))
 
     except Exception as e:
         error_traceback = traceback.format_exc()
-        app.logger.error(f"Критическая ошибка в /analyze/start: {e}\n{error_traceback}")
+        app.logger.error(f"Критическая ошибка в /analyze/select_sheets: {e}\n{error_traceback}")
         flash(f'Произошла внутренняя ошибка сервера на этапе 0: {e}', 'danger')
         cleanup_file(uploaded_filepath or session.get('filepath'))
         session.clear()
         return redirect(url_for('index'))
 
 @app.route('/analyze/confirm_columns', methods=['POST'])
+@flow_view
 def confirm_columns():
     """
     Этап 1: Принимает подтвержденные столбцы и уточнения,
@@ -172,17 +296,14 @@ def confirm_columns():
 
         if not confirmed_columns:
             flash("Необходимо выбрать хотя бы один столбец для анализа.", "warning")
-            df_for_rerender = load_data_from_path(filepath)
-            report_for_rerender = get_data_completeness_report(df_for_rerender) if df_for_rerender is not None else None
-            report_df_filtered_rerender = None
-            if report_for_rerender and report_for_rerender.get('report_df') is not None:
-                report_df_full_rerender = report_for_rerender['report_df']
-                report_df_filtered_rerender = report_df_full_rerender[report_df_full_rerender['% пропусков'] < 100.0]
-
+            # Файл не разбирается заново: таблица полноты и % пропусков сохранены в сессии,
+            # фрагменты страницы берутся из кеша по хешу набора данных (utils.fragments)
+            missing_pct = dict(zip(columns_to_display, session.get('columns_missing_pct') or []))
             return render_template('confirm_columns.html',
                                     original_query=original_query,
                                     completeness_html=completeness_html,
-                                    report_df=report_df_filtered_rerender,
+                                    dataset_hash=session.get('dataset_hash'),
+                                    missing_pct=missing_pct,
                                     llm_suggestions=llm_suggestions_prev,
                                     all_columns=columns_to_display,
                                     user_clarifications_input=user_clarifications)
@@ -194,8 +315,11 @@ def confirm_columns():
         session['confirmed_columns'] = confirmed_columns
         session['user_clarifications'] = user_clarifications
 
-        # 3. Запрос к LLM для получения детального плана
-        proposed_plan = get_detailed_plan_proposal(original_query, confirmed_columns, user_clarifications)
+        # 3. Детальный план: спекулятивный (если выбор не изменился) или новый запрос к LLM
+        proposed_plan = yield Offload(take_speculative_plan, session.get('analysis_id'), original_query,
+                                      confirmed_columns, user_clarifications)
+        if proposed_plan is None:
+            proposed_plan = yield plan_proposal(original_query, confirmed_columns, user_clarifications)
 
         if isinstance(proposed_plan, dict) and proposed_plan.get('error'):
             flash(f"Ошибка LLM при генерации плана: {proposed_plan['error']}", "warning")
@@ -203,11 +327,14 @@ def confirm_columns():
              flash("LLM вернула план в неожиданном формате.", "danger")
              app.logger.error(f"Неожиданный формат плана от LLM: {type(proposed_plan)}, План: {proposed_plan}")
              proposed_plan = {"error": "Неожиданный формат ответа LLM."}
+        else:
+            proposed_plan = resolve_plan_columns(proposed_plan, session.get('column_names_original') or columns_to_display)
 
         session['proposed_plan'] = proposed_plan
 
         # 4. Рендеринг страницы подтверждения плана
-        return render_template('confirm_plan.html', proposed_plan=proposed_plan)
+        return render_template('confirm_plan.html', proposed_plan=proposed_plan,
+                               strata_candidates=session.get('confirmed_columns', []))
 
     except Exception as e:
         error_traceback = traceback.format_exc()
@@ -226,6 +353,7 @@ def execute_plan():
     final_results = []
     filepath = session.get('filepath')
     proposed_plan = session.get('proposed_plan')
+    keep_file = False  # план не принят планировщиком - пользователь может повторить запуск
 
     try:
         if not filepath or not proposed_plan:
@@ -236,137 +364,44 @@ def execute_plan():
         if not isinstance(proposed_plan, list):
              flash(f"Ошибка: Невозможно выполнить анализ, так как план недействителен.", "danger")
              app.logger.error(f"Попытка выполнить недействительный план: {proposed_plan}")
-             return render_template('confirm_plan.html', proposed_plan=proposed_plan)
+             return render_template('confirm_plan.html', proposed_plan=proposed_plan,
+                                    strata_candidates=session.get('confirmed_columns', []))
 
-        df = load_data_from_path(filepath)
+        # DataFrame, разобранный на этапе 0 (кеш data_loader); повторный разбор - только в другом процессе
+        df = load_workbook_data(filepath, session.get('load_options'))
         if df is None:
             session.clear()
             return redirect(url_for('index'))
 
         app.logger.info(f"Начало выполнения {len(proposed_plan)} шагов анализа для файла {filepath}...")
-        for step in proposed_plan:
-            step_result = {"plan": step, "status": "pending"}
+        strata_variable = request.form.get('strata_variable', '').strip() or None
+        strata_error = validate_strata_column(df, strata_variable) if strata_variable else None
+        if strata_error:
+            flash(f"Стратификация не выполнена: {strata_error} План выполнен по всем данным.", "warning")
+            strata_variable = None
+
+        # Графики страницы результатов: формат по типу графика, миниатюры в списке,
+        # полный размер - по клику (изображения отдаются по URL /plots/<id>)
+        with plot_output(format='auto', tiers=True):
+            # Предпросмотр: план на выборке с миниатюрами сразу, точный расчет - в фоне
             try:
-                if not isinstance(step, dict):
-                    step_result["status"] = "error"
-                    step_result["message"] = f"Ошибка формата: шаг плана не словарь ({type(step)})."
-                    app.logger.warning(f"Пропуск шага: {step_result['message']}")
-                    # ---> ИСПРАВЛЕНИЕ ОТСТУПА ЗДЕСЬ <---
-                    final_results.append(step_result)
-                    continue # ---> Добавил continue здесь, чтобы не выполнять блок ниже
-
-                analysis_type = step.get("analysis_type")
-                if not analysis_type:
-                    step_result["status"] = "error"
-                    step_result["message"] = "Тип анализа не указан в шаге."
-                    app.logger.warning(f"Пропуск шага: {step_result['message']}")
-                    # ---> ИСПРАВЛЕНИЕ ОТСТУПА ЗДЕСЬ <---
-                    final_results.append(step_result)
-                    continue # ---> Добавил continue
-
-                app.logger.info(f"Выполнение шага: {analysis_type}")
-
-
-                # --- Логика выполнения ---
-                if analysis_type == "error":
-                     step_result["status"] = "skipped"
-                     step_result["message"] = step.get("message", "Шаг с ошибкой из плана LLM.")
-                     flash(f"Пропущен шаг плана (ошибка LLM): {step_result['message']}", "info")
-
-                elif analysis_type == "t-test":
-                    variable = step.get("variable")
-                    grouping_variable = step.get("grouping_variable")
-                    if variable and grouping_variable:
-                        error_msg = None
-                        if variable not in df.columns: error_msg = f"Столбец '{variable}' не найден."
-                        elif grouping_variable not in df.columns: error_msg = f"Столбец '{grouping_variable}' не найден."
-                        elif not pd.api.types.is_numeric_dtype(df[variable]): error_msg = f"Столбец '{variable}' не числовой."
-                        elif df[grouping_variable].nunique() != 2:
-                             groups = df[grouping_variable].dropna().unique()
-                             error_msg = f"Столбец '{grouping_variable}' должен иметь 2 группы (найдено {len(groups)}: {list(groups)})."
-
-                        if error_msg:
-                            step_result["status"] = "error"
-                            step_result["message"] = error_msg
-                            flash(f"Ошибка T-test (валидация): {error_msg}", "danger")
-                        else:
-                             result_data = perform_t_test(df, variable, grouping_variable)
-                             step_result["data"] = result_data
-                             step_result["status"] = "error" if result_data.get("error") else "success"
-                             if result_data.get("warning"): flash(f"Предупреждение T-test ({variable} по {grouping_variable}): {result_data['warning']}", "warning")
-                             if result_data.get("error"): flash(f"Ошибка T-test ({variable} по {grouping_variable}): {result_data['error']}", "danger")
-                    else:
-                         step_result["status"] = "error"; step_result["message"] = "Не указаны 'variable' или 'grouping_variable' для t-теста."
-                         flash(f"Ошибка конфигурации t-теста: {step_result['message']}", "warning")
-
-                elif analysis_type == "chi-square":
-                    variable1 = step.get("variable1")
-                    variable2 = step.get("variable2")
-                    if variable1 and variable2:
-                        error_msg = None
-                        if variable1 not in df.columns: error_msg = f"Столбец '{variable1}' не найден."
-                        elif variable2 not in df.columns: error_msg = f"Столбец '{variable2}' не найден."
-                        elif variable1 == variable2: error_msg = "Нужны два разных столбца."
-
-                        if error_msg:
-                             step_result["status"] = "error"; step_result["message"] = error_msg
-                             flash(f"Ошибка Chi-square (валидация): {error_msg}", "danger")
-                        else:
-                            result_data = perform_chi_square(df, variable1, variable2)
-                            step_result["data"] = result_data
-                            step_result["status"] = "error" if result_data.get("error") else "success"
-                            if result_data.get("warning"): flash(f"Предупреждение Chi-Square ({variable1} vs {variable2}): {result_data['warning']}", "warning")
-                            if result_data.get("error"): flash(f"Ошибка Chi-Square ({variable1} vs {variable2}): {result_data['error']}", "danger")
-                    else:
-                         step_result["status"] = "error"; step_result["message"] = "Не указаны 'variable1' или 'variable2' для хи-квадрат."
-                         flash(f"Ошибка конфигурации хи-квадрат: {step_result['message']}", "warning")
-
-                elif analysis_type == "descriptive_stats":
-                    variable = step.get("variable")
-                    if variable:
-                        if variable not in df.columns:
-                             step_result["status"] = "error"; step_result["message"] = f"Столбец '{variable}' не найден."
-                             flash(f"Ошибка опис. стат. (валидация): {step_result['message']}", "danger")
-                        else:
-                             result_data = get_descriptive_stats(df, variable)
-                             step_result["data"] = result_data
-                             step_result["status"] = "error" if result_data.get("error") else "success"
-                             if result_data.get("warning"): flash(f"Предупреждение опис. стат. ({variable}): {result_data['warning']}", "warning")
-                             if result_data.get("error"): flash(f"Ошибка опис. стат. ({variable}): {result_data['error']}", "danger")
-                    else:
-                        step_result["status"] = "error"; step_result["message"] = "Не указана 'variable' для описательных статистик."
-                        flash(f"Ошибка конфигурации опис. стат.: {step_result['message']}", "warning")
-
-                else:
-                    step_result["status"] = "skipped"
-                    step_result["message"] = f"Неизвестный тип анализа '{analysis_type}' в плане."
-                    flash(f"Пропущен шаг: Неизвестный тип анализа '{analysis_type}'", "info")
-                    app.logger.warning(f"Пропущен шаг с неизвестным типом анализа: {analysis_type}")
-
-            # --- Блок except для ошибок выполнения шага ---
-            except Exception as step_e:
-                 error_traceback_step = traceback.format_exc()
-                 app.logger.error(f"Ошибка при выполнении шага {step}: {step_e}\n{error_traceback_step}")
-                 step_result["status"] = "error"
-                 step_result["message"] = f"Внутренняя ошибка сервера при выполнении шага: {step_e}"
-                 flash(f"Ошибка при выполнении шага ({step.get('analysis_type', 'N/A')}): {step_e}", "danger")
-
-            # ---> ИСПРАВЛЕНИЕ ОТСТУПА ЗДЕСЬ <---
-            # Эта строка должна выполняться ПОСЛЕ try/except, но ВНУТРИ цикла for
-            final_results.append(step_result)
-        # --- Конец цикла обработки шагов ---
-
-        # ... (остальная часть функции execute_plan без изменений: подсчет результатов, flash, рендеринг) ...
-        num_steps = len(proposed_plan)
-        num_success = sum(1 for r in final_results if r.get("status") == "success")
-        num_errors = sum(1 for r in final_results if r.get("status") == "error")
-        num_skipped = sum(1 for r in final_results if r.get("status") == "skipped")
-
-        summary_message = f"Анализ завершен. Всего шагов в плане: {num_steps}. Успешно: {num_success}."
-        if num_errors > 0: summary_message += f" С ошибками: {num_errors}."
-        if num_skipped > 0: summary_message += f" Пропущено: {num_skipped}."
-
-        flash_category = "success" if num_errors == 0 and num_skipped == 0 else ("warning" if num_errors > 0 else "info")
+                if request.form.get('mode') == 'preview':
+                    discard_exact_run(session.get('exact_job_id'))
+                    session['exact_job_id'] = start_exact_run(df, proposed_plan, strata_variable)
+                    preview = run_preview(df, proposed_plan, strata_variable)
+                    app.logger.info(f"Предпросмотр на {preview['sample_rows']} из {preview['total_rows']} строк, точный расчет запущен в фоне.")
+                    return render_template('results.html', analysis_results=preview['results'], preview=preview,
+                                           exact_job_id=session['exact_job_id'])
+
+                # Через очередь с квотой на сессию и лимитами времени/памяти (utils.scheduler)
+                final_results = run_plan(df, proposed_plan, strata_variable)
+            except SchedulerBusy as e:
+                flash(f"{e} Файл сохранен - можно запустить анализ повторно.", "warning")
+                keep_file = True
+                return render_template('confirm_plan.html', proposed_plan=proposed_plan,
+                                       strata_candidates=session.get('confirmed_columns', []))
+
+        summary_message, flash_category = summarize_results(final_results, len(proposed_plan))
         flash(summary_message, flash_category)
         app.logger.info(summary_message)
 
@@ -382,13 +417,54 @@ def execute_plan():
 
     finally:
         # Окончательная очистка файла
-        final_filepath = session.pop('filepath', filepath)
+        final_filepath = session.pop('filepath', filepath) if not keep_file else None
         if final_filepath:
             cleanup_file(final_filepath)
-        else:
+        elif not keep_file:
             app.logger.warning("Не найден путь к файлу для очистки в finally execute_plan.")
 
 
+@app.route('/analyze/exact_results/<job_id>', methods=['GET'])
+def exact_results(job_id):
+    """
+    Точные результаты после предпросмотра: 202 (JSON) пока расчет идет,
+    затем страница результатов (страница предпросмотра подменяет ими свое содержимое).
+    """
+    if job_id != session.get('exact_job_id'):
+        return jsonify({"status": "not_found", "error": "Расчет не найден для текущего анализа."}), 404
+    outcome = get_exact_run(job_id)
+    if outcome is None:
+        return jsonify({"status": "not_found", "error": "Расчет не найден или устарел. Выполните анализ заново."}), 404
+    if outcome["status"] == "pending":
+        return jsonify({"status": "pending"}), 202, {"Retry-After": "1"}
+    if outcome["status"] == "error":
+        return jsonify({"status": "error", "error": outcome["error"]}), 500
+
+    for message in outcome["messages"]:
+        flash(message["message"], message["category"])
+    flash(outcome["summary"]["message"], outcome["summary"]["category"])
+    discard_exact_run(session.pop('exact_job_id', None))
+    return render_template('results.html', analysis_results=outcome["results"])
+
+
+@app.route(PLOT_URL_PREFIX + '<plot_id>', methods=['GET'])
+def plot_image(plot_id):
+    """Изображение графика из хранилища: полный размер или миниатюра (?tier=thumb)."""
+    tier = 'thumb' if request.args.get('tier') == 'thumb' else 'full'
+    image = get_stored_plot(plot_id, tier)
+    if image is None:
+        return "График не найден или устарел.", 404
+    data, headers = image["data"], {"Vary": "Accept-Encoding"}
+    if image["encoding"] == 'gzip':
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            headers["Content-Encoding"] = 'gzip'
+        else:
+            data = gzip.decompress(data)
+    # id - хеш содержимого, поэтому ответ можно кешировать без перепроверки
+    headers["Cache-Control"] = 'private, max-age=86400, immutable'
+    return app.response_class(data, mimetype=image["mimetype"], headers=headers)
+
+
 if __name__ == '__main__':
     # Рекомендуется установить debug=False для production
     app.run(debug=os.getenv('FLASK_DEBUG', 'False').lower() == 'true',
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+ASGI-режим: представления, ожидающие LLM, выполняются на event loop.
+
+Запуск:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+Представления, помеченные utils.flow.flow_view (этапы 0 и 1 HTML-интерфейса и
+JSON API), исполняются как корутины: запрос к Gemini идет через
+generate_content_async и не занимает поток, CPU-работа (разбор файла, профиль)
+выполняется в пуле ASGI_CPU_THREADS. Остальные маршруты (выполнение плана,
+статистика, графики, /metrics) вызываются как обычное WSGI-приложение в пуле
+ASGI_WSGI_THREADS - вне event loop.
+
+Тело запроса читается до MAX_CONTENT_LENGTH (больше - ответ 413 без дочитывания);
+если клиент отключился до конца тела, запрос не обрабатывается.
+
+asgiref.WsgiToAsgi здесь не используется: он направляет все WSGI-вызовы в один
+поток (thread_sensitive), и CPU-тяжелые запросы выполнялись бы строго по очереди.
+"""
+import asyncio
+import contextvars
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import request
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+
+from app import app
+from utils.flow import run_flow_async
+
+_wsgi_executor = ThreadPoolExecutor(max_workers=int(os.getenv('ASGI_WSGI_THREADS', 8)),
+                                    thread_name_prefix="statonco-wsgi")
+_cpu_executor = ThreadPoolExecutor(max_workers=int(os.getenv('ASGI_CPU_THREADS', 4)),
+                                   thread_name_prefix="statonco-cpu")
+
+_STREAM_END = object()
+
+
+def _build_environ(scope: dict, body: bytes) -> dict:
+    """WSGI environ (PEP 3333) из ASGI scope HTTP-запроса."""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+async def _read_body(receive, limit: int | None) -> bytes | None:
+    """
+    Тело запроса целиком; None - клиент отключился до конца тела.
+    Raises:
+        _BodyTooLarge: тело больше limit (MAX_CONTENT_LENGTH) - дальше не читается.
+    """
+    chunks, size = [], 0
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if limit is not None and size > limit:
+            raise _BodyTooLarge()
+        chunks.append(chunk)
+        more_body = message.get('more_body', False)
+    return b"".join(chunks)
+
+
+def _declared_length(scope: dict) -> int | None:
+    for name, value in scope.get('headers', []):
+        if name.lower() == b'content-length':
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+async def _send_too_large(send):
+    response = RequestEntityTooLarge().get_response()
+    await _send_response(send, response.status_code, response.headers.to_wsgi_list(),
+                         _single_chunk(response.get_data()))
+
+
+def _flow_for(environ: dict):
+    """Генератор представления (utils.flow) для маршрута запроса или None."""
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return None
+    return getattr(app.view_functions.get(endpoint), 'flow', None)
+
+
+async def _send_response(send, status: int, headers: list, chunks):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers],
+    })
+    async for chunk in chunks:
+        if chunk:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def _single_chunk(body: bytes):
+    yield body
+
+
+async def _run_flow(flow, environ: dict, send):
+    """
+    Исполняет представление-генератор на event loop внутри контекста запроса Flask
+    (before/after_request, сессия, обработчики ошибок - как в обычном запросе).
+    """
+    with app.request_context(environ):
+        try:
+            # Та же последовательность, что в Flask.full_dispatch_request / wsgi_app
+            try:
+                rv = app.preprocess_request()
+                if rv is None:
+                    rv = await run_flow_async(flow(**request.view_args), _cpu_executor)
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            response = app.finalize_request(rv)
+        except Exception as e:
+            response = app.handle_exception(e)
+        app_iter, status, headers = response.get_wsgi_response(environ)
+        body = b"".join(app_iter)
+    await _send_response(send, int(status.split(' ', 1)[0]), headers, _single_chunk(body))
+
+
+async def _run_wsgi(environ: dict, send):
+    """
+    Обычное WSGI-приложение в пуле потоков. Тело ответа читается по частям в том же
+    контексте contextvars, чтобы потоковые ответы (stream_with_context) работали.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.Context()
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'], started['headers'] = status, headers
+        return lambda data: None
+
+    def call_app():
+        return iter(app(environ, start_response))
+
+    def next_chunk(iterator):
+        return next(iterator, _STREAM_END)
+
+    iterator = await loop.run_in_executor(_wsgi_executor, context.run, call_app)
+    # start_response может быть вызван при получении первого фрагмента (генераторы)
+    first = await loop.run_in_executor(_wsgi_executor, context.run, next_chunk, iterator)
+
+    async def chunks():
+        try:
+            chunk = first
+            while chunk is not _STREAM_END:
+                yield chunk
+                chunk = await loop.run_in_executor(_wsgi_executor, context.run, next_chunk, iterator)
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                await loop.run_in_executor(_wsgi_executor, context.run, close)
+
+    await _send_response(send, int(started['status'].split(' ', 1)[0]), started['headers'], chunks())
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            _wsgi_executor.shutdown(wait=False, cancel_futures=True)
+            _cpu_executor.shutdown(wait=False, cancel_futures=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI-приложение StatOnco."""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        raise RuntimeError(f"Неподдерживаемый тип ASGI scope: {scope['type']}")
+
+    limit = app.config.get('MAX_CONTENT_LENGTH')
+    declared = _declared_length(scope)
+    if limit is not None and declared is not None and declared > limit:
+        await _send_too_large(send)
+        return
+    try:
+        body = await _read_body(receive, limit)
+    except _BodyTooLarge:
+        await _send_too_large(send)
+        return
+    if body is None:
+        return  # клиент отключился: ответ некому отправлять
+    environ = _build_environ(scope, body)
+    flow = _flow_for(environ)
+    if flow is not None:
+        await _run_flow(flow, environ, send)
+    else:
+        await _run_wsgi(environ, send)
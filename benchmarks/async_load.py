@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный тест: пропускная способность WSGI и ASGI-режима при медленной LLM.
+
+Запуск из корня репозитория:
+    python -m benchmarks.async_load --llm-latency 1.0 --wsgi-workers 4 --concurrency 1 4 16 64
+
+Оба режима работают в процессе, без сети, с заглушкой LLM (utils.llm_backends.StubBackend),
+имитирующей задержку Gemini. WSGI - пул из --wsgi-workers потоков, как синхронные
+воркеры gunicorn: каждый ждущий LLM запрос занимает воркер. ASGI - приложение
+asgi.application, в которое одновременно отправляется --concurrency запросов.
+Для каждого уровня конкурентности печатаются пропускная способность и p50/p95 задержки.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Ключ нужен только для проверки в llm_handler, реальные запросы не отправляются
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-stub")
+
+from app import app  # noqa: E402
+from asgi import application  # noqa: E402
+
+from benchmarks.synthetic import make_synthetic_frame, write_workbook  # noqa: E402
+from utils.llm_backends import StubBackend, use_backend  # noqa: E402
+
+ENDPOINTS = ("plans", "suggestions")
+
+
+def _request_body(endpoint: str, columns: list[str]) -> bytes:
+    body = {"query": "Сравнить num_0 между группами"}
+    if endpoint == "plans":
+        body["confirmed_columns"] = columns
+    return json.dumps(body, ensure_ascii=False).encode('utf-8')
+
+
+def _summary(mode: str, concurrency: int, timings: list[float], errors: int, elapsed: float) -> dict:
+    arr = np.array(timings) * 1000 if timings else np.array([0.0])
+    return {
+        "mode": mode, "concurrency": concurrency, "requests": len(timings) + errors, "errors": errors,
+        "throughput_rps": len(timings) / elapsed if elapsed else 0.0,
+        "p50_ms": float(np.percentile(arr, 50)), "p95_ms": float(np.percentile(arr, 95)),
+    }
+
+
+def run_wsgi(path: str, body: bytes, concurrency: int, total: int, workers: int) -> dict:
+    """
+    concurrency клиентов шлют запросы через test_client; семафор на workers мест
+    моделирует синхронные воркеры: пока воркер ждет LLM, следующий запрос стоит в очереди.
+    """
+    client = app.test_client()
+    gate = threading.BoundedSemaphore(workers)
+
+    def one(_):
+        start = time.perf_counter()
+        with gate:
+            response = client.post(path, data=body, content_type='application/json')
+        return time.perf_counter() - start, response.status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(one, range(total)))
+        elapsed = time.perf_counter() - start
+    timings = [t for t, status in results if status < 400]
+    return _summary("wsgi", concurrency, timings, len(results) - len(timings), elapsed)
+
+
+async def _asgi_request(path: str, body: bytes) -> tuple[float, int]:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 0), "server": ("localhost", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    status = {}
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    start = time.perf_counter()
+    await application(scope, receive, send)
+    return time.perf_counter() - start, status.get("code", 500)
+
+
+async def _run_asgi(path: str, body: bytes, concurrency: int, total: int) -> dict:
+    queue = list(range(total))
+    results = []
+
+    async def client():
+        while queue:
+            queue.pop()
+            results.append(await _asgi_request(path, body))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    timings = [t for t, status in results if status < 400]
+    return _summary("asgi", concurrency, timings, len(results) - len(timings), elapsed)
+
+
+def run_asgi(path: str, body: bytes, concurrency: int, total: int) -> dict:
+    return asyncio.run(_run_asgi(path, body, concurrency, total))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест WSGI vs ASGI с медленной LLM-заглушкой.")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="plans", help="Этап API под нагрузкой.")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Задержка LLM-заглушки, с.")
+    parser.add_argument("--wsgi-workers", type=int, default=4, help="Число синхронных воркеров WSGI.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests-per-client", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    app.config['SPECULATIVE_PLANNING'] = False  # каждый запрос плана должен доходить до LLM
+    df = make_synthetic_frame(rows=args.rows, numeric_cols=5, categorical_cols=3, missing_rate=0.05,
+                              cardinality=4, seed=0)
+    columns = ["group", "num_0"]
+    restore = use_backend(app, StubBackend(
+        latency_s=args.llm_latency, suggestions={"suggested_columns": columns, "questions_to_user": []},
+        plan=[{"analysis_type": "t-test", "variable": "num_0", "grouping_variable": "group"}]))
+    reports = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            workbook_path = write_workbook(df, os.path.join(tmp, "load.xlsx"))
+            with open(workbook_path, "rb") as f:
+                created = app.test_client().post('/api/v1/datasets', data={"file": (f, "load.xlsx")},
+                                                 content_type='multipart/form-data')
+            dataset_id = created.get_json()["id"]
+            path = f"/api/v1/datasets/{dataset_id}/{args.endpoint}"
+            body = _request_body(args.endpoint, columns)
+            # Прогрев: профиль набора данных строится при первом запросе предложений
+            app.test_client().post(f"/api/v1/datasets/{dataset_id}/suggestions", data=_request_body("suggestions", columns),
+                                   content_type='application/json')
+
+            for concurrency in args.concurrency:
+                total = concurrency * args.requests_per_client
+                for report in (run_wsgi(path, body, concurrency, total, args.wsgi_workers),
+                               run_asgi(path, body, concurrency, total)):
+                    reports.append(report)
+                    print(f"  {report['mode']} c={concurrency}: {report['throughput_rps']:.2f} rps", file=sys.stderr)
+            app.test_client().delete(f"/api/v1/datasets/{dataset_id}")
+    finally:
+        restore()
+
+    header = f"{'mode':<6} {'conc':>5} {'reqs':>5} {'errors':>6} {'rps':>8} {'p50 ms':>10} {'p95 ms':>10}"
+    print(f"endpoint={args.endpoint} llm_latency={args.llm_latency}s wsgi_workers={args.wsgi_workers}")
+    print(header)
+    print("-" * len(header))
+    for r in reports:
+        print(f"{r['mode']:<6} {r['concurrency']:>5} {r['requests']:>5} {r['errors']:>6} "
+              f"{r['throughput_rps']:>8.2f} {r['p50_ms']:>10.1f} {r['p95_ms']:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP-заглушка LLM для нагрузочного тестирования развернутого приложения.
+
+Запуск из корня репозитория:
+    python -m benchmarks.llm_stub_server --port 8090 --latency 2.0 --jitter 0.5 --error-rate 0.01 --rate-limit-rate 0.05
+
+Приложение подключается к ней через LLM_BACKEND=http и LLM_STUB_URL=http://127.0.0.1:8090/generate.
+POST /generate {"prompt": ...} -> {"text": JSON-ответ}; имитируемые ошибки отдаются кодами 429 и 500.
+Ответы строит та же логика, что и у LLM_BACKEND=stub (utils.llm_backends.StubBackend).
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from google.api_core import exceptions as google_api_exceptions
+
+from utils.llm_backends import StubBackend
+
+
+def make_handler(backend: StubBackend):
+    lock = threading.Lock()  # random.Random заглушки общий для потоков сервера
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, payload: dict):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path != '/generate':
+                self._reply(404, {"error": "not found"})
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                prompt = json.loads(self.rfile.read(length).decode('utf-8'))["prompt"]
+            except (ValueError, KeyError) as e:
+                self._reply(400, {"error": f"Ожидается JSON с полем 'prompt': {e}"})
+                return
+            with lock:
+                delay = backend.delay()
+            time.sleep(delay)
+            try:
+                with lock:
+                    response = backend.respond(prompt)
+            except google_api_exceptions.GoogleAPIError as e:
+                self._reply(e.code or 500, {"error": str(e)})
+                return
+            self._reply(200, {"text": response.text})
+
+        def log_message(self, format, *args):
+            pass  # без строки лога на каждый запрос: под нагрузкой это заметные накладные расходы
+
+    return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP-заглушка LLM для нагрузочных тестов.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=1.0, help="Средняя задержка ответа, с.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Разброс задержки (равномерный, ±), с.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 500.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Доля ответов 429.")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    backend = StubBackend(latency_s=args.latency, jitter_s=args.jitter, error_rate=args.error_rate,
+                          rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(backend))
+    print(f"Заглушка LLM: http://{args.host}:{args.port}/generate (задержка {args.latency}±{args.jitter} с, "
+          f"ошибки {args.error_rate:.1%}, 429 {args.rate_limit_rate:.1%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
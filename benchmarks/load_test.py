@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный тест всего трехэтапного сценария HTML-интерфейса.
+
+Каждый виртуальный пользователь проходит /analyze/start -> /analyze/confirm_columns
+-> /analyze/execute_plan (со своей сессией) --iterations раз. В отчете - пропускная
+способность (завершенные сценарии в секунду), p50/p95/p99 задержки по этапам и доли
+ошибок с разбивкой по причинам (HTTP, ошибка LLM, 429 от LLM, неожиданная страница).
+
+В процессе (по умолчанию): приложение вызывается через test_client, LLM - заглушка
+LLM_BACKEND=stub с параметрами --llm-latency/--llm-jitter/--llm-error-rate/--llm-rate-limit-rate:
+    python -m benchmarks.load_test --users 16 --iterations 3 --llm-latency 1.0 --llm-rate-limit-rate 0.05
+
+Против запущенного сервера (LLM_BACKEND=stub или http с benchmarks.llm_stub_server):
+    python -m benchmarks.load_test --url http://127.0.0.1:5000 --users 32 --iterations 5
+"""
+import argparse
+import html
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Ключ нужен только для проверки в llm_handler, реальные запросы не отправляются
+os.environ.setdefault("GEMINI_API_KEY", "load-test-stub")
+
+from benchmarks.synthetic import make_synthetic_frame, write_workbook  # noqa: E402
+
+STAGES = ("start", "confirm_columns", "execute_plan")
+# Маркеры страниц, которыми должен завершиться каждый этап (заголовки шаблонов)
+_EXPECTED_PAGE = {
+    "start": "(Этап 1: Подтверждение столбцов)",
+    "confirm_columns": "(Этап 2: Подтверждение плана)",
+    "execute_plan": "(Этап 3: Результаты)",
+}
+_CHECKED_COLUMN_RE = re.compile(r'name="confirmed_columns"\s+value="([^"]*)"\s+checked')
+
+
+class _InProcessClient:
+    """Клиент через Flask test_client (своя cookie-сессия на пользователя)."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def post(self, path: str, data: dict, workbook_path: str | None = None) -> tuple[int, str]:
+        if workbook_path:
+            with open(workbook_path, "rb") as f:
+                response = self.client.post(path, data={**data, "file": (f, "load_test.xlsx")},
+                                            content_type='multipart/form-data')
+        else:
+            response = self.client.post(path, data=data)
+        return response.status_code, response.get_data(as_text=True)
+
+
+class _HttpClient:
+    """Клиент к запущенному серверу (requests.Session, редиректы не отслеживаются)."""
+
+    def __init__(self, base_url: str):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def post(self, path: str, data: dict, workbook_path: str | None = None) -> tuple[int, str]:
+        url = self.base_url + path
+        if workbook_path:
+            with open(workbook_path, "rb") as f:
+                response = self.session.post(url, data=data, files={"file": ("load_test.xlsx", f)},
+                                             allow_redirects=False, timeout=600)
+        else:
+            response = self.session.post(url, data=data, allow_redirects=False, timeout=600)
+        return response.status_code, response.text
+
+
+def classify(stage: str, status: int, text: str) -> str:
+    """Исход этапа: 'ok' или причина ошибки."""
+    if 300 <= status < 400:
+        return "redirect"  # представления перенаправляют на главную при ошибке этапа
+    if status >= 400:
+        return f"http_{status}"
+    if "Ошибка LLM" in text:
+        return "llm_rate_limited" if "429" in text else "llm_error"
+    if _EXPECTED_PAGE[stage] not in text:
+        return "unexpected_page"
+    return "ok"
+
+
+class LoadTest:
+    def __init__(self, make_client, workbook_path: str, query: str, think_time_s: float):
+        self.make_client = make_client
+        self.workbook_path = workbook_path
+        self.query = query
+        self.think_time_s = think_time_s
+        self.lock = threading.Lock()
+        self.latencies = {stage: [] for stage in STAGES}
+        self.outcomes = {stage: Counter() for stage in STAGES}
+        self.flows_completed = 0
+        self.flows_failed = 0
+
+    def _record(self, stage: str, duration: float, outcome: str):
+        with self.lock:
+            self.latencies[stage].append(duration)
+            self.outcomes[stage][outcome] += 1
+
+    def _step(self, client, stage: str, path: str, data: dict, workbook: bool = False) -> str | None:
+        start = time.perf_counter()
+        try:
+            status, text = client.post(path, data, self.workbook_path if workbook else None)
+            outcome = classify(stage, status, text)
+        except Exception as e:
+            text, outcome = None, f"exception_{type(e).__name__}"
+        self._record(stage, time.perf_counter() - start, outcome)
+        return text if outcome == "ok" else None
+
+    def flow(self, client) -> bool:
+        page = self._step(client, "start", "/analyze/start", {"query": self.query}, workbook=True)
+        if page is None:
+            return False
+        columns = [html.unescape(c) for c in _CHECKED_COLUMN_RE.findall(page)]
+        time.sleep(self.think_time_s)
+        if self._step(client, "confirm_columns", "/analyze/confirm_columns", {"confirmed_columns": columns}) is None:
+            return False
+        time.sleep(self.think_time_s)
+        return self._step(client, "execute_plan", "/analyze/execute_plan", {}) is not None
+
+    def user(self, iterations: int):
+        client = self.make_client()
+        for _ in range(iterations):
+            ok = self.flow(client)
+            with self.lock:
+                if ok:
+                    self.flows_completed += 1
+                else:
+                    self.flows_failed += 1
+
+    def run(self, users: int, iterations: int, ramp_up_s: float) -> dict:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=users) as pool:
+            futures = []
+            for i in range(users):
+                futures.append(pool.submit(self.user, iterations))
+                if ramp_up_s and users > 1:
+                    time.sleep(ramp_up_s / (users - 1))
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - start
+        return self.report(users, iterations, elapsed)
+
+    def report(self, users: int, iterations: int, elapsed: float) -> dict:
+        stages = {}
+        for stage in STAGES:
+            timings = np.array(self.latencies[stage]) * 1000
+            total = len(timings)
+            errors = total - self.outcomes[stage]["ok"]
+            stages[stage] = {
+                "requests": total,
+                "error_rate": errors / total if total else 0.0,
+                "errors": {k: v for k, v in self.outcomes[stage].items() if k != "ok"},
+                "p50_ms": float(np.percentile(timings, 50)) if total else None,
+                "p95_ms": float(np.percentile(timings, 95)) if total else None,
+                "p99_ms": float(np.percentile(timings, 99)) if total else None,
+                "max_ms": float(timings.max()) if total else None,
+            }
+        flows = self.flows_completed + self.flows_failed
+        return {
+            "users": users, "iterations": iterations, "elapsed_s": elapsed,
+            "flows": flows, "flows_completed": self.flows_completed,
+            "flow_error_rate": self.flows_failed / flows if flows else 0.0,
+            "throughput_flows_per_s": self.flows_completed / elapsed if elapsed else 0.0,
+            "stages": stages,
+        }
+
+
+def print_report(report: dict):
+    print(f"users={report['users']} iterations={report['iterations']} elapsed={report['elapsed_s']:.1f}s "
+          f"flows={report['flows']} completed={report['flows_completed']} "
+          f"flow_error_rate={report['flow_error_rate']:.1%} throughput={report['throughput_flows_per_s']:.2f} flows/s")
+    header = f"{'stage':<16} {'reqs':>5} {'err %':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}  errors"
+    print(header)
+    print("-" * len(header))
+    for stage, m in report["stages"].items():
+        if not m["requests"]:
+            print(f"{stage:<16} {0:>5}")
+            continue
+        errors = ", ".join(f"{k}={v}" for k, v in sorted(m["errors"].items())) or "-"
+        print(f"{stage:<16} {m['requests']:>5} {m['error_rate']:>6.1%} {m['p50_ms']:>9.1f} {m['p95_ms']:>9.1f} "
+              f"{m['p99_ms']:>9.1f} {m['max_ms']:>9.1f}  {errors}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест сценария start -> confirm_columns -> execute_plan.")
+    parser.add_argument("--url", help="Адрес запущенного сервера; без него приложение вызывается в процессе.")
+    parser.add_argument("--users", type=int, default=8, help="Число одновременных пользователей.")
+    parser.add_argument("--iterations", type=int, default=2, help="Сценариев на пользователя.")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Время запуска всех пользователей, с.")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Пауза пользователя между этапами, с.")
+    parser.add_argument("--query", default="Сравнить num_0 между группами")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--numeric-cols", type=int, default=10)
+    parser.add_argument("--categorical-cols", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="(в процессе) задержка заглушки LLM, с.")
+    parser.add_argument("--llm-jitter", type=float, default=0.0, help="(в процессе) разброс задержки, с.")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="(в процессе) доля ошибок 500.")
+    parser.add_argument("--llm-rate-limit-rate", type=float, default=0.0, help="(в процессе) доля ответов 429.")
+    parser.add_argument("--json", metavar="PATH", help="Сохранить отчет в JSON.")
+    args = parser.parse_args(argv)
+
+    if args.url:
+        def make_client():
+            return _HttpClient(args.url)
+    else:
+        from app import app
+        app.config.update(LLM_BACKEND='stub', LLM_STUB_LATENCY_S=args.llm_latency, LLM_STUB_JITTER_S=args.llm_jitter,
+                          LLM_STUB_ERROR_RATE=args.llm_error_rate, LLM_STUB_RATE_LIMIT_RATE=args.llm_rate_limit_rate)
+
+        def make_client():
+            return _InProcessClient(app)
+
+    df = make_synthetic_frame(rows=args.rows, numeric_cols=args.numeric_cols, categorical_cols=args.categorical_cols,
+                              missing_rate=0.05, cardinality=4, seed=0)
+    with tempfile.TemporaryDirectory() as tmp:
+        workbook_path = write_workbook(df, os.path.join(tmp, "load_test.xlsx"))
+        test = LoadTest(make_client, workbook_path, args.query, args.think_time)
+        report = test.run(args.users, args.iterations, args.ramp_up)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Размер и время построения графиков в разных режимах вывода (utils.plot_utils.plot_output)
+на представительном плане: описательные (гистограмма, частоты), t-тест (box plot),
+хи-квадрат (столбцы), корреляционная матрица (тепловая карта), выживаемость (Каплан-Мейер).
+
+    python -m benchmarks.plot_formats --rows 5000 --repeat 3
+
+Режимы:
+    png (текущий)      - PNG в data URI;
+    webp / auto inline - WebP без потерь (auto - по типу графика) в data URI, как для API;
+    auto tiers         - страница результатов: на странице URL и миниатюры, полный размер по клику.
+Для auto tiers "на странице" - миниатюры (SVG - сжатым gzip, как отдает /plots/<id>),
+"полные" - все изображения полного размера, если открыть каждое.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-stub")
+
+from app import app  # noqa: E402
+from utils.pipeline import execute_analysis_plan  # noqa: E402
+from utils.plot_utils import plot_output, get_stored_plot, PLOT_URL_PREFIX  # noqa: E402
+
+from benchmarks.synthetic import make_synthetic_frame  # noqa: E402
+
+MODES = {
+    "png (текущий)": {"format": "png", "tiers": False},
+    "webp inline": {"format": "webp", "tiers": False},
+    "auto inline": {"format": "auto", "tiers": False},
+    "auto tiers": {"format": "auto", "tiers": True},
+}
+
+
+def representative_plan(numeric_cols: list[str]) -> list[dict]:
+    return [
+        {"analysis_type": "descriptive_stats", "variable": "num_0"},
+        {"analysis_type": "descriptive_stats", "variable": "cat_0"},
+        {"analysis_type": "t-test", "variable": "num_1", "grouping_variable": "group"},
+        {"analysis_type": "chi-square", "variable1": "cat_1", "variable2": "group"},
+        {"analysis_type": "correlation_matrix", "variables": numeric_cols},
+        {"analysis_type": "survival", "time_variable": "_time", "event_variable": "_event", "grouping_variable": "cat_2"},
+    ]
+
+
+def _plot_sizes(plot_data: str) -> tuple[int, int]:
+    """(байт на странице, байт полного изображения) для одного графика."""
+    if not plot_data.startswith(PLOT_URL_PREFIX):
+        return len(plot_data), len(plot_data)
+    plot_id = plot_data[len(PLOT_URL_PREFIX):]
+    thumb, full = get_stored_plot(plot_id, "thumb"), get_stored_plot(plot_id)
+    return len(plot_data) + len(thumb["data"]), len(full["data"])
+
+
+def measure(df, plan: list, settings: dict, repeat: int) -> dict:
+    timings, results = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with plot_output(thumbnails=False, **settings):
+            results = execute_analysis_plan(df, plan)
+        timings.append(time.perf_counter() - start)
+    per_type = {}
+    for step, result in zip(plan, results):
+        plot_data = (result.get("data") or {}).get("plot_data")
+        if plot_data:
+            per_type[step["analysis_type"] + ("" if step["analysis_type"] != "descriptive_stats" else f"({step['variable']})")] = _plot_sizes(plot_data)
+    return {"ms": float(np.median(timings)) * 1000, "per_type": per_type,
+            "page": sum(page for page, _ in per_type.values()), "full": sum(full for _, full in per_type.values())}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Размер и время графиков в разных форматах вывода.")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--numeric-cols", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    df = make_synthetic_frame(rows=args.rows, numeric_cols=args.numeric_cols, categorical_cols=3, missing_rate=0.05, seed=0)
+    df = df.assign(_time=df["num_0"].abs(), _event=(df["num_1"] > 50).astype(int))
+    numeric_cols = [col for col in df.columns if col.startswith("num_")]
+    plan = representative_plan(numeric_cols)
+
+    with app.test_request_context('/'):
+        rows = {mode: measure(df, plan, settings, args.repeat) for mode, settings in MODES.items()}
+
+    baseline = rows["png (текущий)"]
+    print(f"{'mode':<15} {'plan ms':>8} {'page KiB':>9} {'vs png':>7} {'full KiB':>9}")
+    for mode, row in rows.items():
+        print(f"{mode:<15} {row['ms']:>8.0f} {row['page'] / 1024:>9.1f} {row['page'] / baseline['page']:>7.2f} "
+              f"{row['full'] / 1024:>9.1f}")
+    print()
+    print(f"{'plot':<32}" + "".join(f"{mode:>16}" for mode in rows))
+    for plot in baseline["per_type"]:
+        print(f"{plot:<32}" + "".join(f"{rows[mode]['per_type'][plot][0] / 1024:>12.1f} KiB" for mode in rows))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Сравнение размера промпта этапа 0 и задержки LLM-заглушки: полный список столбцов
+против компактного блока (utils.prompt_builder) для разной ширины таблиц.
+
+    python -m benchmarks.prompt_compaction --widths 50 200 400 800 --budget 2000
+
+Задержка заглушки: --base-latency + --latency-per-1k-tokens * (токены промпта / 1000).
+"""
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-stub")
+
+from app import app  # noqa: E402
+from utils.llm_handler import get_initial_assessment  # noqa: E402
+from utils.pipeline import profile_dataframe  # noqa: E402
+from utils.prompt_builder import estimate_tokens  # noqa: E402
+
+from benchmarks.synthetic import make_synthetic_frame  # noqa: E402
+from utils.llm_backends import StubBackend, use_backend  # noqa: E402
+
+QUERY = "Сравни num_3 между группами group и оцени связь cat_1 с group"
+
+
+def measure_width(width: int, args) -> dict:
+    df = make_synthetic_frame(rows=args.rows, numeric_cols=width // 2, categorical_cols=width - width // 2,
+                              missing_rate=args.missing_rate, seed=width)
+    profile = profile_dataframe(df)
+    suggestions = {"suggested_columns": ["num_3", "group", "cat_1"], "questions_to_user": []}
+    row = {"width": width}
+    for label, column_profile in (("full", None), ("compact", profile["column_profile"])):
+        calls = []
+        restore = use_backend(app, StubBackend(latency_s=args.base_latency, suggestions=suggestions, plan=[],
+                                               latency_per_1k_tokens_s=args.latency_per_1k_tokens, calls=calls))
+        try:
+            start = time.perf_counter()
+            get_initial_assessment(QUERY, profile["columns_to_display"], profile["missing_info_str"],
+                                   column_profile=column_profile)
+            row[f"{label}_ms"] = (time.perf_counter() - start) * 1000
+        finally:
+            restore()
+        row[f"{label}_chars"] = len(calls[-1])
+        row[f"{label}_tokens"] = estimate_tokens(calls[-1])
+        if column_profile is not None:
+            # Проверяем, что упомянутые в запросе столбцы не были отброшены
+            row["query_columns_kept"] = all(f"\n{name}|" in calls[-1] for name in ("num_3", "group", "cat_1"))
+    return row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Эффект компактного описания столбцов в промпте этапа 0.")
+    parser.add_argument("--widths", type=int, nargs="+", default=[50, 200, 400, 800])
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--missing-rate", type=float, default=0.15)
+    parser.add_argument("--budget", type=int, default=2000, help="LLM_COLUMN_TOKEN_BUDGET.")
+    parser.add_argument("--base-latency", type=float, default=0.05)
+    parser.add_argument("--latency-per-1k-tokens", type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    app.config['LLM_COLUMN_TOKEN_BUDGET'] = args.budget
+    print(f"{'cols':>5} {'full tok':>9} {'compact tok':>12} {'ratio':>6} {'full ms':>9} {'compact ms':>11} {'query cols kept':>16}")
+    with app.test_request_context('/'):
+        for width in args.widths:
+            row = measure_width(width, args)
+            print(f"{row['width']:>5} {row['full_tokens']:>9} {row['compact_tokens']:>12} "
+                  f"{row['compact_tokens'] / row['full_tokens']:>6.2f} {row['full_ms']:>9.1f} {row['compact_ms']:>11.1f} "
+                  f"{str(row['query_columns_kept']):>16}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк конвейера анализа по этапам.
+
+Запуск из корня репозитория:
+    python -m benchmarks.run_benchmarks --rows 5000 --numeric-cols 20 --repeat 10
+    python -m benchmarks.run_benchmarks --save-baseline main
+    python -m benchmarks.run_benchmarks --compare main
+
+Каждый этап (чтение Excel, профиль полноты, вызовы LLM через заглушку, каждый тип
+анализа, каждый график, рендер шаблонов) замеряется отдельно: перцентили задержки
+по --repeat прогонам и пиковая память (tracemalloc, отдельный прогон).
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+# Ключ нужен только для проверки в llm_handler, реальные запросы не отправляются
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-stub")
+
+from app import app  # noqa: E402
+from flask import render_template  # noqa: E402
+from utils.data_loader import load_data_from_path, parse_workbook_data, list_sheet_names, get_data_completeness_report  # noqa: E402
+from utils.llm_handler import get_initial_assessment, get_detailed_plan_proposal  # noqa: E402
+from utils.pipeline import profile_dataframe, execute_analysis_plan  # noqa: E402
+from utils.stats_processor import get_descriptive_stats, perform_t_test, perform_chi_square, compute_correlation_matrix, perform_survival_analysis, compare_groups  # noqa: E402
+from utils.plot_utils import plot_histogram, plot_boxplot, plot_countplot, plot_contingency_table  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from benchmarks.synthetic import make_synthetic_frame, write_workbook, split_into_sheets, write_multi_sheet_workbook  # noqa: E402
+from utils.llm_backends import StubBackend, use_backend  # noqa: E402
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+
+
+def measure(func, repeat: int, warmup: int = 1) -> dict:
+    """Замеряет func(): перцентили задержки (мс) и пиковую память (МБ)."""
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    # Память меряем отдельным прогоном: tracemalloc заметно искажает время
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    arr = np.array(timings)
+    return {
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p95_ms": float(np.percentile(arr, 95)),
+        "p99_ms": float(np.percentile(arr, 99)),
+        "mean_ms": float(arr.mean()),
+        "peak_mem_mb": peak / (1024 * 1024),
+    }
+
+
+def build_stages(workbook_path: str, df: pd.DataFrame, multi_sheet_path: str | None = None) -> dict:
+    """Возвращает упорядоченный словарь {имя_этапа: функция без аргументов}."""
+    numeric_col = "num_0" if "num_0" in df.columns else None
+    categorical_col = "cat_0" if "cat_0" in df.columns else None
+    plan = [{"analysis_type": "descriptive_stats", "variable": "group"}]
+    if numeric_col:
+        plan.append({"analysis_type": "t-test", "variable": numeric_col, "grouping_variable": "group"})
+        plan.append({"analysis_type": "descriptive_stats", "variable": numeric_col})
+    if categorical_col:
+        plan.append({"analysis_type": "chi-square", "variable1": categorical_col, "variable2": "group"})
+    results = execute_analysis_plan(df, plan)
+    profile = profile_dataframe(df)
+    contingency = pd.crosstab(df[categorical_col], df["group"]) if categorical_col else None
+
+    stages = {
+        "ingest.load_data_from_path": lambda: load_data_from_path(workbook_path),
+        "profile.completeness_report": lambda: get_data_completeness_report(df),
+        "profile.profile_dataframe": lambda: profile_dataframe(df),
+        "llm.initial_assessment(stub)": lambda: get_initial_assessment("benchmark", profile["columns_to_display"], profile["missing_info_str"]),
+        "llm.plan_proposal(stub)": lambda: get_detailed_plan_proposal("benchmark", profile["columns_to_display"][:5], ""),
+        "analysis.descriptive_stats(categorical)": lambda: get_descriptive_stats(df, "group"),
+    }
+    if numeric_col:
+        stages["analysis.descriptive_stats(numeric)"] = lambda: get_descriptive_stats(df, numeric_col)
+        stages["analysis.t-test"] = lambda: perform_t_test(df, numeric_col, "group")
+        stages["plot.histogram"] = lambda: plot_histogram(df[numeric_col], title="bench")
+        stages["plot.boxplot"] = lambda: plot_boxplot(df, numeric_col, "group", title="bench")
+    numeric_cols = [col for col in df.columns if col.startswith("num_")]
+    if len(numeric_cols) >= 2:
+        stages["analysis.correlation_matrix"] = lambda: compute_correlation_matrix(df, numeric_cols)
+    if numeric_col:
+        survival_df = df.assign(_time=df[numeric_col].abs(), _event=(df[numeric_col] > 0).astype(int))
+        stages["analysis.survival"] = lambda: perform_survival_analysis(survival_df, "_time", "_event", "group")
+    if numeric_cols and categorical_col:
+        stages["analysis.anova(all numeric)"] = lambda: compare_groups(df, numeric_cols, categorical_col, "anova")
+        stages["analysis.kruskal_wallis(all numeric)"] = lambda: compare_groups(df, numeric_cols, categorical_col, "kruskal_wallis")
+    if categorical_col:
+        stages["analysis.chi-square"] = lambda: perform_chi_square(df, categorical_col, "group")
+        stages["plot.countplot"] = lambda: plot_countplot(df[categorical_col], title="bench")
+        stages["plot.contingency_table"] = lambda: plot_contingency_table(contingency, title="bench")
+    if multi_sheet_path:
+        sheet_options = {"sheets": list_sheet_names(multi_sheet_path), "join_key": "patient_id"}
+        stages["ingest.load_workbook_data(multi_sheet)"] = lambda: parse_workbook_data(multi_sheet_path, sheet_options)
+    stages["pipeline.execute_analysis_plan"] = lambda: execute_analysis_plan(df, plan)
+    stages["template.confirm_columns"] = lambda: render_template(
+        'confirm_columns.html', original_query="benchmark", completeness_html=profile["completeness_html"],
+        dataset_hash=profile["dataset_hash"], missing_pct=profile["missing_pct"], llm_suggestions={"suggested_columns": profile["columns_to_display"][:5], "questions_to_user": []},
+        all_columns=profile["columns_to_display"])
+    stages["template.results"] = lambda: render_template('results.html', analysis_results=results)
+    return stages, plan
+
+
+def run(args) -> dict:
+    df = make_synthetic_frame(rows=args.rows, numeric_cols=args.numeric_cols, categorical_cols=args.categorical_cols,
+                              missing_rate=args.missing_rate, cardinality=args.cardinality, seed=args.seed)
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("save_baseline", "compare", "only")},
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "stages": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        workbook_path = write_workbook(df, os.path.join(tmp, "benchmark.xlsx"))
+        multi_sheet_path = None
+        if args.sheets > 1:
+            multi_sheet_path = write_multi_sheet_workbook(split_into_sheets(df, args.sheets),
+                                                          os.path.join(tmp, "benchmark_sheets.xlsx"))
+        with app.test_request_context('/'):
+            loaded = load_data_from_path(workbook_path)
+            suggestions = {"suggested_columns": loaded.columns.tolist()[:5], "questions_to_user": []}
+            restore = use_backend(app, StubBackend(latency_s=args.llm_latency, suggestions=suggestions, plan=[]))
+            try:
+                stages, plan = build_stages(workbook_path, loaded, multi_sheet_path)
+                restore()
+                restore = use_backend(app, StubBackend(latency_s=args.llm_latency, suggestions=suggestions, plan=plan))
+                for name, func in stages.items():
+                    if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                        continue
+                    report["stages"][name] = measure(func, repeat=args.repeat)
+                    print(f"  {name:<45} p50={report['stages'][name]['p50_ms']:9.2f} ms", file=sys.stderr)
+            finally:
+                restore()
+    return report
+
+
+def print_report(report: dict, baseline: dict | None = None, threshold: float = 0.1):
+    header = f"{'stage':<45} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'peak MB':>9}"
+    if baseline:
+        header += f" {'Δp50':>9}"
+    print(header)
+    print("-" * len(header))
+    regressions = []
+    for name, m in report["stages"].items():
+        line = f"{name:<45} {m['p50_ms']:>10.2f} {m['p95_ms']:>10.2f} {m['p99_ms']:>10.2f} {m['peak_mem_mb']:>9.2f}"
+        base = (baseline or {}).get("stages", {}).get(name)
+        if base and base["p50_ms"] > 0:
+            delta = (m["p50_ms"] - base["p50_ms"]) / base["p50_ms"]
+            line += f" {delta:>+8.1%}"
+            if delta > threshold:
+                line += "  <-- регрессия"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов конвейера StatOnco.")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--numeric-cols", type=int, default=10)
+    parser.add_argument("--categorical-cols", type=int, default=5)
+    parser.add_argument("--missing-rate", type=float, default=0.1)
+    parser.add_argument("--cardinality", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sheets", type=int, default=3, help="Листов в книге для этапа чтения нескольких листов (1 - пропустить).")
+    parser.add_argument("--repeat", type=int, default=5, help="Число замеров на этап.")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Имитируемая задержка LLM-заглушки, с.")
+    parser.add_argument("--only", nargs="*", help="Префиксы этапов для запуска (например, plot. analysis.).")
+    parser.add_argument("--save-baseline", metavar="NAME", help="Сохранить результаты как базовую линию.")
+    parser.add_argument("--compare", metavar="NAME", help="Сравнить с сохраненной базовой линией.")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Порог регрессии p50 (доля).")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json"), encoding='utf-8') as f:
+            baseline = json.load(f)
+    regressions = print_report(report, baseline, threshold=args.threshold)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        with open(path, "w", encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Базовая линия сохранена: {path}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Генераторы синтетических наборов данных для бенчмарков.
+
+Формат рабочей книги повторяет реальные выгрузки: первая строка - заголовки,
+вторая - описания столбцов (ее пропускает load_data_from_path).
+"""
+import numpy as np
+import pandas as pd
+
+
+def make_synthetic_frame(rows: int = 1000, numeric_cols: int = 10, categorical_cols: int = 5,
+                         missing_rate: float = 0.1, cardinality: int = 4, seed: int = 0) -> pd.DataFrame:
+    """
+    Создает DataFrame со смесью числовых и категориальных столбцов.
+
+    Args:
+        rows (int): Количество строк (пациентов).
+        numeric_cols (int): Количество числовых столбцов ('num_0', 'num_1', ...).
+        categorical_cols (int): Количество категориальных столбцов ('cat_0', ...).
+            Столбец 'group' (2 группы) добавляется всегда - он нужен для t-теста.
+        missing_rate (float): Доля пропусков в каждом столбце (кроме 'group').
+        cardinality (int): Число уровней в категориальных столбцах.
+        seed (int): Зерно генератора случайных чисел.
+    """
+    rng = np.random.default_rng(seed)
+    data = {"group": rng.choice(["A", "B"], size=rows)}
+    for i in range(numeric_cols):
+        data[f"num_{i}"] = rng.normal(loc=50 + i, scale=10, size=rows).round(2)
+    levels = [f"L{j}" for j in range(max(cardinality, 1))]
+    for i in range(categorical_cols):
+        data[f"cat_{i}"] = rng.choice(levels, size=rows)
+
+    df = pd.DataFrame(data)
+    if missing_rate > 0:
+        for col in df.columns:
+            if col == "group":
+                continue
+            mask = rng.random(rows) < missing_rate
+            df[col] = df[col].mask(mask)
+    return df
+
+
+def write_workbook(df: pd.DataFrame, path: str) -> str:
+    """Сохраняет DataFrame как .xlsx со строкой описаний под заголовками."""
+    descriptions = pd.DataFrame([[f"Описание {col}" for col in df.columns]], columns=df.columns)
+    pd.concat([descriptions, df], ignore_index=True).to_excel(path, index=False, engine='openpyxl')
+    return path
+
+
+def split_into_sheets(df: pd.DataFrame, n_sheets: int = 3, key: str = "patient_id",
+                      repeats_per_key: int = 1) -> dict[str, pd.DataFrame]:
+    """
+    Делит столбцы DataFrame на n_sheets листов с общим ключом пациента.
+    Листы после первого могут содержать repeats_per_key записей на пациента (визиты).
+    """
+    df = df.reset_index(drop=True)
+    keys = pd.Series([f"P{i:06d}" for i in range(len(df))], name=key)
+    column_groups = np.array_split(np.array(df.columns, dtype=object), max(n_sheets, 1))
+    sheets = {}
+    for i, columns in enumerate(column_groups):
+        part = pd.concat([keys, df[list(columns)]], axis=1)
+        if i > 0 and repeats_per_key > 1:
+            part = pd.concat([part] * repeats_per_key, ignore_index=True)
+        sheets["Пациенты" if i == 0 else f"Лист_{i}"] = part
+    return sheets
+
+
+def write_multi_sheet_workbook(sheets: dict[str, pd.DataFrame], path: str) -> str:
+    """Сохраняет несколько листов (у каждого строка описаний под заголовками)."""
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        for name, df in sheets.items():
+            descriptions = pd.DataFrame([[f"Описание {col}" for col in df.columns]], columns=df.columns)
+            pd.concat([descriptions, df], ignore_index=True).to_excel(writer, sheet_name=name, index=False)
+    return path
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Сверка корреляционной матрицы (utils.stats_processor.compute_correlation_matrix)
+со scipy.stats на парно-полных наблюдениях.
+
+    python -m pytest -q benchmarks
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from utils.stats_processor import compute_correlation_matrix
+
+
+def _frame_with_gaps(seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.normal(size=(300, 4)), columns=["a", "b", "c", "d"])
+    df["b"] += 0.6 * df["a"]
+    df["d"] = np.exp(df["c"]) + rng.normal(scale=0.5, size=len(df))  # монотонная, но нелинейная связь
+    # Разные пропуски в столбцах: ранги по всему столбцу не совпадают с рангами в паре
+    df.loc[rng.random(len(df)) < 0.2, "a"] = np.nan
+    df.loc[rng.random(len(df)) < 0.3, "c"] = np.nan
+    df.loc[::7, "d"] = np.nan
+    return df
+
+
+@pytest.mark.parametrize("method, reference", [("pearson", stats.pearsonr), ("spearman", stats.spearmanr)])
+def test_masked_correlation_matches_scipy(method, reference):
+    df = _frame_with_gaps()
+    result = compute_correlation_matrix(df, method=method)
+    assert "error" not in result
+    for x, y in itertools.combinations(df.columns, 2):
+        pair = df[[x, y]].dropna()
+        expected = reference(pair[x], pair[y]).statistic
+        assert result["matrix"][method][x][y] == pytest.approx(expected, abs=1e-4)
+        assert result["matrix"][method][y][x] == pytest.approx(expected, abs=1e-4)
+
+
+def test_complete_columns_match_scipy_matrix():
+    df = _frame_with_gaps().dropna()
+    result = compute_correlation_matrix(df, method="spearman")
+    expected = stats.spearmanr(df.to_numpy()).statistic
+    for (i, x), (j, y) in itertools.product(enumerate(df.columns), repeat=2):
+        assert result["matrix"]["spearman"][x][y] == pytest.approx(expected[i, j], abs=1e-4)
+
+
+def test_pair_with_too_few_rows_is_empty():
+    df = pd.DataFrame({"a": [1.0, 2.0, np.nan, np.nan, 5.0], "b": [np.nan, 1.0, 2.0, 3.0, np.nan],
+                       "c": [1.0, 3.0, 2.0, 5.0, 4.0]})
+    result = compute_correlation_matrix(df, method="spearman")
+    assert result["matrix"]["spearman"]["a"]["b"] is None
+    assert result["matrix"]["pearson"]["a"]["b"] is None
+    assert result["matrix"]["spearman"]["b"]["c"] == pytest.approx(stats.spearmanr([1, 2, 3], [3, 2, 5]).statistic, abs=1e-4)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилище наборов данных (utils.dataset_store): общий файл одинаковых загрузок
+не теряется при одновременной регистрации нового набора и удалении старого.
+
+    python -m pytest -q benchmarks
+"""
+import os
+import threading
+import time
+
+import pytest
+
+from utils import dataset_store
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    monkeypatch.setattr(dataset_store, "DATASET_STORE_DIR", str(tmp_path / "datasets"))
+    os.makedirs(dataset_store.DATASET_STORE_DIR)
+    return tmp_path
+
+
+def _upload(directory, name: str) -> str:
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"same workbook content")
+    return path
+
+
+def test_drop_during_register_of_same_content_keeps_file(store, monkeypatch):
+    old = dataset_store.register_dataset(_upload(store, "old.xlsx"), "a.xlsx")
+    upload = _upload(store, "new.xlsx")
+
+    # Регистрация "застревает" между проверкой общего файла и записью dataset.json,
+    # в это время другой поток удаляет старый набор с тем же файлом
+    write_json = dataset_store._write_json
+    paused = threading.Event()
+
+    def slow_write_json(path, payload):
+        if path.endswith("dataset.json") and payload.get("filename") == "b.xlsx":
+            paused.set()
+            time.sleep(0.2)
+        write_json(path, payload)
+    monkeypatch.setattr(dataset_store, "_write_json", slow_write_json)
+
+    registered = {}
+    thread = threading.Thread(target=lambda: registered.update(dataset=dataset_store.register_dataset(upload, "b.xlsx")))
+    thread.start()
+    assert paused.wait(5)
+    dataset_store.drop_dataset(old["id"])
+    thread.join()
+
+    assert os.path.exists(registered["dataset"]["filepath"])
+    dataset_store.drop_dataset(registered["dataset"]["id"])
+    assert not os.path.exists(registered["dataset"]["filepath"])
+
+
+def test_artifact_lookup_uses_index(store, monkeypatch):
+    dataset = dataset_store.register_dataset(_upload(store, "data.xlsx"), "a.xlsx")
+    others = [dataset_store.register_dataset(_upload(store, f"other{i}.xlsx"), "b.xlsx") for i in range(3)]
+    plan = dataset_store.put_artifact('plans', dataset["id"], {"proposed_plan": []})
+
+    def no_scan(path):
+        raise AssertionError("get_artifact не должен обходить каталог наборов")
+    with monkeypatch.context() as patch:
+        patch.setattr(dataset_store.os, "scandir", no_scan)
+        assert dataset_store.get_artifact('plans', plan["id"]) == plan
+        assert dataset_store.get_artifact('results', plan["id"]) is None
+
+    dataset_store.drop_dataset(dataset["id"])
+    assert dataset_store.get_artifact('plans', plan["id"]) is None
+    assert os.listdir(os.path.join(dataset_store.DATASET_STORE_DIR, "artifacts")) == []
+    for other in others:
+        dataset_store.drop_dataset(other["id"])
+
+
+def test_stored_artifacts_without_index_are_indexed(store):
+    dataset = dataset_store.register_dataset(_upload(store, "data.xlsx"), "a.xlsx")
+    result = dataset_store.put_artifact('results', dataset["id"], {"results": []})
+    os.remove(os.path.join(dataset_store.DATASET_STORE_DIR, "artifacts", f"results-{result['id']}.json"))
+    assert dataset_store.get_artifact('results', result["id"]) is None
+
+    dataset_store.track_stored_datasets()
+    assert dataset_store.get_artifact('results', result["id"]) == result
+    dataset_store.drop_dataset(dataset["id"])
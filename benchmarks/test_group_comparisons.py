@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Сверка сравнения групп (utils.stats_processor.compare_groups): ANOVA и критерий
+Краскела-Уоллиса - со scipy.stats.f_oneway / kruskal, попарные сравнения
+(t-критерий с объединенной дисперсией, критерий Данна) и поправка Холма - с
+прямым расчетом по каждой паре.
+
+    python -m pytest -q benchmarks
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse, stats
+
+from utils.stats_processor import _anova, _group_sums, _holm, _kruskal_wallis, compare_groups
+
+
+@pytest.fixture
+def grouped():
+    """3 показателя, 4 группы разного размера, разные пропуски; показатель 'tied' - со связями."""
+    rng = np.random.default_rng(5)
+    codes = rng.integers(0, 4, size=200)
+    values = np.column_stack([
+        rng.normal(codes * 0.3, 1.0),
+        rng.exponential(1.0 + codes),
+        np.round(rng.normal(codes * 0.5, 2.0)),
+    ])
+    values[rng.random(values.shape) < 0.1] = np.nan
+    indicator = sparse.csr_matrix((np.ones(len(codes)), (codes, np.arange(len(codes)))), shape=(4, len(codes)))
+    return values, codes, indicator, np.triu_indices(4, k=1)
+
+
+def _groups(values, codes, k):
+    present = ~np.isnan(values[:, k])
+    return [values[present & (codes == g), k] for g in range(4)]
+
+
+def _holm_reference(p_values):
+    order = np.argsort(p_values)
+    adjusted, running = np.empty(len(p_values)), 0.0
+    for rank, idx in enumerate(order):
+        running = max(running, min(1.0, (len(p_values) - rank) * p_values[idx]))
+        adjusted[idx] = running
+    return adjusted
+
+
+def test_anova_matches_scipy(grouped):
+    values, codes, indicator, pairs = grouped
+    result = _anova(*_group_sums(indicator, values), pairs)
+    for k in range(values.shape[1]):
+        groups = _groups(values, codes, k)
+        reference = stats.f_oneway(*groups)
+        assert result["statistic"][k] == pytest.approx(reference.statistic, rel=1e-9)
+        assert result["p"][k] == pytest.approx(reference.pvalue, rel=1e-9)
+
+        n_total = sum(len(g) for g in groups)
+        ms_within = sum(((g - g.mean()) ** 2).sum() for g in groups) / (n_total - len(groups))
+        raw = [2 * stats.t.sf(abs(groups[i].mean() - groups[j].mean())
+                              / np.sqrt(ms_within * (1 / len(groups[i]) + 1 / len(groups[j]))), n_total - len(groups))
+               for i, j in zip(*pairs)]
+        np.testing.assert_allclose(result["pair_p"][k], _holm_reference(np.array(raw)), rtol=1e-9)
+
+
+def test_kruskal_wallis_and_dunn_match_reference(grouped):
+    values, codes, indicator, pairs = grouped
+    result = _kruskal_wallis(values, indicator, pairs)
+    for k in range(values.shape[1]):
+        groups = _groups(values, codes, k)
+        reference = stats.kruskal(*groups)
+        assert result["statistic"][k] == pytest.approx(reference.statistic, rel=1e-9)
+        assert result["p"][k] == pytest.approx(reference.pvalue, rel=1e-9)
+
+        ranks = stats.rankdata(np.concatenate(groups))
+        n_total = len(ranks)
+        _, tie_counts = np.unique(np.concatenate(groups), return_counts=True)
+        ties = (tie_counts ** 3 - tie_counts).sum()
+        bounds = np.cumsum([0] + [len(g) for g in groups])
+        mean_ranks = [ranks[bounds[g]:bounds[g + 1]].mean() for g in range(4)]
+        raw = [2 * stats.norm.sf(abs(mean_ranks[i] - mean_ranks[j]) / np.sqrt(
+                   (n_total * (n_total + 1) / 12 - ties / (12 * (n_total - 1))) * (1 / len(groups[i]) + 1 / len(groups[j]))))
+               for i, j in zip(*pairs)]
+        np.testing.assert_allclose(result["pair_p"][k], _holm_reference(np.array(raw)), rtol=1e-9)
+
+
+def test_holm_ignores_missing_p_values():
+    p_values = np.array([[0.01, np.nan, 0.04, 0.03], [0.2, 0.5, 0.01, 0.03]])
+    adjusted = _holm(p_values)
+    np.testing.assert_allclose(adjusted[0, [0, 2, 3]], _holm_reference(np.array([0.01, 0.04, 0.03])))
+    assert np.isnan(adjusted[0, 1])
+    np.testing.assert_allclose(adjusted[1], _holm_reference(p_values[1]))
+
+
+@pytest.mark.parametrize("method, reference", [("anova", stats.f_oneway), ("kruskal_wallis", stats.kruskal)])
+def test_compare_groups_reports_scipy_p_values(grouped, method, reference):
+    values, codes, _, _ = grouped
+    df = pd.DataFrame(values, columns=["normal", "skewed", "tied"]).assign(group=[f"g{c}" for c in codes])
+    result = compare_groups(df, ["normal", "skewed", "tied"], "group", method=method)
+    assert "error" not in result
+    expected_significant = sum(reference(*_groups(values, codes, k)).pvalue < 0.05 for k in range(values.shape[1]))
+    assert result["metrics"]["Значимых различий (p < 0.05)"] == expected_significant
+    assert result["groups"] == ["g0", "g1", "g2", "g3"]
+    for label in itertools.chain(result["groups"], result["variables"]):
+        assert label in result["table_html"]
+
+
+def test_single_observation_group_has_no_sd():
+    df = pd.DataFrame({"value": [1.0, 2.0, 3.0, 4.0, 5.0, 9.0], "group": ["a", "a", "a", "b", "b", "c"]})
+    result = compare_groups(df, ["value"], "group", method="anova")
+    assert "error" not in result
+    assert "nan" not in result["table_html"]
+    assert "9.00 ± — (n=1)" in result["table_html"]
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Профилирование запроса (utils.profiling) охватывает работу вне потока запроса:
+план в процессе-исполнителе (utils.scheduler) и код представлений в пуле потоков ASGI.
+
+    python -m pytest -q benchmarks
+"""
+import contextvars
+import json
+import os
+import pstats
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from flask import g
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-stub")
+
+from app import app  # noqa: E402
+from utils import scheduler  # noqa: E402
+from utils.flow import _call_profiled  # noqa: E402
+
+from benchmarks.synthetic import make_synthetic_frame  # noqa: E402
+
+PLAN = [{"analysis_type": "descriptive_stats", "variable": "num_0"}]
+
+
+@pytest.fixture
+def profiling(monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'PROFILING_ON_DEMAND', True)
+    monkeypatch.setitem(app.config, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setitem(app.config, 'PROFILE_SAMPLE_INTERVAL_S', 0.001)
+    monkeypatch.setattr(scheduler, "JOB_ISOLATION", True)
+    return tmp_path
+
+
+def _profiled_plan(mode: str):
+    df = make_synthetic_frame(rows=2000, numeric_cols=2, categorical_cols=1, missing_rate=0.0, seed=0)
+    with app.test_request_context('/', headers={'X-Profile': mode}):
+        app.preprocess_request()
+        scheduler.run_plan(df, PLAN, client="profiling-test")
+        app.do_teardown_request()
+
+
+def _saved_profile(profile_dir, suffix: str) -> tuple[str, dict]:
+    data_file = next(name for name in os.listdir(profile_dir) if name.endswith(suffix))
+    with open(os.path.join(profile_dir, data_file[:-len(suffix)] + ".json"), encoding='utf-8') as f:
+        return os.path.join(profile_dir, data_file), json.load(f)
+
+
+@pytest.mark.skipif(os.name != "posix", reason="изоляция планов работает только в POSIX")
+def test_cprofile_includes_plan_worker(profiling):
+    _profiled_plan('cprofile')
+    path, meta = _saved_profile(profiling, ".prof")
+    assert meta["worker_profiles"] == 1
+    functions = {func for _, _, func in pstats.Stats(path).stats}
+    assert "execute_plan_step" in functions
+
+
+@pytest.mark.skipif(os.name != "posix", reason="изоляция планов работает только в POSIX")
+def test_sampled_profile_includes_plan_worker(profiling):
+    _profiled_plan('sample')
+    path, meta = _saved_profile(profiling, ".folded")
+    assert meta["worker_profiles"] == 1
+    with open(path, encoding='utf-8') as f:
+        worker_stacks = [line for line in f if line.startswith("plan_worker;")]
+    assert worker_stacks
+
+
+def test_executor_threads_join_request_profile(profiling):
+    with app.test_request_context('/', headers={'X-Profile': 'cprofile'}):
+        app.preprocess_request()
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(context.run, _call_profiled, lambda: sum(range(1000))).result()
+        assert len(g._profiling['thread_profilers']) == 1
+        app.do_teardown_request()
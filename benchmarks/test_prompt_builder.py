@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Компактный блок столбцов (utils.prompt_builder): имена с символом '|' и другими
+служебными символами переживают кодирование и разбор заглушкой LLM
+(utils.llm_backends.prompt_columns) без сдвига столбцов.
+
+    python -m pytest -q benchmarks
+"""
+import os
+
+import pandas as pd
+import pytest
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-stub")
+
+from utils.llm_backends import _INITIAL_COLUMNS_MARKER, prompt_columns  # noqa: E402
+from utils.prompt_builder import build_column_profile, build_columns_block, header_column_profile  # noqa: E402
+
+NAMES = ["возраст", "доза|мг", 'стадия "T"', "(код)", " пробел ", "строка\nдве", "путь\\a|b", "n|c3|10%"]
+
+
+def _prompt(block: dict) -> str:
+    return f"Запрос\n\n{_INITIAL_COLUMNS_MARKER}{block['text']}\n\nДальше"
+
+
+@pytest.mark.parametrize("profile", [
+    build_column_profile(pd.DataFrame({name: [1.0, None, 3.0] for name in NAMES})),
+    header_column_profile(NAMES),
+], ids=["metadata", "headers"])
+def test_column_names_round_trip(profile):
+    block = build_columns_block("доза", profile)
+    assert block["omitted"] == 0
+    assert prompt_columns(_prompt(block)) == block["included"]
+    assert sorted(block["included"]) == sorted(NAMES)
+
+
+def test_plain_names_stay_unquoted():
+    block = build_columns_block("", build_column_profile(pd.DataFrame({"num_3": [1.0, 2.0]})))
+    assert "\nnum_3|n" in block["text"]
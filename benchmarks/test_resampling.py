@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Ресэмплинг (utils.resampling): воспроизводимость по seed при разбиении на блоки
+с дочерними SeedSequence.spawn (последовательно и в пуле процессов) и сверка
+интервалов и p-value со scipy.stats.bootstrap / permutation_test; t-тест сообщает
+один seed для бутстрепа и перестановочного теста.
+
+    python -m pytest -q benchmarks
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from utils import resampling
+from utils.stats_processor import perform_t_test
+
+
+@pytest.fixture
+def samples():
+    rng = np.random.default_rng(42)
+    return rng.normal(0.0, 1.0, size=80), rng.normal(0.5, 1.2, size=60)
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    """Много блоков даже при небольшом B: каждый блок - свой дочерний SeedSequence."""
+    monkeypatch.setattr(resampling, "_BLOCK_ELEMENTS", 5_000)
+
+
+def test_same_seed_same_result(samples, small_blocks):
+    x, y = samples
+    assert resampling.bootstrap_ci(x, ("mean", "median"), n_resamples=1000, seed=7) == \
+        resampling.bootstrap_ci(x, ("mean", "median"), n_resamples=1000, seed=7)
+    assert resampling.permutation_test(x, y, n_resamples=1000, seed=7) == \
+        resampling.permutation_test(x, y, n_resamples=1000, seed=7)
+    assert resampling.bootstrap_diff_ci(x, y, n_resamples=1000, seed=7) != \
+        resampling.bootstrap_diff_ci(x, y, n_resamples=1000, seed=8)
+
+
+def test_returned_entropy_reproduces_unseeded_run(samples, small_blocks):
+    x, y = samples
+    first = resampling.bootstrap_diff_ci(x, y, statistic="median", n_resamples=1000)
+    repeated = resampling.bootstrap_diff_ci(x, y, statistic="median", n_resamples=1000, seed=first["seed"])
+    assert repeated == first
+
+
+def test_blocks_match_spawned_seed_sequences(samples, small_blocks):
+    x, _ = samples
+    values, entropy = resampling._run_blocks("bootstrap", (x,), ("mean",), 1000, len(x), seed=11)
+    assert entropy == 11
+    block = resampling._BLOCK_ELEMENTS // len(x)
+    sizes = [block] * (1000 // block) + [1000 % block]
+    children = np.random.SeedSequence(11).spawn(len(sizes))
+    expected = np.concatenate([resampling._resample_block("bootstrap", (x,), ("mean",), size, child)
+                               for size, child in zip(sizes, children)])
+    np.testing.assert_array_equal(values, expected)
+
+
+def test_process_pool_matches_sequential(samples, small_blocks, monkeypatch):
+    x, y = samples
+    sequential = resampling.permutation_test(x, y, n_resamples=2000, seed=3)
+    monkeypatch.setattr(resampling, "_PARALLEL_MIN_ELEMENTS", 0)
+    parallel = resampling.permutation_test(x, y, n_resamples=2000, seed=3)
+    assert parallel == sequential
+    # Процессы пула не форкаются из процесса с потоками сервера
+    assert resampling._pool._mp_context.get_start_method() != "fork"
+
+
+def test_bootstrap_interval_close_to_scipy(samples):
+    x, _ = samples
+    ours = resampling.bootstrap_ci(x, ("mean",), n_resamples=20_000, seed=1)["intervals"]["mean"]
+    reference = stats.bootstrap((x,), np.mean, n_resamples=20_000, method="percentile",
+                                random_state=np.random.default_rng(1)).confidence_interval
+    assert ours["ci_low"] == pytest.approx(reference.low, abs=0.02)
+    assert ours["ci_high"] == pytest.approx(reference.high, abs=0.02)
+
+
+def test_permutation_p_value_close_to_scipy(samples):
+    x, y = samples
+    ours = resampling.permutation_test(x, y, n_resamples=20_000, seed=1)
+    reference = stats.permutation_test((x, y), lambda a, b: np.mean(a) - np.mean(b), n_resamples=20_000,
+                                       random_state=np.random.default_rng(1))
+    assert ours["statistic"] == pytest.approx(reference.statistic)
+    assert ours["p_value"] == pytest.approx(reference.pvalue, abs=0.01)
+
+
+def test_t_test_reports_one_seed_for_both_resampling_methods(samples):
+    x, y = samples
+    df = pd.DataFrame({"value": np.concatenate([x, y]), "group": ["a"] * len(x) + ["b"] * len(y)})
+    first = perform_t_test(df, "value", "group", bootstrap=True, permutation=True, n_resamples=500)
+    seed = first["resampling"]["bootstrap"]["seed"]
+    assert first["resampling"]["permutation"]["seed"] == seed
+    assert first["metrics"]["Повторных выборок (seed)"] == f"500 ({seed})"
+
+    repeated = perform_t_test(df, "value", "group", bootstrap=True, permutation=True, n_resamples=500, seed=seed)
+    assert repeated["resampling"] == first["resampling"]
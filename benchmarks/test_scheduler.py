@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Выполнение плана в процессе-исполнителе (utils.scheduler, JOB_ISOLATION): метрики
+шагов, анализов и графиков из исполнителя попадают в /metrics и Server-Timing
+процесса приложения.
+
+    python -m pytest -q benchmarks
+"""
+import os
+
+import pytest
+from flask import g
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-stub")
+
+from app import app  # noqa: E402
+from utils import metrics, scheduler  # noqa: E402
+
+from benchmarks.synthetic import make_synthetic_frame  # noqa: E402
+
+STAGE_KEY = ("statonco_stage_duration_seconds", (("stage", "plan_step.descriptive_stats"),))
+
+
+def _stage_count(key) -> int:
+    with metrics._lock:
+        hist = metrics._histograms.get(key)
+        return hist["count"] if hist else 0
+
+
+@pytest.mark.skipif(os.name != "posix", reason="изоляция планов работает только в POSIX")
+def test_isolated_plan_reports_step_metrics(monkeypatch):
+    monkeypatch.setattr(scheduler, "JOB_ISOLATION", True)
+    df = make_synthetic_frame(rows=200, numeric_cols=2, categorical_cols=1, missing_rate=0.0, seed=0)
+    plan = [{"analysis_type": "descriptive_stats", "variable": "num_0"},
+            {"analysis_type": "descriptive_stats", "variable": "num_1"}]
+    before = _stage_count(STAGE_KEY)
+
+    with app.test_request_context('/'):
+        results = scheduler.run_plan(df, plan, client="test")
+        timings = [name for name, _ in g.get('_server_timings', [])]
+
+    assert [r["status"] for r in results] == ["success", "success"]
+    assert _stage_count(STAGE_KEY) == before + 2
+    assert timings.count("plan_step.descriptive_stats") == 2
+    assert 'stage="plan_step.descriptive_stats"' in metrics.render_prometheus()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Сверка анализа выживаемости (utils.stats_processor): кривые Каплана-Мейера,
+ДИ по Гринвуду (log(-log)) и лог-ранговый критерий - со scipy.stats и lifelines.
+
+    python -m pytest -q benchmarks
+"""
+import numpy as np
+import pytest
+from scipy import stats
+
+from utils.stats_processor import _kaplan_meier, _log_rank, _survival_tables
+
+
+def _survival_sample(n_groups: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Времена с совпадениями (округление), цензурирование ~30%, разные риски в группах."""
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(0, n_groups, size=240)
+    times = np.round(rng.exponential(10.0 * (1 + 0.4 * codes)), 0) + 1
+    events = (rng.random(len(times)) > 0.3).astype(float)
+    return times, events, codes
+
+
+@pytest.mark.filterwarnings("ignore:The confidence interval is undefined")
+def test_kaplan_meier_and_greenwood_match_scipy():
+    times, events, codes = _survival_sample(n_groups=1)
+    tables = _survival_tables(times, events, codes, 1)
+    km = _kaplan_meier(tables)
+
+    reference = stats.ecdf(stats.CensoredData.right_censored(times, events == 0)).sf
+    interval = reference.confidence_interval(0.95, method="log-log")
+    grid = tables["times"]
+    np.testing.assert_allclose(km["survival"][0], reference.evaluate(grid), atol=1e-10)
+    # scipy не определяет интервал там, где S = 1 или S = 0; у нас он вырожден (S)
+    defined = np.isfinite(interval.low.evaluate(grid)) & (km["survival"][0] < 1) & (km["survival"][0] > 0)
+    np.testing.assert_allclose(km["lower"][0][defined], interval.low.evaluate(grid)[defined], atol=1e-8)
+    np.testing.assert_allclose(km["upper"][0][defined], interval.high.evaluate(grid)[defined], atol=1e-8)
+
+
+def test_two_group_log_rank_matches_scipy():
+    times, events, codes = _survival_sample(n_groups=2)
+    chi2, dof, p = _log_rank(_survival_tables(times, events, codes, 2))
+
+    groups = [stats.CensoredData.right_censored(times[codes == g], events[codes == g] == 0) for g in (0, 1)]
+    reference = stats.logrank(*groups)
+    assert dof == 1
+    assert chi2 == pytest.approx(reference.statistic ** 2, rel=1e-8)
+    assert p == pytest.approx(reference.pvalue, rel=1e-8)
+
+
+@pytest.mark.parametrize("n_groups", [2, 4])
+def test_multigroup_log_rank_matches_lifelines(n_groups):
+    lifelines_stats = pytest.importorskip("lifelines.statistics")
+    times, events, codes = _survival_sample(n_groups=n_groups, seed=n_groups)
+    chi2, dof, p = _log_rank(_survival_tables(times, events, codes, n_groups))
+
+    reference = lifelines_stats.multivariate_logrank_test(times, codes, events)
+    assert dof == n_groups - 1
+    assert chi2 == pytest.approx(reference.test_statistic, rel=1e-8)
+    assert p == pytest.approx(reference.p_value, rel=1e-8)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Пулы потоков для фоновых задач запросов - отдельный ограниченный пул на вид задач,
+чтобы задачи одного вида не занимали потоки остальных:
+    parse       - разбор файла параллельно с запросом к LLM на этапе 0
+                  (BACKGROUND_PARSE_WORKERS, по умолчанию 4);
+    speculation - спекулятивные планы (BACKGROUND_SPECULATION_WORKERS, 2);
+    exact       - точные расчеты после предпросмотра (BACKGROUND_EXACT_WORKERS, 4).
+Кроме потоков ограничена и очередь (BACKGROUND_<ВИД>_QUEUE): при заполненной очереди
+submit_* бросает PoolBusy, и вызывающий код выполняет задачу сам, пропускает ее
+или отвечает "сервер занят".
+"""
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from flask import copy_current_request_context, current_app
+
+from .metrics import inc_counter
+
+# вид -> (потоков по умолчанию, мест в очереди по умолчанию)
+POOL_DEFAULTS = {"parse": (4, 8), "speculation": (2, 4), "exact": (4, 16)}
+
+
+class PoolBusy(RuntimeError):
+    """Очередь пула заполнена."""
+
+
+class _BoundedPool:
+    """ThreadPoolExecutor с ограничением числа выполняемых и ожидающих задач."""
+
+    def __init__(self, name: str, max_workers: int, max_queued: int):
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"statonco-{name}")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queued)
+
+    def submit(self, func) -> Future:
+        if not self._slots.acquire(blocking=False):
+            inc_counter("statonco_background_rejected_total", help_text="Фоновые задачи, отклоненные из-за заполненной очереди.",
+                        pool=self.name)
+            raise PoolBusy(f"Очередь фоновых задач '{self.name}' заполнена.")
+        try:
+            future = self._executor.submit(func)
+        except BaseException:
+            self._slots.release()
+            raise
+        # Освобождает место и при отмене задачи, ожидавшей в очереди
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+def _pool_from_env(name: str) -> _BoundedPool:
+    workers, queued = POOL_DEFAULTS[name]
+    return _BoundedPool(name, int(os.getenv(f'BACKGROUND_{name.upper()}_WORKERS', workers)),
+                        int(os.getenv(f'BACKGROUND_{name.upper()}_QUEUE', queued)))
+
+
+_pools = {name: _pool_from_env(name) for name in POOL_DEFAULTS}
+
+
+def submit_in_request_context(pool: str, func, *args, **kwargs) -> Future:
+    """
+    Запускает func в пуле pool с копией текущего контекста запроса
+    (доступны current_app, session, flash).
+    """
+    request_func = copy_current_request_context(func)
+    return _pools[pool].submit(lambda: request_func(*args, **kwargs))
+
+
+def submit_in_app_context(pool: str, func, *args, **kwargs) -> Future:
+    """
+    Запускает func в пуле pool только с контекстом приложения - для задач,
+    которые могут пережить текущий запрос (session и flash им недоступны).
+    """
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            return func(*args, **kwargs)
+    return _pools[pool].submit(run)
+
+
+def submit_in_detached_request_context(pool: str, func, *args, **kwargs) -> Future:
+    """
+    Запускает func в пуле pool в новом пустом контексте запроса: flash и
+    session работают, но не связаны с клиентом (сообщения можно забрать через
+    get_flashed_messages внутри func). Для задач, переживающих запрос и вызывающих
+    код с flash (например, выполнение плана).
+    """
+    app = current_app._get_current_object()
+
+    def run():
+        with app.test_request_context():
+            return func(*args, **kwargs)
+    return _pools[pool].submit(run)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Локальное сопоставление имен столбцов из ответов LLM с реальными столбцами данных.
+
+LLM иногда возвращает имена, немного отличающиеся от df.columns: регистр,
+пробелы и подчеркивания, транслитерация ('Vozrast' вместо 'Возраст'), латинские
+буквы-двойники в кириллице. Индекс строится один раз на набор столбцов и
+разрешает имя за несколько обращений к словарю; сопоставление по триграммам -
+только если точные ключи не сработали, и только при однозначном лидере.
+
+Уровни (в порядке проверки): exact, normalized (регистр/разделители/пунктуация/ё),
+transliteration (кириллица -> латиница с выравниванием вариантов), fuzzy (триграммы).
+"""
+import re
+from functools import lru_cache
+
+# Кириллица -> латиница (упрощенная схема, варианты выравниваются _LATIN_FOLDS)
+_TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+}
+_TRANSLIT_TABLE = str.maketrans(_TRANSLIT)
+# Разные схемы транслитерации одной буквы приводятся к одному виду (с обеих сторон)
+_LATIN_FOLDS = (("shch", "sh"), ("sch", "sh"), ("kh", "h"), ("tz", "c"), ("ts", "c"), ("j", "y"),
+                ("w", "v"), ("ck", "k"), ("iy", "y"), ("yy", "y"), ("ph", "f"))
+# Латинские буквы, совпадающие по начертанию с кириллическими
+_HOMOGLYPHS = str.maketrans("aceopxykmthb", "асеорхукмтнв")
+
+_SEPARATORS_RE = re.compile(r"[\W_]+")
+_CYRILLIC_RE = re.compile(r"[а-яё]")
+
+# Порог сходства Дайса по триграммам и необходимый отрыв от второго кандидата
+FUZZY_THRESHOLD = 0.75
+FUZZY_MARGIN = 0.1
+
+
+def normalize_name(name: str) -> str:
+    """Регистр, ё -> е, пробелы/подчеркивания/пунктуация -> один пробел; латинские двойники в кириллических словах."""
+    text = _SEPARATORS_RE.sub(" ", str(name).casefold().replace('ё', 'е')).strip()
+    return " ".join(word.translate(_HOMOGLYPHS) if _CYRILLIC_RE.search(word) else word for word in text.split(" "))
+
+
+def transliteration_key(name: str) -> str:
+    """Ключ, одинаковый для кириллического имени и его латинской транслитерации (без пробелов)."""
+    key = normalize_name(name).translate(_TRANSLIT_TABLE).replace(" ", "")
+    for source, target in _LATIN_FOLDS:
+        key = key.replace(source, target)
+    return key
+
+
+def _trigrams(key: str) -> frozenset[str]:
+    padded = f"  {key} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class ColumnIndex:
+    """Индекс имен столбцов одного набора данных."""
+
+    def __init__(self, columns):
+        self.columns = [str(col) for col in columns]
+        self._exact = set(self.columns)
+        self._normalized = self._unique_map(normalize_name)
+        self._transliterated = self._unique_map(transliteration_key)
+        self._trigrams = [(col, _trigrams(transliteration_key(col))) for col in self.columns]
+
+    def _unique_map(self, key_func) -> dict:
+        """Ключ -> столбец; ключи, общие для нескольких столбцов, неоднозначны (None)."""
+        mapping = {}
+        for col in self.columns:
+            key = key_func(col)
+            mapping[key] = None if key in mapping and mapping[key] != col else col
+        return mapping
+
+    def resolve(self, name) -> tuple[str | None, str | None]:
+        """
+        Returns:
+            (столбец, способ) - способ: 'exact' | 'normalized' | 'transliteration' | 'fuzzy';
+            (None, None), если имя не удалось однозначно сопоставить.
+        """
+        if not isinstance(name, str) or not name.strip():
+            return None, None
+        if name in self._exact:
+            return name, "exact"
+        col = self._normalized.get(normalize_name(name))
+        if col:
+            return col, "normalized"
+        key = transliteration_key(name)
+        col = self._transliterated.get(key)
+        if col:
+            return col, "transliteration"
+
+        grams = _trigrams(key)
+        best, best_score, second_score = None, 0.0, 0.0
+        for candidate, candidate_grams in self._trigrams:
+            score = 2 * len(grams & candidate_grams) / (len(grams) + len(candidate_grams))
+            if score > best_score:
+                best, best_score, second_score = candidate, score, best_score
+            elif score > second_score:
+                second_score = score
+        if best_score >= FUZZY_THRESHOLD and best_score - second_score >= FUZZY_MARGIN:
+            return best, "fuzzy"
+        return None, None
+
+
+@lru_cache(maxsize=64)
+def _cached_index(columns: tuple) -> ColumnIndex:
+    return ColumnIndex(columns)
+
+
+def get_column_index(columns) -> ColumnIndex:
+    """Индекс для набора столбцов (строится один раз на набор и кешируется)."""
+    return _cached_index(tuple(str(col) for col in columns))
+
+
+def resolve_names(names: list, columns) -> tuple[list, list[dict]]:
+    """
+    Сопоставляет список имен со столбцами. Несопоставленные имена остаются как есть.
+
+    Returns:
+        (имена после исправления, [{"from", "to", "method"}, ...] - только исправленные)
+    """
+    index = get_column_index(columns)
+    resolved, fixes = [], []
+    for name in names:
+        col, method = index.resolve(name)
+        if col and method != "exact":
+            fixes.append({"from": name, "to": col, "method": method})
+        resolved.append(col or name)
+    return resolved, fixes
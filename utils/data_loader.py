@@ -1,10 +1,20 @@
 # -*- coding: utf-8 -*-
 import pandas as pd
 import os
+import json
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from werkzeug.utils import secure_filename
 # !!! Убираем импорт current_app и flash на уровне модуля, если он не нужен в глобальной области !!!
 # Оставляем только если он нужен ВНУТРИ функций
 from flask import current_app, flash
+from .metrics import instrumented, record_cache
+from .processes import process_context
+from . import janitor
 
 # !!! УБРАТЬ ПРОВЕРКУ ПАПКИ НА УРОВНЕ МОДУЛЯ !!!
 # # Проблемный код удален:
@@ -17,10 +27,12 @@ from flask import current_app, flash
 # !!! КОНЕЦ УДАЛЕНИЯ !!!
 
 
+@instrumented("ingest.save_upload")
 def save_uploaded_file(uploaded_file):
     """Сохраняет загруженный файл локально и возвращает путь."""
     if uploaded_file and uploaded_file.filename != '':
-        filename = secure_filename(uploaded_file.filename)
+        # Уникальный префикс: одновременные загрузки файлов с одинаковым именем не перезаписывают друг друга
+        filename = f"{uuid.uuid4().hex[:12]}_{secure_filename(uploaded_file.filename)}"
         try:
             # Получаем папку из config ВНУТРИ функции, когда current_app доступен
             upload_folder = current_app.config['UPLOAD_FOLDER']
@@ -37,6 +49,7 @@ def save_uploaded_file(uploaded_file):
 
             filepath = os.path.join(upload_folder, filename)
             uploaded_file.save(filepath)
+            janitor.track_file(filepath, "upload", evict=lambda: cleanup_file(filepath))
             current_app.logger.info(f"Файл '{filename}' сохранен как '{filepath}'")
             return filepath
         except KeyError:
@@ -49,6 +62,35 @@ def save_uploaded_file(uploaded_file):
             return None
     return None
 
+def _clean_header(header_row) -> list[str]:
+    return [str(value).strip() if value is not None else f"Unnamed: {i}" for i, value in enumerate(header_row)]
+
+
+@instrumented("ingest.header_read")
+def read_header_columns(filepath: str) -> list[str] | None:
+    """
+    Быстро читает только строку заголовков первого листа (без разбора данных).
+
+    Имена очищаются так же, как в load_data_from_path; пустые заголовки
+    получают имена 'Unnamed: N', как у pandas. Возвращает None при ошибке.
+    """
+    janitor.touch(filepath)
+    try:
+        from openpyxl import load_workbook
+        workbook = load_workbook(filepath, read_only=True, data_only=True)
+        try:
+            sheet = workbook.worksheets[0]
+            header_row = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), None)
+        finally:
+            workbook.close()
+        if not header_row:
+            return None
+        return _clean_header(header_row)
+    except Exception as e:
+        current_app.logger.warning(f"Не удалось быстро прочитать заголовки '{filepath}': {e}")
+        return None
+
+@instrumented("ingest.excel_parse")
 def load_data_from_path(filepath: str) -> pd.DataFrame | None:
     """
     Загружает данные из Excel файла по указанному пути.
@@ -58,6 +100,7 @@ def load_data_from_path(filepath: str) -> pd.DataFrame | None:
         flash(f"Ошибка: Файл '{os.path.basename(filepath)}' не найден для загрузки данных.", "danger")
         current_app.logger.error(f"Ошибка load_data_from_path: Файл не найден '{filepath}'")
         return None
+    janitor.touch(filepath)
     try:
         # Читаем заголовок из ПЕРВОЙ строки (индекс 0)
         # Пропускаем ВТОРУЮ строку (индекс 1) с описаниями
@@ -92,9 +135,245 @@ def load_data_from_path(filepath: str) -> pd.DataFrame | None:
         current_app.logger.error(f"Ошибка чтения Excel '{filepath}': {e}", exc_info=True)
         return None
 
+# --- Книги с несколькими листами ---
+
+SHEET_COLUMN = "Лист"  # исходный лист строки при объединении листов без ключа
+
+_sheet_pool = None
+_sheet_pool_lock = threading.Lock()
+
+
+def list_sheet_names(filepath: str) -> list[str] | None:
+    """Имена листов книги. В режиме read_only данные листов не разбираются. None при ошибке."""
+    janitor.touch(filepath)
+    try:
+        from openpyxl import load_workbook
+        workbook = load_workbook(filepath, read_only=True)
+        try:
+            return list(workbook.sheetnames)
+        finally:
+            workbook.close()
+    except Exception as e:
+        current_app.logger.warning(f"Не удалось получить список листов '{filepath}': {e}")
+        return None
+
+
+@instrumented("ingest.sheet_headers")
+def read_sheet_headers(filepath: str, sheet_names: list[str] | None = None) -> dict[str, list[str]]:
+    """Заголовки (первая строка) указанных листов за одно открытие книги: {лист: [столбцы]}."""
+    headers = {}
+    janitor.touch(filepath)
+    try:
+        from openpyxl import load_workbook
+        workbook = load_workbook(filepath, read_only=True, data_only=True)
+        try:
+            for name in sheet_names or workbook.sheetnames:
+                header_row = next(workbook[name].iter_rows(min_row=1, max_row=1, values_only=True), None)
+                headers[name] = _clean_header(header_row) if header_row else []
+        finally:
+            workbook.close()
+    except Exception as e:
+        current_app.logger.warning(f"Не удалось прочитать заголовки листов '{filepath}': {e}")
+    return headers
+
+
+def _read_sheet(filepath: str, sheet_name: str, columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    Разбирает один лист (header=0, skiprows=[1], как load_data_from_path).
+    Выполняется в рабочем процессе, поэтому не использует Flask (current_app, flash).
+    """
+    usecols = None
+    if columns:
+        wanted = set(columns)
+        usecols = lambda name: str(name).strip() in wanted
+    df = pd.read_excel(filepath, sheet_name=sheet_name, engine='openpyxl', header=0, skiprows=[1], usecols=usecols)
+    df.columns = df.columns.astype(str).str.strip()
+    return df
+
+
+def _get_sheet_pool() -> ProcessPoolExecutor:
+    global _sheet_pool
+    with _sheet_pool_lock:
+        if _sheet_pool is None:
+            # forkserver/spawn: fork из сервера с потоками небезопасен (utils.processes)
+            _sheet_pool = ProcessPoolExecutor(max_workers=int(os.getenv('INGEST_WORKERS', min(4, os.cpu_count() or 1))),
+                                              mp_context=process_context())
+        return _sheet_pool
+
+
+def _parse_sheets(filepath: str, sheets: list[str], columns_by_sheet: dict) -> dict[str, pd.DataFrame]:
+    """Разбирает листы параллельно в рабочих процессах (один лист - без пула)."""
+    global _sheet_pool
+    if len(sheets) == 1:
+        return {sheets[0]: _read_sheet(filepath, sheets[0], columns_by_sheet.get(sheets[0]))}
+    try:
+        pool = _get_sheet_pool()
+        futures = {name: pool.submit(_read_sheet, filepath, name, columns_by_sheet.get(name)) for name in sheets}
+        return {name: future.result() for name, future in futures.items()}
+    except BrokenProcessPool as e:
+        current_app.logger.warning(f"Пул разбора листов недоступен ({e}), листы читаются последовательно.")
+        with _sheet_pool_lock:
+            _sheet_pool = None
+        return {name: _read_sheet(filepath, name, columns_by_sheet.get(name)) for name in sheets}
+
+
+def _aggregate_by_key(df: pd.DataFrame, join_key: str, sheet: str) -> pd.DataFrame:
+    """
+    Сворачивает лист с повторяющимся ключом (визиты, анализы) до строки на пациента:
+    числовые столбцы - среднее, остальные - первое значение, плюс число записей.
+    """
+    grouped = df.groupby(join_key, sort=False)
+    agg = grouped.agg({col: ('mean' if pd.api.types.is_numeric_dtype(df[col]) else 'first')
+                       for col in df.columns if col != join_key})
+    agg[f"{sheet}: число записей"] = grouped.size()
+    return agg.reset_index()
+
+
+def combine_sheets(frames: dict[str, pd.DataFrame], join_key: str | None = None) -> pd.DataFrame:
+    """
+    Объединяет листы в один DataFrame.
+
+    С ключом: левое соединение с первым листом по join_key; листы с повторяющимся
+    ключом сворачиваются (_aggregate_by_key); совпадающие имена столбцов получают
+    префикс листа ('Лист: столбец'). Без ключа: строки листов друг под другом со
+    столбцом SHEET_COLUMN.
+    """
+    if len(frames) == 1:
+        return next(iter(frames.values()))
+    if not join_key:
+        return pd.concat([df.assign(**{SHEET_COLUMN: name}) for name, df in frames.items()], ignore_index=True)
+
+    missing = [name for name, df in frames.items() if join_key not in df.columns]
+    if missing:
+        raise ValueError(f"Столбец-ключ '{join_key}' отсутствует на листах: {', '.join(missing)}")
+
+    prepared = {}
+    for position, (name, df) in enumerate(frames.items()):
+        if position > 0 and df[join_key].duplicated().any():
+            current_app.logger.info(f"Лист '{name}': ключ '{join_key}' повторяется, записи свернуты по пациенту.")
+            df = _aggregate_by_key(df, join_key, name)
+        prepared[name] = df
+
+    seen = {}
+    for df in prepared.values():
+        for col in df.columns:
+            seen[col] = seen.get(col, 0) + 1
+    result = None
+    for name, df in prepared.items():
+        df = df.rename(columns={col: f"{name}: {col}" for col in df.columns if col != join_key and seen[col] > 1})
+        result = df if result is None else result.merge(df, on=join_key, how='left')
+    return result
+
+
+# Разобранные книги процесса: этап 2 и предпросмотр берут DataFrame, разобранный на этапе 0
+FRAME_CACHE_MAX_BYTES = int(os.getenv('FRAME_CACHE_MAX_MB', 256)) * 1024 * 1024
+
+_frame_cache = OrderedDict()  # (путь, параметры загрузки, mtime, размер) -> DataFrame
+_frame_cache_bytes = 0
+_frame_cache_lock = threading.Lock()
+
+
+def _frame_key(filepath: str, load_options: dict | None):
+    try:
+        stat = os.stat(filepath)
+    except (OSError, TypeError):
+        return None
+    return (os.path.abspath(filepath), json.dumps(load_options or None, sort_keys=True), stat.st_mtime_ns, stat.st_size)
+
+
+def _remember_frame(key, df: pd.DataFrame):
+    global _frame_cache_bytes
+    size = int(df.memory_usage(deep=True).sum())
+    if size > FRAME_CACHE_MAX_BYTES:
+        return
+    with _frame_cache_lock:
+        if key in _frame_cache:
+            return
+        _frame_cache[key] = (df, size)
+        _frame_cache_bytes += size
+        while _frame_cache_bytes > FRAME_CACHE_MAX_BYTES:
+            _, (_, evicted_size) = _frame_cache.popitem(last=False)
+            _frame_cache_bytes -= evicted_size
+
+
+def _forget_frames(filepath: str):
+    global _frame_cache_bytes
+    path = os.path.abspath(filepath)
+    with _frame_cache_lock:
+        for key in [k for k in _frame_cache if k[0] == path]:
+            _frame_cache_bytes -= _frame_cache.pop(key)[1]
+
+
+def load_workbook_data(filepath: str, load_options: dict | None = None) -> pd.DataFrame | None:
+    """
+    Как parse_workbook_data, но книга, уже разобранная в этом процессе с теми же параметрами
+    (и не измененная с тех пор), берется из кеша. Возвращаемый DataFrame общий - не изменять.
+    """
+    key = _frame_key(filepath, load_options)
+    with _frame_cache_lock:
+        cached = _frame_cache.get(key) if key else None
+        if cached is not None:
+            _frame_cache.move_to_end(key)
+    record_cache('workbook_frame', cached is not None)
+    if cached is not None:
+        janitor.touch(filepath)
+        return cached[0]
+    df = parse_workbook_data(filepath, load_options)
+    if df is not None and key is not None:
+        _remember_frame(key, df)
+    return df
+
+
+@instrumented("ingest.multi_sheet_parse")
+def parse_workbook_data(filepath: str, load_options: dict | None = None) -> pd.DataFrame | None:
+    """
+    Загружает данные с учетом выбора листов.
+
+    load_options: {"sheets": [листы], "join_key": ключ или None, "columns": {лист: [столбцы]}}.
+    Без выбранных листов - прежнее поведение (первый лист, load_data_from_path).
+    """
+    sheets = (load_options or {}).get('sheets')
+    if not sheets:
+        return load_data_from_path(filepath)
+    if not filepath or not os.path.exists(filepath):
+        flash(f"Ошибка: Файл '{os.path.basename(filepath)}' не найден для загрузки данных.", "danger")
+        current_app.logger.error(f"Ошибка load_workbook_data: Файл не найден '{filepath}'")
+        return None
+    janitor.touch(filepath)
+
+    join_key = load_options.get('join_key') or None
+    columns_by_sheet = {}
+    for name, columns in (load_options.get('columns') or {}).items():
+        if columns:
+            columns_by_sheet[name] = list(columns) + ([join_key] if join_key and join_key not in columns else [])
+    try:
+        frames = _parse_sheets(filepath, list(sheets), columns_by_sheet)
+        df = combine_sheets(frames, join_key)
+    except ValueError as e:
+        flash(f"Ошибка объединения листов: {e}", "danger")
+        current_app.logger.error(f"Ошибка объединения листов '{filepath}': {e}")
+        return None
+    except Exception as e:
+        flash(f"Ошибка при чтении данных из файла '{os.path.basename(filepath)}': {e}", "danger")
+        current_app.logger.error(f"Ошибка чтения листов {sheets} из '{filepath}': {e}", exc_info=True)
+        return None
+
+    current_app.logger.info(f"Листы {sheets} прочитаны{f' и объединены по {join_key!r}' if join_key else ''}: "
+                            f"{len(df)} строк, {len(df.columns)} столбцов.")
+    if df.empty and df.columns.empty:
+        flash(f"Ошибка: Не удалось прочитать данные из файла '{os.path.basename(filepath)}'.", "danger")
+        return None
+    if df.empty:
+        flash(f"Предупреждение: Выбранные листы файла '{os.path.basename(filepath)}' не содержат данных.", "warning")
+    return df
+
+
 def cleanup_file(filepath: str):
     """Удаляет файл по указанному пути, если он существует."""
     # Здесь current_app не используется, можно оставить как есть
+    if filepath:
+        janitor.forget(filepath)
+        _forget_frames(filepath)
     if filepath and os.path.exists(filepath):
         try:
             os.remove(filepath)
@@ -109,6 +388,7 @@ def cleanup_file(filepath: str):
          logger.warning(f"Попытка удалить файл '{filepath}', но он не существует.")
 
 
+@instrumented("profile.completeness_report")
 def get_data_completeness_report(df: pd.DataFrame) -> dict | None:
     """
     Рассчитывает отчет о полноте данных (пропущенных значениях) в DataFrame.
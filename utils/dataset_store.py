@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+Серверное хранилище наборов данных и производных ресурсов (предложения LLM,
+планы, результаты) для JSON API.
+
+Хранится на диске в DATASET_STORE_DIR, поэтому id действителен во всех процессах
+приложения (воркеры gunicorn) и после перезапуска:
+    files/<sha256><расширение>          - файл набора данных (ключ - хеш содержимого,
+                                          одинаковые загрузки хранятся один раз);
+    <dataset_id>/dataset.json           - запись набора данных;
+    <dataset_id>/<вид>-<artifact_id>.json - производные ресурсы;
+    artifacts/<вид>-<artifact_id>.json  - индекс ресурса: id его набора данных (поиск
+                                          ресурса по id - одно чтение, без обхода наборов).
+Общий файл нескольких наборов защищен межпроцессной блокировкой files/<sha256>.lock
+(flock): регистрация набора и удаление файла после проверки ссылок не пересекаются.
+Время изменения dataset.json - последнее обращение к набору в любом процессе (по нему
+уборщик, utils.janitor, определяет срок жизни). Загруженный DataFrame и профиль
+кешируются в памяти процесса.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # не POSIX: блокировка только между потоками процесса
+    fcntl = None
+
+from . import janitor
+
+DATASET_STORE_DIR = os.getenv('DATASET_STORE_DIR', 'datasets')
+ARTIFACT_KINDS = ('suggestions', 'plans', 'results')
+
+_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+_lock = threading.Lock()
+_datasets = {}    # dataset_id -> dict (запись + "df", "profile" процесса)
+_load_locks = {}  # dataset_id -> Lock загрузки DataFrame/профиля
+_file_locks = {}  # sha256 -> Lock (между потоками; между процессами - flock)
+
+
+def _file_sha256(filepath: str) -> str:
+    """Хеш содержимого файла (используется как версия набора данных)."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _json_default(obj):
+    """numpy-скаляры и прочие нестандартные типы - в JSON-совместимые."""
+    if hasattr(obj, 'item'):
+        return obj.item()
+    return str(obj)
+
+
+def _write_json(path: str, payload: dict):
+    """Атомарная запись: читатели в других процессах не видят недописанный файл."""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, default=_json_default)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> dict | None:
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _files_dir() -> str:
+    return os.path.join(DATASET_STORE_DIR, 'files')
+
+
+@contextmanager
+def _shared_file_lock(sha256: str):
+    """
+    Эксклюзивная блокировка файла набора с данным хешем во всех процессах.
+    Файл блокировки не удаляется: удаление между open и flock другого процесса
+    дало бы двум процессам блокировки разных файлов.
+    """
+    with _lock:
+        thread_lock = _file_locks.setdefault(sha256, threading.Lock())
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(_files_dir(), exist_ok=True)
+        with open(os.path.join(_files_dir(), f"{sha256}.lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _dataset_dir(dataset_id: str) -> str:
+    return os.path.join(DATASET_STORE_DIR, dataset_id)
+
+
+def _meta_path(dataset_id: str) -> str:
+    return os.path.join(_dataset_dir(dataset_id), 'dataset.json')
+
+
+def _last_access(dataset_id: str) -> float | None:
+    try:
+        return os.path.getmtime(_meta_path(dataset_id))
+    except OSError:
+        return None
+
+
+def _track(dataset: dict):
+    try:
+        size = os.path.getsize(dataset["filepath"])
+    except OSError:
+        return
+    dataset_id = dataset["id"]
+    janitor.track(f"dataset:{dataset_id}", "dataset", size, evict=lambda: _evict_dataset(dataset_id),
+                  shared_access=lambda: _last_access(dataset_id))
+
+
+def register_dataset(filepath: str, original_filename: str, load_options: dict | None = None,
+                     sheet_names: list[str] | None = None) -> dict:
+    """
+    Регистрирует загруженный файл как набор данных и возвращает его запись.
+    Файл переносится в хранилище (files/<sha256>); путь в записи - "filepath".
+    load_options - выбор листов (см. data_loader.load_workbook_data), sheet_names - все листы книги.
+    """
+    sha256 = _file_sha256(filepath)
+    stored_path = os.path.join(_files_dir(), sha256 + os.path.splitext(filepath)[1].lower())
+    # Файл загрузки теперь принадлежит набору данных: срок жизни набора, удаление вместе с ним
+    janitor.forget(filepath)
+
+    record = {
+        "id": uuid.uuid4().hex,
+        "filepath": stored_path,
+        "filename": original_filename,
+        "load_options": load_options,
+        "sheet_names": sheet_names,
+        "sha256": sha256,
+        "created_at": time.time(),
+    }
+    # Проверка файла и запись dataset.json - под блокировкой: drop_dataset другого набора
+    # с тем же файлом либо увидит новую ссылку, либо удалит файл до проверки
+    with _shared_file_lock(sha256):
+        if os.path.exists(stored_path):
+            os.remove(filepath)
+        else:
+            shutil.move(filepath, stored_path)
+        os.makedirs(_dataset_dir(record["id"]))
+        _write_json(_meta_path(record["id"]), record)
+    dataset = {**record, "df": None, "profile": None}  # DataFrame и профиль загружаются лениво
+    with _lock:
+        _datasets[record["id"]] = dataset
+    _track(dataset)
+    return dataset
+
+
+def _evict_dataset(dataset_id: str):
+    """Удаление набора данных уборщиком (utils.janitor): запись, производные ресурсы и файл."""
+    drop_dataset(dataset_id)
+
+
+def get_dataset(dataset_id: str) -> dict | None:
+    if not _ID_PATTERN.match(dataset_id or ''):
+        return None
+    try:
+        # Отметка обращения, видимая другим процессам
+        os.utime(_meta_path(dataset_id))
+    except OSError:
+        # Набор удален (возможно, другим процессом)
+        with _lock:
+            _datasets.pop(dataset_id, None)
+        janitor.forget(f"dataset:{dataset_id}")
+        return None
+    with _lock:
+        dataset = _datasets.get(dataset_id)
+    if dataset is None:
+        record = _read_json(_meta_path(dataset_id))
+        if record is None or not os.path.exists(record["filepath"]):
+            return None
+        with _lock:
+            dataset = _datasets.setdefault(dataset_id, {**record, "df": None, "profile": None})
+        _track(dataset)
+    janitor.touch(f"dataset:{dataset_id}")
+    return dataset
+
+
+def track_stored_datasets():
+    """
+    Берет на учет уборщика наборы, сохраненные до запуска процесса (иначе они не истекут),
+    и дополняет индекс ресурсов, сохраненных без него.
+    """
+    try:
+        entries = [entry.name for entry in os.scandir(DATASET_STORE_DIR) if _ID_PATTERN.match(entry.name)]
+    except OSError:
+        return
+    for dataset_id in entries:
+        record = _read_json(_meta_path(dataset_id))
+        if record is not None:
+            _track(record)
+            for name in _artifact_names(dataset_id):
+                if not os.path.exists(_index_path(name)):
+                    _index_artifact(name, dataset_id)
+
+
+def dataset_lock(dataset_id: str) -> threading.Lock:
+    """Блокировка загрузки DataFrame/профиля набора (один разбор файла на процесс)."""
+    with _lock:
+        return _load_locks.setdefault(dataset_id, threading.Lock())
+
+
+def drop_dataset(dataset_id: str) -> dict | None:
+    """
+    Удаляет набор данных и все связанные с ним ресурсы; файл - если на него не ссылаются
+    другие наборы. Возвращает удаленную запись.
+    """
+    if not _ID_PATTERN.match(dataset_id or ''):
+        return None
+    with _lock:
+        dataset = _datasets.pop(dataset_id, None)
+        _load_locks.pop(dataset_id, None)
+    janitor.forget(f"dataset:{dataset_id}")
+    record = _read_json(_meta_path(dataset_id)) or dataset
+    artifact_names = _artifact_names(dataset_id)
+    shutil.rmtree(_dataset_dir(dataset_id), ignore_errors=True)
+    _remove_index(artifact_names)
+    if record is None:
+        return None
+    with _shared_file_lock(record["sha256"]):
+        still_used = any(
+            (_read_json(os.path.join(entry.path, 'dataset.json')) or {}).get("sha256") == record["sha256"]
+            for entry in os.scandir(DATASET_STORE_DIR) if _ID_PATTERN.match(entry.name))
+        if not still_used:
+            try:
+                os.remove(record["filepath"])
+            except OSError:
+                pass
+    return dataset or {**record, "df": None, "profile": None}
+
+
+def _artifact_path(kind: str, dataset_id: str, artifact_id: str) -> str:
+    return os.path.join(_dataset_dir(dataset_id), f"{kind}-{artifact_id}.json")
+
+
+def _index_path(artifact_name: str) -> str:
+    """Запись индекса для ресурса '<вид>-<artifact_id>.json'."""
+    return os.path.join(DATASET_STORE_DIR, 'artifacts', artifact_name)
+
+
+def _index_artifact(artifact_name: str, dataset_id: str):
+    os.makedirs(os.path.dirname(_index_path(artifact_name)), exist_ok=True)
+    _write_json(_index_path(artifact_name), {"dataset_id": dataset_id})
+
+
+def _remove_index(artifact_names):
+    for name in artifact_names:
+        try:
+            os.remove(_index_path(name))
+        except OSError:
+            pass
+
+
+def _artifact_names(dataset_id: str) -> list[str]:
+    try:
+        return [name for name in os.listdir(_dataset_dir(dataset_id))
+                if name.endswith('.json') and name != 'dataset.json']
+    except OSError:
+        return []
+
+
+def put_artifact(kind: str, dataset_id: str, payload: dict) -> dict:
+    """Сохраняет производный ресурс ('suggestions', 'plans', 'results')."""
+    artifact = {
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        "dataset_id": dataset_id,
+        "created_at": time.time(),
+        **payload,
+    }
+    _write_json(_artifact_path(kind, dataset_id, artifact["id"]), artifact)
+    _index_artifact(f"{kind}-{artifact['id']}.json", dataset_id)
+    return artifact
+
+
+def update_artifact(artifact: dict, **fields) -> dict:
+    """Обновляет поля сохраненного ресурса (например, результаты точного расчета)."""
+    artifact.update(fields)
+    path = _artifact_path(artifact["kind"], artifact["dataset_id"], artifact["id"])
+    if os.path.isdir(os.path.dirname(path)):  # набор мог быть удален за время расчета
+        _write_json(path, artifact)
+    return artifact
+
+
+def get_artifact(kind: str, artifact_id: str) -> dict | None:
+    if kind not in ARTIFACT_KINDS or not _ID_PATTERN.match(artifact_id or ''):
+        return None
+    name = f"{kind}-{artifact_id}.json"
+    dataset_id = (_read_json(_index_path(name)) or {}).get("dataset_id")
+    if not _ID_PATTERN.match(dataset_id or ''):
+        return None
+    artifact = _read_json(_artifact_path(kind, dataset_id, artifact_id))
+    if artifact is None:
+        _remove_index([name])  # набор удален, запись индекса осталась
+    return artifact
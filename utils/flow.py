@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Представления, ожидающие LLM, в виде генераторов: один код для WSGI и ASGI.
+
+Вместо блокирующих вызовов генератор отдает (yield) шаги и получает их результат:
+    LLMCall(sync_func, async_func, ...) - запрос к LLM;
+    Offload(func, ...)                  - CPU-работа (разбор файла, профиль, ожидание спекуляции);
+    Wait(future)                        - ожидание concurrent.futures.Future из фонового пула.
+
+Под WSGI (flow_view) шаги выполняются синхронно, как раньше. ASGI-приложение
+(asgi.py) исполняет тот же генератор на event loop через run_flow_async: запрос к
+Gemini идет через generate_content_async, CPU-работа - в пуле потоков, и поток
+не простаивает, пока LLM отвечает. Код представления между шагами (сохранение
+файла, слияние предложений, render_template) тоже выполняется в пуле, а не на
+event loop; при профилировании запроса (utils.profiling) эти потоки добавляются
+к профилю на время работы. Исключения шагов пробрасываются в генератор, поэтому обработка ошибок
+в представлениях не меняется.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import Executor, Future
+
+from .llm_handler import (get_initial_assessment, get_initial_assessment_async,
+                          get_detailed_plan_proposal, get_detailed_plan_proposal_async)
+from .profiling import profile_current_thread
+
+
+class LLMCall:
+    def __init__(self, sync_func, async_func, *args, **kwargs):
+        self.sync_func, self.async_func, self.args, self.kwargs = sync_func, async_func, args, kwargs
+
+
+class Offload:
+    def __init__(self, func, *args, **kwargs):
+        self.func, self.args, self.kwargs = func, args, kwargs
+
+
+class Wait:
+    def __init__(self, future: Future):
+        self.future = future
+
+
+def initial_assessment(*args, **kwargs) -> LLMCall:
+    """Шаг: этап 0 (аргументы как у llm_handler.get_initial_assessment)."""
+    return LLMCall(get_initial_assessment, get_initial_assessment_async, *args, **kwargs)
+
+
+def plan_proposal(*args, **kwargs) -> LLMCall:
+    """Шаг: этап 1 (аргументы как у llm_handler.get_detailed_plan_proposal)."""
+    return LLMCall(get_detailed_plan_proposal, get_detailed_plan_proposal_async, *args, **kwargs)
+
+
+def _resolve_sync(step):
+    if isinstance(step, LLMCall):
+        return step.sync_func(*step.args, **step.kwargs)
+    if isinstance(step, Offload):
+        return step.func(*step.args, **step.kwargs)
+    if isinstance(step, Wait):
+        return step.future.result()
+    raise TypeError(f"Неизвестный шаг представления: {step!r}")
+
+
+def _call_profiled(func):
+    """Вызов в потоке пула с учетом профилирования запроса."""
+    with profile_current_thread():
+        return func()
+
+
+async def _resolve_async(step, executor: Executor | None, context: contextvars.Context):
+    if isinstance(step, LLMCall):
+        return await step.async_func(*step.args, **step.kwargs)
+    if isinstance(step, Offload):
+        # Копия contextvars: в потоке доступны текущие контексты Flask (request, session, g)
+        call = functools.partial(step.func, *step.args, **step.kwargs)
+        return await asyncio.get_running_loop().run_in_executor(executor, context.copy().run, _call_profiled, call)
+    if isinstance(step, Wait):
+        return await asyncio.wrap_future(step.future)
+    raise TypeError(f"Неизвестный шаг представления: {step!r}")
+
+
+def run_flow_sync(gen):
+    """Исполняет генератор представления синхронно и возвращает его результат."""
+    value, error = None, None
+    while True:
+        try:
+            step = gen.throw(error) if error is not None else gen.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value, error = None, None
+        try:
+            value = _resolve_sync(step)
+        except Exception as e:
+            error = e
+
+
+def _advance(gen, value, error):
+    """Выполняет код представления до следующего шага: (True, шаг) или (False, результат)."""
+    with profile_current_thread():
+        try:
+            return True, (gen.throw(error) if error is not None else gen.send(value))
+        except StopIteration as stop:
+            return False, stop.value
+
+
+async def run_flow_async(gen, executor: Executor | None = None):
+    """
+    Исполняет генератор представления: ожидание шагов - на event loop, код между шагами
+    и Offload - в executor. Один контекст contextvars на весь генератор, поэтому
+    контексты Flask и значения, установленные представлением (plot_output), сохраняются между шагами.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    value, error = None, None
+    while True:
+        has_step, result = await loop.run_in_executor(executor, context.run, _advance, gen, value, error)
+        if not has_step:
+            return result
+        value, error = None, None
+        try:
+            value = await _resolve_async(result, executor, context)
+        except Exception as e:
+            error = e
+
+
+def flow_view(gen_func):
+    """
+    Декоратор представления-генератора. Flask вызывает обычную синхронную функцию,
+    а исходный генератор доступен ASGI-приложению как атрибут .flow.
+    """
+    @functools.wraps(gen_func)
+    def view(*args, **kwargs):
+        return run_flow_sync(gen_func(*args, **kwargs))
+    view.flow = gen_func
+    return view
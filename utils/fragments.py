@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Кеш отрисованных фрагментов страниц и предварительная компиляция шаблонов.
+
+Тяжелые части страниц подтверждения (таблица полноты, список столбцов с
+процентом пропусков, сводка плана) вынесены в частичные шаблоны (templates/_*.html)
+и вставляются через cached_fragment(имя, ключ, **контекст). Ключ - хеш набора
+данных (utils.pipeline.profile_dataframe) и/или плана; повторная отрисовка с тем же
+ключом (ошибка формы, возврат на страницу, повторный показ плана) берет готовый
+HTML. Кеш в памяти процесса, LRU с лимитом FRAGMENT_CACHE_MAX_BYTES.
+
+Шаблоны компилируются при запуске приложения (TEMPLATE_PRECOMPILE), байт-код
+сохраняется в TEMPLATE_CACHE_DIR (по умолчанию - временный каталог Jinja), поэтому
+первые запросы и новые процессы-воркеры не тратят время на разбор шаблонов.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from flask import render_template
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+from .metrics import record_cache
+
+FRAGMENT_CACHE_MAX_BYTES = int(os.getenv('FRAGMENT_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+_cache = OrderedDict()  # (шаблон, хеш ключа) -> HTML
+_cache_bytes = 0
+_lock = threading.Lock()
+
+
+def content_hash(obj) -> str:
+    """Хеш JSON-представления (порядок ключей словарей не важен)."""
+    payload = json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def cached_fragment(template_name: str, key, **context) -> Markup:
+    """
+    Отрисованный частичный шаблон из кеша или новый (и кладется в кеш).
+    key должен однозначно определять результат при данном context.
+    """
+    global _cache_bytes
+    cache_key = (template_name, content_hash(key))
+    with _lock:
+        html = _cache.get(cache_key)
+        if html is not None:
+            _cache.move_to_end(cache_key)
+    record_cache(f"fragment.{template_name}", html is not None)
+    if html is not None:
+        return Markup(html)
+
+    html = render_template(template_name, **context)
+    with _lock:
+        if cache_key not in _cache:
+            _cache[cache_key] = html
+            _cache_bytes += len(html)
+        while _cache_bytes > FRAGMENT_CACHE_MAX_BYTES and len(_cache) > 1:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= len(evicted)
+    return Markup(html)
+
+
+def precompile_templates(app) -> int:
+    """Компилирует все шаблоны приложения заранее. Возвращает число шаблонов."""
+    compiled = 0
+    for name in app.jinja_env.list_templates(extensions=('html',)):
+        try:
+            app.jinja_env.get_template(name)
+            compiled += 1
+        except Exception as e:
+            app.logger.error(f"Не удалось скомпилировать шаблон '{name}': {e}")
+    return compiled
+
+
+def init_app(app):
+    """Функция cached_fragment в шаблонах, кеш байт-кода и предварительная компиляция шаблонов."""
+    app.config.setdefault('TEMPLATE_PRECOMPILE', os.getenv('TEMPLATE_PRECOMPILE', 'True').lower() == 'true')
+    app.config.setdefault('TEMPLATE_CACHE_DIR', os.getenv('TEMPLATE_CACHE_DIR') or None)
+    app.jinja_env.globals['cached_fragment'] = cached_fragment
+    if app.config['TEMPLATE_PRECOMPILE']:
+        cache_dir = app.config['TEMPLATE_CACHE_DIR']
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        precompile_templates(app)
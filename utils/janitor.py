@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Фоновая очистка загрузок, наборов данных API и графиков: сроки жизни и дисковая квота.
+
+Модули регистрируют ресурсы (track) с размером и функцией удаления и отмечают
+обращения (touch); явное удаление (cleanup_file, drop_dataset) снимает ресурс с
+учета (forget). Поток-уборщик раз в JANITOR_INTERVAL_S:
+    * удаляет ресурсы, к которым не обращались дольше срока жизни их вида
+      (JANITOR_TTL_UPLOAD_S, JANITOR_TTL_DATASET_S, JANITOR_TTL_PLOT_S);
+    * если файлы на диске (загрузки и наборы данных) занимают больше
+      JANITOR_DISK_QUOTA_MB - удаляет самые давно использованные, пока не уложится
+      (не трогая ресурсы, к которым обращались последние JANITOR_MIN_IDLE_S);
+    * удаляет файлы в UPLOAD_FOLDER, которых нет в учете, если их владелец известен
+      и завершился (остались после перезапуска) и они старше срока жизни загрузок;
+    * удаляет профили запросов (PROFILE_DIR, utils.profiling) старше
+      JANITOR_TTL_PROFILE_S и сверх JANITOR_MAX_PROFILES самых новых.
+Реестр ресурсов - в памяти процесса, поэтому у каждого учтенного файла есть метка
+владельца "<файл>.owner" (хост, pid и время запуска процесса). Неучтенный файл без
+метки или с меткой другого работающего процесса (соседний воркер gunicorn) не удаляется.
+Запросы только обновляют словарь под блокировкой; удаление файлов идет в потоке
+уборщика. Освобожденные байты - в метрике statonco_janitor_reclaimed_bytes_total.
+"""
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+from .metrics import inc_counter, set_gauge
+
+# Виды ресурсов, занимающих место на диске (учитываются в квоте)
+DISK_KINDS = ("upload", "dataset")
+OWNER_SUFFIX = ".owner"
+
+_lock = threading.Lock()
+_resources = {}  # ключ -> {"kind", "size", "last_access", "evict", "shared_access"}
+_thread = None
+
+
+def track(key: str, kind: str, size: int, evict, shared_access=None):
+    """
+    Берет ресурс на учет (повторный вызов с тем же ключом обновляет вид, размер и evict).
+    shared_access() - время последнего обращения к ресурсу в любом процессе (или None),
+    если ресурс общий для процессов (наборы данных utils.dataset_store).
+    """
+    with _lock:
+        _resources[key] = {"kind": kind, "size": size, "last_access": time.time(), "evict": evict,
+                           "shared_access": shared_access}
+
+
+def _process_start(pid) -> str:
+    """Время запуска процесса (отличает процесс от более позднего с тем же pid); '' если неизвестно."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return ''
+
+
+def _owner_id() -> str:
+    pid = os.getpid()
+    return f"{socket.gethostname()}:{pid}:{_process_start(pid)}"
+
+
+def _owner_alive(owner: str) -> bool:
+    """Работает ли процесс-владелец; процессы других хостов проверить нельзя - считаются работающими."""
+    host, pid, start = (owner.split(':') + ['', '', ''])[:3]
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return _process_start(pid) == start
+
+
+def _read_owner(filepath: str) -> str | None:
+    try:
+        with open(filepath + OWNER_SUFFIX, encoding='utf-8') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _remove_owner(filepath: str):
+    try:
+        os.remove(filepath + OWNER_SUFFIX)
+    except OSError:
+        pass
+
+
+def track_file(filepath: str, kind: str = "upload", evict=None):
+    """Берет на учет файл и ставит метку владельца; по умолчанию при вытеснении файл просто удаляется."""
+    try:
+        size = os.path.getsize(filepath)
+        with open(filepath + OWNER_SUFFIX, 'w', encoding='utf-8') as f:
+            f.write(_owner_id())
+    except OSError:
+        return
+    track(os.path.abspath(filepath), kind, size, evict or (lambda: os.remove(filepath)))
+
+
+def touch(key: str):
+    """Отмечает обращение к ресурсу (для файлов ключ - путь)."""
+    if not key:
+        return
+    now = time.time()
+    with _lock:
+        resource = _resources.get(key) or _resources.get(os.path.abspath(key))
+        if resource is not None:
+            resource["last_access"] = now
+
+
+def forget(key: str):
+    """Снимает ресурс с учета (он уже удален вызывающим кодом)."""
+    if not key:
+        return
+    with _lock:
+        resource = _resources.pop(key, None) or _resources.pop(os.path.abspath(key), None)
+    if resource is not None and resource["kind"] in DISK_KINDS:
+        _remove_owner(key)
+
+
+def _select_victims(now: float, config: dict) -> list[tuple[str, dict, str]]:
+    """Выбирает под блокировкой ресурсы к удалению: [(ключ, ресурс, причина)], снимая их с учета."""
+    ttl = {"upload": config['JANITOR_TTL_UPLOAD_S'], "dataset": config['JANITOR_TTL_DATASET_S'],
+           "plot": config['JANITOR_TTL_PLOT_S']}
+    victims = []
+    with _lock:
+        for key, resource in list(_resources.items()):
+            if resource.get("shared_access"):
+                resource["last_access"] = max(resource["last_access"], resource["shared_access"]() or 0)
+            limit = ttl.get(resource["kind"])
+            if limit and now - resource["last_access"] > limit:
+                victims.append((key, _resources.pop(key), "ttl"))
+
+        quota = config['JANITOR_DISK_QUOTA_MB'] * 1024 * 1024
+        on_disk = sorted(((r["last_access"], key) for key, r in _resources.items() if r["kind"] in DISK_KINDS))
+        used = sum(_resources[key]["size"] for _, key in on_disk)
+        for last_access, key in on_disk:
+            if used <= quota or now - last_access < config['JANITOR_MIN_IDLE_S']:
+                break
+            resource = _resources.pop(key)
+            used -= resource["size"]
+            victims.append((key, resource, "quota"))
+
+        for kind in ("upload", "dataset", "plot"):
+            set_gauge("statonco_janitor_tracked_bytes", sum(r["size"] for r in _resources.values() if r["kind"] == kind),
+                      help_text="Учтенный уборщиком объем ресурсов, байт, по виду.", kind=kind)
+    return victims
+
+
+def _reclaimed(kind: str, reason: str, size: int):
+    inc_counter("statonco_janitor_evictions_total", help_text="Ресурсы, удаленные уборщиком, по виду и причине.",
+                kind=kind, reason=reason)
+    inc_counter("statonco_janitor_reclaimed_bytes_total", size,
+                help_text="Освобожденный уборщиком объем, байт, по виду и причине.", kind=kind, reason=reason)
+
+
+def _sweep_orphans(upload_folder: str, max_age_s: float, logger) -> int:
+    """
+    Удаляет неучтенные файлы загрузок старше max_age_s, владелец которых - этот процесс
+    или завершившийся процесс. Возвращает число освобожденных байт.
+    """
+    reclaimed = 0
+    now = time.time()
+    try:
+        entries = list(os.scandir(upload_folder))
+    except OSError:
+        return 0
+    with _lock:
+        tracked = set(_resources)
+    me = _owner_id()
+    names = {entry.name for entry in entries}
+    for entry in entries:
+        try:
+            if not entry.is_file() or os.path.abspath(entry.path) in tracked:
+                continue
+            if entry.name.endswith(OWNER_SUFFIX):
+                # Метка без файла (файл удален, процесс завершился до снятия метки)
+                if entry.name[:-len(OWNER_SUFFIX)] not in names and now - entry.stat().st_mtime > max_age_s:
+                    os.remove(entry.path)
+                continue
+            owner = _read_owner(entry.path)
+            if owner is None or (owner != me and _owner_alive(owner)):
+                continue
+            stat = entry.stat()
+            if now - max(stat.st_mtime, stat.st_atime) <= max_age_s:
+                continue
+            os.remove(entry.path)
+        except OSError:
+            continue
+        _remove_owner(entry.path)
+        reclaimed += stat.st_size
+        _reclaimed("upload", "orphan", stat.st_size)
+        logger.info(f"Уборщик: удален неучтенный файл '{entry.path}' ({stat.st_size} байт).")
+    return reclaimed
+
+
+def _sweep_profiles(profile_dir: str, max_age_s: float, max_count: int, logger) -> int:
+    """Удаляет профили (метаданные и файл данных) старше max_age_s и сверх max_count новых."""
+    try:
+        entries = [entry for entry in os.scandir(profile_dir) if entry.is_file()]
+    except OSError:
+        return 0
+    profiles = {}  # имя профиля -> [(путь, размер, mtime)]
+    for entry in entries:
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        profiles.setdefault(os.path.splitext(entry.name)[0], []).append((entry.path, stat.st_size, stat.st_mtime))
+    now = time.time()
+    newest_first = sorted(profiles.items(), key=lambda item: max(f[2] for f in item[1]), reverse=True)
+    reclaimed = 0
+    for index, (name, files) in enumerate(newest_first):
+        expired = max_age_s and now - max(f[2] for f in files) > max_age_s
+        if not expired and not (max_count and index >= max_count):
+            continue
+        for path, size, _ in files:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            reclaimed += size
+            _reclaimed("profile", "ttl" if expired else "quota", size)
+        logger.info(f"Уборщик: удален профиль запроса '{name}'.")
+    return reclaimed
+
+
+def sweep(app) -> int:
+    """Один проход уборщика. Возвращает число освобожденных байт."""
+    victims = _select_victims(time.time(), app.config)
+    reclaimed = 0
+    for key, resource, reason in victims:
+        try:
+            resource["evict"]()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            app.logger.error(f"Уборщик: не удалось удалить '{key}': {e}")
+            continue
+        reclaimed += resource["size"]
+        _reclaimed(resource["kind"], reason, resource["size"])
+        if resource["kind"] in DISK_KINDS:
+            _remove_owner(key)
+            app.logger.info(f"Уборщик: удален {resource['kind']} '{key}' ({resource['size']} байт, причина: {reason}).")
+    reclaimed += _sweep_orphans(app.config['UPLOAD_FOLDER'], app.config['JANITOR_TTL_UPLOAD_S'], app.logger)
+    if app.config.get('PROFILE_DIR'):
+        reclaimed += _sweep_profiles(app.config['PROFILE_DIR'], app.config['JANITOR_TTL_PROFILE_S'],
+                                     app.config['JANITOR_MAX_PROFILES'], app.logger)
+    return reclaimed
+
+
+def _run(app):
+    while True:
+        time.sleep(app.config['JANITOR_INTERVAL_S'])
+        try:
+            with app.app_context():
+                sweep(app)
+        except Exception as e:
+            app.logger.error(f"Ошибка уборщика: {e}")
+
+
+def init_app(app):
+    """Настройки уборщика и запуск фонового потока (JANITOR_INTERVAL_S=0 - поток не запускается)."""
+    global _thread
+    app.config.setdefault('JANITOR_INTERVAL_S', float(os.getenv('JANITOR_INTERVAL_S', 60)))
+    app.config.setdefault('JANITOR_TTL_UPLOAD_S', float(os.getenv('JANITOR_TTL_UPLOAD_S', 2 * 3600)))
+    app.config.setdefault('JANITOR_TTL_DATASET_S', float(os.getenv('JANITOR_TTL_DATASET_S', 24 * 3600)))
+    app.config.setdefault('JANITOR_TTL_PLOT_S', float(os.getenv('JANITOR_TTL_PLOT_S', 3600)))
+    app.config.setdefault('JANITOR_TTL_PROFILE_S', float(os.getenv('JANITOR_TTL_PROFILE_S', 7 * 24 * 3600)))
+    app.config.setdefault('JANITOR_MAX_PROFILES', int(os.getenv('JANITOR_MAX_PROFILES', 200)))
+    app.config.setdefault('JANITOR_DISK_QUOTA_MB', float(os.getenv('JANITOR_DISK_QUOTA_MB', 1024)))
+    app.config.setdefault('JANITOR_MIN_IDLE_S', float(os.getenv('JANITOR_MIN_IDLE_S', 60)))
+    # Процессы-исполнители планов (utils.scheduler, spawn/forkserver) заново выполняют модуль
+    # запуска приложения; убирает только основной процесс
+    if multiprocessing.current_process().name != 'MainProcess':
+        return
+    if app.config['JANITOR_INTERVAL_S'] > 0 and _thread is None:
+        _thread = threading.Thread(target=_run, args=(app,), name="statonco-janitor", daemon=True)
+        _thread.start()
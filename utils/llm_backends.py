@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Бэкенды LLM: Gemini и локальные заглушки для нагрузочного тестирования.
+
+Бэкенд выбирается конфигурацией LLM_BACKEND:
+    gemini - Google Gemini (по умолчанию);
+    stub   - заглушка в процессе: схемно-корректные ответы без сети;
+    http   - HTTP-заглушка (benchmarks/llm_stub_server.py) по адресу LLM_STUB_URL,
+             например, чтобы нагружать запущенный gunicorn/uvicorn без доступа к Gemini.
+
+Заглушки имитируют задержку (LLM_STUB_LATENCY_S ± LLM_STUB_JITTER_S), ошибки
+сервера (LLM_STUB_ERROR_RATE) и ответы 429 (LLM_STUB_RATE_LIMIT_RATE) - исключениями
+google.api_core, поэтому обработка ошибок в llm_handler работает как с настоящим API.
+Бенчмарки подставляют готовый экземпляр бэкенда через use_backend.
+"""
+import abc
+import ast
+import asyncio
+import json
+import os
+import random
+import time
+import urllib.error
+import urllib.request
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_api_exceptions
+from flask import current_app
+
+from .prompt_builder import estimate_tokens, parse_column_line
+
+BACKENDS = ('gemini', 'stub', 'http')
+
+_INITIAL_COLUMNS_MARKER = "Доступные столбцы в данных:\n"
+_PLAN_COLUMNS_MARKER = "Столбцы, которые пользователь подтвердил для использования в анализе:\n"
+_EXTENSION_KEY = 'statonco_llm_backend'
+
+
+class StubResponse:
+    """Минимальный аналог ответа Gemini: text, parts, prompt_feedback."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.parts = [text]
+        self.prompt_feedback = None
+
+
+class LLMBackend(abc.ABC):
+    """Интерфейс бэкенда: синхронный и асинхронный вызов модели."""
+
+    @abc.abstractmethod
+    def generate(self, prompt: str, generation_config=None):
+        """Ответ модели на prompt (объект с text, parts, prompt_feedback)."""
+
+    @abc.abstractmethod
+    async def generate_async(self, prompt: str, generation_config=None):
+        """Асинхронный вариант generate."""
+
+
+class GeminiBackend(LLMBackend):
+    def __init__(self, model_name: str):
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt: str, generation_config=None):
+        return self.model.generate_content(prompt, generation_config=generation_config)
+
+    async def generate_async(self, prompt: str, generation_config=None):
+        return await self.model.generate_content_async(prompt, generation_config=generation_config)
+
+
+def _prompt_section(prompt: str, marker: str) -> list[str]:
+    """Строки блока промпта после marker до первой пустой строки."""
+    start = prompt.find(marker)
+    if start < 0:
+        return []
+    lines = []
+    for line in prompt[start + len(marker):].splitlines():
+        if not line.strip():
+            break
+        lines.append(line)
+    return lines
+
+
+def _literal_list(line: str) -> list[str]:
+    try:
+        value = ast.literal_eval(line.strip())
+    except (ValueError, SyntaxError):
+        return []
+    return [str(v) for v in value] if isinstance(value, list) else []
+
+
+def prompt_columns(prompt: str) -> list[str]:
+    """
+    Имена столбцов из промпта этапа 0 или 1: список Python либо компактный блок
+    prompt_builder (строка-легенда, затем 'имя|тип|%' по строке на столбец; имена
+    со служебными символами - JSON-строкой).
+    """
+    lines = _prompt_section(prompt, _PLAN_COLUMNS_MARKER) or _prompt_section(prompt, _INITIAL_COLUMNS_MARKER)
+    if not lines:
+        return []
+    if lines[0].lstrip().startswith('['):
+        return _literal_list(lines[0])
+    return [parse_column_line(line) for line in lines[1:] if not line.startswith('(')]
+
+
+def stub_payload(prompt: str, max_columns: int = 3) -> dict | list:
+    """
+    Схемно-корректный ответ для промпта: на этапе 0 - первые max_columns столбцов
+    (в компактном блоке они уже отсортированы по релевантности) и один вопрос,
+    на этапе 1 - описательные статистики по каждому подтвержденному столбцу.
+    """
+    columns = prompt_columns(prompt)
+    if _PLAN_COLUMNS_MARKER in prompt:
+        return [{"analysis_type": "descriptive_stats", "variable": column} for column in columns[:max_columns]]
+    return {
+        "suggested_columns": columns[:max_columns],
+        "questions_to_user": ["Какую группу считать контрольной?"] if columns else [],
+    }
+
+
+class StubBackend(LLMBackend):
+    """
+    Заглушка в процессе с настраиваемыми задержкой и долей ошибок.
+
+    suggestions / plan - фиксированные ответы этапов 0 и 1 вместо построенных по промпту
+    (stub_payload); latency_per_1k_tokens_s - рост задержки с длиной промпта;
+    если передан calls, туда дописываются промпты.
+    """
+
+    def __init__(self, latency_s: float = 0.0, jitter_s: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, seed: int | None = None, suggestions: dict | None = None,
+                 plan: list | None = None, latency_per_1k_tokens_s: float = 0.0, calls: list | None = None):
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rng = random.Random(seed)
+        self.suggestions = suggestions
+        self.plan = plan
+        self.latency_per_1k_tokens_s = latency_per_1k_tokens_s
+        self.calls = calls
+
+    def delay(self, prompt: str = "") -> float:
+        """Имитируемая задержка очередного ответа, с."""
+        delay = self.latency_s + self.rng.uniform(-self.jitter_s, self.jitter_s)
+        if self.latency_per_1k_tokens_s:
+            delay += self.latency_per_1k_tokens_s * estimate_tokens(prompt) / 1000
+        return max(delay, 0.0)
+
+    def payload(self, prompt: str) -> dict | list:
+        if _PLAN_COLUMNS_MARKER in prompt:
+            fixed = self.plan
+        else:
+            fixed = self.suggestions
+        return fixed if fixed is not None else stub_payload(prompt)
+
+    def respond(self, prompt: str):
+        """Ответ заглушки или исключение google.api_core (429 / 500)."""
+        if self.calls is not None:
+            self.calls.append(prompt)
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            raise google_api_exceptions.ResourceExhausted("Заглушка LLM: превышен лимит запросов (429).")
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise google_api_exceptions.InternalServerError("Заглушка LLM: внутренняя ошибка сервера (500).")
+        return StubResponse(json.dumps(self.payload(prompt), ensure_ascii=False))
+
+    def generate(self, prompt: str, generation_config=None):
+        time.sleep(self.delay(prompt))
+        return self.respond(prompt)
+
+    async def generate_async(self, prompt: str, generation_config=None):
+        await asyncio.sleep(self.delay(prompt))
+        return self.respond(prompt)
+
+
+class HttpStubBackend(LLMBackend):
+    """Клиент HTTP-заглушки: POST {"prompt"} -> {"text"}; коды 429/5xx - ошибки API."""
+
+    def __init__(self, url: str, timeout_s: float = 120.0):
+        self.url = url
+        self.timeout_s = timeout_s
+
+    def generate(self, prompt: str, generation_config=None):
+        request = urllib.request.Request(self.url, data=json.dumps({"prompt": prompt}).encode('utf-8'),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout_s) as response:
+                return StubResponse(json.loads(response.read().decode('utf-8'))["text"])
+        except urllib.error.HTTPError as e:
+            raise google_api_exceptions.from_http_status(e.code, f"HTTP-заглушка LLM: {e.reason}") from e
+        except urllib.error.URLError as e:
+            raise google_api_exceptions.ServiceUnavailable(f"HTTP-заглушка LLM недоступна: {e.reason}") from e
+
+    async def generate_async(self, prompt: str, generation_config=None):
+        # urllib синхронный: в ASGI-режиме запрос уходит в поток по умолчанию
+        return await asyncio.to_thread(self.generate, prompt, generation_config)
+
+
+def use_backend(app, backend: LLMBackend):
+    """
+    Подставляет готовый бэкенд для всех вызовов LLM приложения (бенчмарки, тесты)
+    вместо создаваемого по LLM_BACKEND. Возвращает функцию, отменяющую подстановку.
+    """
+    previous = app.extensions.get(_EXTENSION_KEY)
+    app.extensions[_EXTENSION_KEY] = backend
+
+    def restore():
+        if previous is None:
+            app.extensions.pop(_EXTENSION_KEY, None)
+        else:
+            app.extensions[_EXTENSION_KEY] = previous
+    return restore
+
+
+def create_backend(model_name: str) -> LLMBackend:
+    """Создает бэкенд по конфигурации приложения (LLM_BACKEND и LLM_STUB_*) или берет подставленный use_backend."""
+    override = current_app.extensions.get(_EXTENSION_KEY)
+    if override is not None:
+        return override
+    config = current_app.config
+    kind = config.get('LLM_BACKEND', 'gemini')
+    if kind == 'stub':
+        return StubBackend(latency_s=config['LLM_STUB_LATENCY_S'], jitter_s=config['LLM_STUB_JITTER_S'],
+                           error_rate=config['LLM_STUB_ERROR_RATE'], rate_limit_rate=config['LLM_STUB_RATE_LIMIT_RATE'])
+    if kind == 'http':
+        return HttpStubBackend(config['LLM_STUB_URL'])
+    return GeminiBackend(model_name)
+
+
+def init_app(app):
+    """Читает настройки бэкенда LLM из переменных окружения."""
+    app.config.setdefault('LLM_BACKEND', os.getenv('LLM_BACKEND', 'gemini').lower())
+    app.config.setdefault('LLM_STUB_LATENCY_S', float(os.getenv('LLM_STUB_LATENCY_S', '1.0')))
+    app.config.setdefault('LLM_STUB_JITTER_S', float(os.getenv('LLM_STUB_JITTER_S', '0.0')))
+    app.config.setdefault('LLM_STUB_ERROR_RATE', float(os.getenv('LLM_STUB_ERROR_RATE', '0.0')))
+    app.config.setdefault('LLM_STUB_RATE_LIMIT_RATE', float(os.getenv('LLM_STUB_RATE_LIMIT_RATE', '0.0')))
+    app.config.setdefault('LLM_STUB_URL', os.getenv('LLM_STUB_URL', 'http://127.0.0.1:8090/generate'))
+    if app.config['LLM_BACKEND'] not in BACKENDS:
+        raise ValueError(f"Неизвестный LLM_BACKEND '{app.config['LLM_BACKEND']}', ожидается одно из {BACKENDS}")
+    if app.config['LLM_BACKEND'] != 'gemini':
+        app.logger.warning(f"LLM_BACKEND={app.config['LLM_BACKEND']}: запросы к Gemini не отправляются.")
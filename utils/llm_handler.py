@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 import os
 import json
-import re
 import google.generativeai as genai
 from google.generativeai.types import GenerationConfig
 from google.api_core import exceptions as google_api_exceptions
 from flask import current_app # Для логирования
+from .metrics import instrumented, timed
+from .prompt_builder import build_columns_block, DEFAULT_COLUMN_TOKEN_BUDGET
+from .llm_backends import create_backend
 
 # Конфигурация Gemini (остается без изменений)
 try:
@@ -19,46 +21,70 @@ try:
 except Exception as e:
     print(f"Критическая ошибка при конфигурации Gemini API: {e}")
 
-# --- НОВАЯ ФУНКЦИЯ: Этап 0 - Первичная оценка ---
-def get_initial_assessment(query: str, column_names: list[str], completeness_info: str) -> dict | None:
-    """
-    Этап 0: Запрашивает у LLM первичную оценку запроса, выбор релевантных столбцов
-            и уточняющие вопросы пользователю.
-
-    Args:
-        query (str): Исходный запрос пользователя.
-        column_names (list[str]): Список имен столбцов.
-        completeness_info (str): Строка с информацией о % пропусков.
 
-    Returns:
-        dict | None: Словарь с результатом LLM или None/словарь с ошибкой.
-           Ожидаемый формат успешного ответа:
-           {
-               "suggested_columns": ["Список", "столбцов", "которые", "LLM", "считает", "релевантными"],
-               "questions_to_user": ["Список", "уточняющих", "вопросов", "если", "нужны"]
-           }
-           В случае ошибки: {"error": "Сообщение об ошибке"}
+def _prepare_backend(model_name: str):
+    """
+    Создает бэкенд LLM (utils.llm_backends, по LLM_BACKEND); для Gemini проверяет API ключ.
+    Возвращает (backend, None) или (None, словарь с ошибкой).
     """
-    if not os.getenv("GEMINI_API_KEY"):
+    if current_app.config.get('LLM_BACKEND', 'gemini') == 'gemini' and not os.getenv("GEMINI_API_KEY"):
         current_app.logger.error("Ошибка LLM: Попытка вызова LLM без API ключа.")
-        return {"error": "API ключ Gemini не сконфигурирован."}
-
-    model_name = 'gemini-1.5-flash' # Или 'gemini-1.5-pro-latest' если Flash не справляется
+        return None, {"error": "API ключ Gemini не сконфигурирован."}
     try:
-        model = genai.GenerativeModel(model_name)
+        return create_backend(model_name), None
     except Exception as e:
         current_app.logger.error(f"Ошибка инициализации модели Gemini ('{model_name}'): {e}")
-        return {"error": f"Ошибка инициализации модели Gemini ('{model_name}'): {e}"}
+        return None, {"error": f"Ошибка инициализации модели Gemini ('{model_name}'): {e}"}
+
+
+def _handle_llm_exception(stage: str, e: Exception) -> dict:
+    """Преобразует исключение при вызове Gemini в словарь с ошибкой (общий для всех этапов)."""
+    if isinstance(e, (google_api_exceptions.GoogleAPIError, google_api_exceptions.RetryError)):
+        current_app.logger.error(f"LLM {stage}: Ошибка Google API или сети: {e}")
+        return {"error": f"Ошибка API Google Gemini или сети: {e}"}
+    if isinstance(e, ValueError): # Обработка случая, если response_mime_type не сработал
+        current_app.logger.warning(f"LLM {stage}: ValueError (возможно, response_mime_type не поддерживается): {e}.")
+        return {"error": f"Ошибка конфигурации запроса к Gemini: {e}. Попробуйте другую модель или удалите response_mime_type."}
+    current_app.logger.error(f"LLM {stage}: Неожиданная ошибка: {e}", exc_info=True) # Логируем traceback
+    return {"error": f"Неожиданная ошибка API Gemini: {e}"}
+
+
+def _blocked_response_error(stage: str, response) -> dict | None:
+    """Ошибка, если Gemini вернула ответ без частей (запрос заблокирован), иначе None."""
+    if response.parts:
+        return None
+    block_reason = response.prompt_feedback.block_reason.name if response.prompt_feedback.block_reason else "Неизвестно"
+    current_app.logger.error(f"LLM {stage}: Ответ не содержит частей. Блокировка: {block_reason}. Feedback: {response.prompt_feedback}")
+    return {"error": f"Запрос заблокирован Gemini: {block_reason}"}
+
+
+# --- Этап 0 - Первичная оценка ---
+INITIAL_ASSESSMENT_MODEL = 'gemini-1.5-flash' # Или 'gemini-1.5-pro-latest' если Flash не справляется
+
+
+def _build_initial_prompt(query: str, column_names: list[str], completeness_info: str,
+                          column_profile: list[dict] | None) -> str:
+    if column_profile:
+        token_budget = current_app.config.get('LLM_COLUMN_TOKEN_BUDGET', DEFAULT_COLUMN_TOKEN_BUDGET)
+        columns_block = build_columns_block(query, column_profile, token_budget)
+        columns_prompt_part = columns_block["text"]
+        completeness_prompt_part = ("Указана в описании столбцов (третье поле)." if columns_block["has_metadata"]
+                                    else completeness_info)
+        current_app.logger.info(f"LLM Этап 0: компактный блок столбцов: {len(columns_block['included'])} столбцов, "
+                                f"опущено {columns_block['omitted']}, ~{columns_block['tokens']} токенов.")
+    else:
+        columns_prompt_part = f"{column_names}"
+        completeness_prompt_part = completeness_info
 
     prompt = f"""
 Ты - ИИ-ассистент для хирурга-онколога. Помогаешь подготовить данные для стат. анализа.
 Задача: Проанализируй данные и запрос пользователя, предложи релевантные столбцы и задай уточняющие вопросы.
 
 Доступные столбцы в данных:
-{column_names}
+{columns_prompt_part}
 
 Информация о пропущенных значениях:
-{completeness_info}
+{completeness_prompt_part}
 
 Запрос пользователя:
 "{query}"
@@ -81,84 +107,105 @@ def get_initial_assessment(query: str, column_names: list[str], completeness_inf
 
 Твой JSON ответ:
 """
+    return prompt
+
 
-    generation_config = GenerationConfig(
+def _initial_generation_config() -> GenerationConfig:
+    return GenerationConfig(
         temperature=0.2, # Чуть больше креативности для вопросов
         response_mime_type="application/json"
     )
 
-    try:
-        current_app.logger.info(f"LLM Этап 0: Запрос к {model_name}...")
-        response = model.generate_content(prompt, generation_config=generation_config)
 
-        if not response.parts:
-             block_reason = response.prompt_feedback.block_reason.name if response.prompt_feedback.block_reason else "Неизвестно"
-             current_app.logger.error(f"LLM Этап 0: Ответ не содержит частей. Блокировка: {block_reason}. Feedback: {response.prompt_feedback}")
-             return {"error": f"Запрос заблокирован Gemini: {block_reason}"}
+def _parse_initial_response(response) -> dict:
+    """Разбирает и проверяет ответ LLM этапа 0."""
+    blocked = _blocked_response_error("Этап 0", response)
+    if blocked:
+        return blocked
 
-        raw_response_text = response.text
-        current_app.logger.info(f"LLM Этап 0: Получен сырой ответ:\n{raw_response_text}")
+    raw_response_text = response.text
+    current_app.logger.info(f"LLM Этап 0: Получен сырой ответ:\n{raw_response_text}")
 
-        # Прямой парсинг JSON
+    # Прямой парсинг JSON
+    try:
         result = json.loads(raw_response_text)
-
-        # Проверка формата ответа
-        if not isinstance(result, dict) or "suggested_columns" not in result or "questions_to_user" not in result:
-             current_app.logger.error(f"LLM Этап 0: Ответ не соответствует ожидаемому формату JSON. Ответ: {result}")
-             return {"error": "LLM вернула ответ в некорректном формате.", "raw_response": raw_response_text}
-        if not isinstance(result["suggested_columns"], list) or not isinstance(result["questions_to_user"], list):
-             current_app.logger.error(f"LLM Этап 0: Ключи 'suggested_columns' или 'questions_to_user' не являются списками. Ответ: {result}")
-             return {"error": "LLM вернула некорректные типы данных в JSON.", "raw_response": raw_response_text}
-
-        current_app.logger.info("LLM Этап 0: Ответ успешно распарсен.")
-        return result
-
     except json.JSONDecodeError as e:
         current_app.logger.error(f"LLM Этап 0: Ошибка декодирования JSON: {e}. Ответ: {raw_response_text}")
-        # Можно добавить попытку ручной очистки, но с application/json это менее вероятно
         return {"error": f"Ошибка парсинга JSON ответа LLM: {e}", "raw_response": raw_response_text}
-    except (google_api_exceptions.GoogleAPIError, google_api_exceptions.RetryError) as e:
-        current_app.logger.error(f"LLM Этап 0: Ошибка Google API или сети: {e}")
-        return {"error": f"Ошибка API Google Gemini или сети: {e}"}
-    except ValueError as ve: # Обработка случая, если response_mime_type не сработал
-        current_app.logger.warning(f"LLM Этап 0: ValueError (возможно, response_mime_type не поддерживается): {ve}. Пробуем без него.")
-        # Сюда можно добавить логику повторной попытки без mime_type,
-        # аналогично той, что была в вашей исходной функции get_analysis_plan_gemini
-        # Для краткости пока возвращаем ошибку
-        return {"error": f"Ошибка конфигурации запроса к Gemini: {ve}. Попробуйте другую модель или удалите response_mime_type."}
-    except Exception as e:
-        current_app.logger.error(f"LLM Этап 0: Неожиданная ошибка: {e}", exc_info=True) # Логируем traceback
-        return {"error": f"Неожиданная ошибка API Gemini: {e}"}
-# --- КОНЕЦ НОВОЙ ФУНКЦИИ ---
 
+    # Проверка формата ответа
+    if not isinstance(result, dict) or "suggested_columns" not in result or "questions_to_user" not in result:
+         current_app.logger.error(f"LLM Этап 0: Ответ не соответствует ожидаемому формату JSON. Ответ: {result}")
+         return {"error": "LLM вернула ответ в некорректном формате.", "raw_response": raw_response_text}
+    if not isinstance(result["suggested_columns"], list) or not isinstance(result["questions_to_user"], list):
+         current_app.logger.error(f"LLM Этап 0: Ключи 'suggested_columns' или 'questions_to_user' не являются списками. Ответ: {result}")
+         return {"error": "LLM вернула некорректные типы данных в JSON.", "raw_response": raw_response_text}
 
-# --- НОВАЯ ФУНКЦИЯ: Этап 1 - Генерация детального плана ---
-def get_detailed_plan_proposal(query: str, confirmed_columns: list[str], clarifications: str | None) -> list | dict | None:
+    current_app.logger.info("LLM Этап 0: Ответ успешно распарсен.")
+    return result
+
+
+@instrumented("llm.initial_assessment")
+def get_initial_assessment(query: str, column_names: list[str], completeness_info: str,
+                           column_profile: list[dict] | None = None) -> dict | None:
     """
-    Этап 1: Запрашивает у LLM детальный пошаговый план анализа на основе
-            подтвержденных столбцов и уточнений пользователя.
+    Этап 0: Запрашивает у LLM первичную оценку запроса, выбор релевантных столбцов
+            и уточняющие вопросы пользователю.
 
     Args:
         query (str): Исходный запрос пользователя.
-        confirmed_columns (list[str]): Список столбцов, подтвержденных пользователем.
-        clarifications (str | None): Ответы пользователя на уточняющие вопросы LLM (или None).
+        column_names (list[str]): Список имен столбцов.
+        completeness_info (str): Строка с информацией о % пропусков.
+        column_profile (list[dict] | None): Метаданные столбцов (prompt_builder.build_column_profile).
+            Если переданы, вместо полного списка имен и строки о пропусках в промпт идет
+            компактный ранжированный блок в пределах LLM_COLUMN_TOKEN_BUDGET токенов.
 
     Returns:
-        list | dict | None: Список словарей с шагами плана,
-                            словарь с ошибкой от LLM (analysis_type='error'),
-                            или None/словарь с ошибкой API/парсинга.
+        dict | None: Словарь с результатом LLM или None/словарь с ошибкой.
+           Ожидаемый формат успешного ответа:
+           {
+               "suggested_columns": ["Список", "столбцов", "которые", "LLM", "считает", "релевантными"],
+               "questions_to_user": ["Список", "уточняющих", "вопросов", "если", "нужны"]
+           }
+           В случае ошибки: {"error": "Сообщение об ошибке"}
     """
-    if not os.getenv("GEMINI_API_KEY"):
-        current_app.logger.error("Ошибка LLM: Попытка вызова LLM без API ключа.")
-        return {"error": "API ключ Gemini не сконфигурирован."}
+    backend, error = _prepare_backend(INITIAL_ASSESSMENT_MODEL)
+    if error:
+        return error
+    prompt = _build_initial_prompt(query, column_names, completeness_info, column_profile)
 
-    model_name = 'gemini-1.5-flash' # Или 'gemini-1.5-pro-latest'
     try:
-        model = genai.GenerativeModel(model_name)
+        current_app.logger.info(f"LLM Этап 0: Запрос к {INITIAL_ASSESSMENT_MODEL}...")
+        with timed("llm.upstream.initial_assessment"):
+            response = backend.generate(prompt, generation_config=_initial_generation_config())
+        return _parse_initial_response(response)
     except Exception as e:
-        current_app.logger.error(f"Ошибка инициализации модели Gemini ('{model_name}'): {e}")
-        return {"error": f"Ошибка инициализации модели Gemini ('{model_name}'): {e}"}
+        return _handle_llm_exception("Этап 0", e)
+
+
+async def get_initial_assessment_async(query: str, column_names: list[str], completeness_info: str,
+                                       column_profile: list[dict] | None = None) -> dict | None:
+    """Асинхронный вариант get_initial_assessment (generate_content_async) для ASGI-режима."""
+    with timed("llm.initial_assessment"):
+        backend, error = _prepare_backend(INITIAL_ASSESSMENT_MODEL)
+        if error:
+            return error
+        prompt = _build_initial_prompt(query, column_names, completeness_info, column_profile)
+
+        try:
+            current_app.logger.info(f"LLM Этап 0 (async): Запрос к {INITIAL_ASSESSMENT_MODEL}...")
+            with timed("llm.upstream.initial_assessment"):
+                response = await backend.generate_async(prompt, generation_config=_initial_generation_config())
+            return _parse_initial_response(response)
+        except Exception as e:
+            return _handle_llm_exception("Этап 0", e)
+
+
+# --- Этап 1 - Генерация детального плана ---
+PLAN_PROPOSAL_MODEL = 'gemini-1.5-flash' # Или 'gemini-1.5-pro-latest'
+
 
+def _build_plan_prompt(query: str, confirmed_columns: list[str], clarifications: str | None) -> str:
     clarifications_prompt_part = ""
     if clarifications and clarifications.strip():
         clarifications_prompt_part = f"\nОтветы пользователя на уточняющие вопросы:\n\"{clarifications}\"\n"
@@ -175,10 +222,22 @@ def get_detailed_plan_proposal(query: str, confirmed_columns: list[str], clarifi
 Твои действия:
 1.  Используя ТОЛЬКО подтвержденные столбцы, сопоставь их с частями исходного запроса.
 2.  Для каждой части запроса, которую можно выполнить с помощью подтвержденных столбцов, определи конкретный статистический тест и переменные.
-3.  Поддерживаемые тесты: 't-test' (сравнение числовой переменной 'variable' между 2 группами 'grouping_variable'), 'chi-square' (связь двух категориальных 'variable1', 'variable2'), 'descriptive_stats' (описательные статистики для 'variable').
+3.  Поддерживаемые тесты:
+    - 't-test': сравнение числовой переменной 'variable' между 2 группами 'grouping_variable'.
+    - 'chi-square': связь двух категориальных переменных 'variable1', 'variable2'.
+    - 'descriptive_stats': описательные статистики для 'variable'.
+    - 'correlation_matrix': попарные корреляции списка числовых столбцов 'variables' одним шагом; необязательный 'method': 'pearson' или 'spearman'. Для вопросов о связи нескольких числовых показателей используй ОДИН шаг 'correlation_matrix' вместо множества попарных шагов.
+    - 'survival': кривые Каплана-Мейера, медиана выживаемости и лог-ранговый критерий; числовое время наблюдения 'time_variable', индикатор события 0/1 'event_variable', необязательная группировка 'grouping_variable'.
+    - 'anova': однофакторный дисперсионный анализ с попарными сравнениями групп; список числовых показателей 'variables' сравнивается между 2 и более группами 'grouping_variable' (например, стадии I-IV или схемы лечения). 't-test' допускает ровно 2 группы; для 3 и более групп используй ОДИН шаг 'anova' со всеми показателями вместо множества попарных t-тестов.
+    - 'kruskal_wallis': непараметрический критерий Краскела-Уоллиса с попарными сравнениями групп; те же ключи, что у 'anova' ('variables', 'grouping_variable'). Используй вместо 'anova' для асимметричных распределений и малых групп.
+    Необязательные флаги повторных выборок (по умолчанию выключены, добавляй их только при необходимости):
+    - 'bootstrap': true - бутстреп 95% ДИ для 't-test' и 'descriptive_stats' (числовые данные);
+    - 'permutation': true - перестановочный p-value для 't-test';
+    - 'n_resamples' (по умолчанию 2000) и 'seed' - только вместе с одним из флагов выше.
+    Включай их, если пользователь просит доверительные интервалы или выборка мала либо распределение асимметрично; в остальных случаях не указывай.
 4.  Если какая-то часть запроса НЕ МОЖЕТ быть выполнена с подтвержденными столбцами (например, нет нужного столбца), создай шаг с `analysis_type: "error"` и четким описанием проблемы в поле `message`.
 5.  Сгенерируй ответ СТРОГО в формате JSON **списка** ([...]) словарей. Каждый словарь - это один шаг анализа или сообщение об ошибке.
-6.  Каждый словарь должен содержать ключ 'analysis_type' и другие необходимые ключи в зависимости от типа ('variable', 'grouping_variable', 'variable1', 'variable2', 'message').
+6.  Каждый словарь должен содержать ключ 'analysis_type' и другие необходимые ключи в зависимости от типа ('variable', 'grouping_variable', 'variable1', 'variable2', 'variables', 'method', 'time_variable', 'event_variable', 'bootstrap', 'permutation', 'n_resamples', 'seed', 'message').
 
 Пример JSON ответа (список словарей):
 [
@@ -192,6 +251,22 @@ def get_detailed_plan_proposal(query: str, confirmed_columns: list[str], clarifi
     "variable1": "Осложнения_ClavinDindo",
     "variable2": "Группа_исследования"
   }},
+  {{
+    "analysis_type": "correlation_matrix",
+    "variables": ["Гемоглобин", "Лейкоциты", "Тромбоциты"],
+    "method": "spearman"
+  }},
+  {{
+    "analysis_type": "anova",
+    "variables": ["Гемоглобин", "Лейкоциты"],
+    "grouping_variable": "Стадия"
+  }},
+  {{
+    "analysis_type": "survival",
+    "time_variable": "Время_наблюдения_мес",
+    "event_variable": "Рецидив",
+    "grouping_variable": "Группа_исследования"
+  }},
   {{
     "analysis_type": "error",
     "message": "Не найден подтвержденный столбец для анализа показателя 'Выживаемость'."
@@ -202,56 +277,90 @@ def get_detailed_plan_proposal(query: str, confirmed_columns: list[str], clarifi
 
 Твой JSON ответ (список):
 """
+    return prompt
+
 
-    generation_config = GenerationConfig(
+def _plan_generation_config() -> GenerationConfig:
+    return GenerationConfig(
         temperature=0.1, # Низкая температура для строгости
         response_mime_type="application/json"
     )
 
-    try:
-        current_app.logger.info(f"LLM Этап 1: Запрос к {model_name}...")
-        response = model.generate_content(prompt, generation_config=generation_config)
 
-        if not response.parts:
-             block_reason = response.prompt_feedback.block_reason.name if response.prompt_feedback.block_reason else "Неизвестно"
-             current_app.logger.error(f"LLM Этап 1: Ответ не содержит частей. Блокировка: {block_reason}. Feedback: {response.prompt_feedback}")
-             # Возвращаем ошибку в формате словаря, а не списка
-             return {"error": f"Запрос заблокирован Gemini: {block_reason}"}
+def _parse_plan_response(response) -> list | dict:
+    """Разбирает и проверяет ответ LLM этапа 1 (ожидается список шагов)."""
+    blocked = _blocked_response_error("Этап 1", response)
+    if blocked:
+        # Возвращаем ошибку в формате словаря, а не списка
+        return blocked
 
-        raw_response_text = response.text
-        current_app.logger.info(f"LLM Этап 1: Получен сырой ответ:\n{raw_response_text}")
+    raw_response_text = response.text
+    current_app.logger.info(f"LLM Этап 1: Получен сырой ответ:\n{raw_response_text}")
 
-        # Прямой парсинг JSON (ожидаем список)
+    # Прямой парсинг JSON (ожидаем список)
+    try:
         analysis_plan_list = json.loads(raw_response_text)
-
-        # Проверка формата ответа (должен быть список словарей)
-        if not isinstance(analysis_plan_list, list):
-            current_app.logger.error(f"LLM Этап 1: Ответ не является списком JSON. Ответ: {analysis_plan_list}")
-            # Возвращаем ошибку в формате словаря
-            return {"error": "LLM вернула ответ не в формате списка.", "raw_response": raw_response_text}
-        # Дополнительная проверка, что элементы списка - словари (можно добавить)
-        # for item in analysis_plan_list:
-        #    if not isinstance(item, dict): ...
-
-        current_app.logger.info("LLM Этап 1: Ответ успешно распарсен.")
-        return analysis_plan_list # Возвращаем СПИСОК
-
-    # Обработка ошибок аналогична предыдущей функции
     except json.JSONDecodeError as e:
         current_app.logger.error(f"LLM Этап 1: Ошибка декодирования JSON: {e}. Ответ: {raw_response_text}")
         return {"error": f"Ошибка парсинга JSON ответа LLM: {e}", "raw_response": raw_response_text}
-    except (google_api_exceptions.GoogleAPIError, google_api_exceptions.RetryError) as e:
-        current_app.logger.error(f"LLM Этап 1: Ошибка Google API или сети: {e}")
-        return {"error": f"Ошибка API Google Gemini или сети: {e}"}
-    except ValueError as ve:
-        current_app.logger.warning(f"LLM Этап 1: ValueError: {ve}. Пробуем без mime_type.")
-        # Здесь тоже можно добавить повторную попытку
-        return {"error": f"Ошибка конфигурации запроса к Gemini: {ve}."}
+
+    # Проверка формата ответа (должен быть список словарей)
+    if not isinstance(analysis_plan_list, list):
+        current_app.logger.error(f"LLM Этап 1: Ответ не является списком JSON. Ответ: {analysis_plan_list}")
+        # Возвращаем ошибку в формате словаря
+        return {"error": "LLM вернула ответ не в формате списка.", "raw_response": raw_response_text}
+
+    current_app.logger.info("LLM Этап 1: Ответ успешно распарсен.")
+    return analysis_plan_list # Возвращаем СПИСОК
+
+
+@instrumented("llm.plan_proposal")
+def get_detailed_plan_proposal(query: str, confirmed_columns: list[str], clarifications: str | None) -> list | dict | None:
+    """
+    Этап 1: Запрашивает у LLM детальный пошаговый план анализа на основе
+            подтвержденных столбцов и уточнений пользователя.
+
+    Args:
+        query (str): Исходный запрос пользователя.
+        confirmed_columns (list[str]): Список столбцов, подтвержденных пользователем.
+        clarifications (str | None): Ответы пользователя на уточняющие вопросы LLM (или None).
+
+    Returns:
+        list | dict | None: Список словарей с шагами плана,
+                            словарь с ошибкой от LLM (analysis_type='error'),
+                            или None/словарь с ошибкой API/парсинга.
+    """
+    backend, error = _prepare_backend(PLAN_PROPOSAL_MODEL)
+    if error:
+        return error
+    prompt = _build_plan_prompt(query, confirmed_columns, clarifications)
+
+    try:
+        current_app.logger.info(f"LLM Этап 1: Запрос к {PLAN_PROPOSAL_MODEL}...")
+        with timed("llm.upstream.plan_proposal"):
+            response = backend.generate(prompt, generation_config=_plan_generation_config())
+        return _parse_plan_response(response)
     except Exception as e:
-        current_app.logger.error(f"LLM Этап 1: Неожиданная ошибка: {e}", exc_info=True)
-        return {"error": f"Неожиданная ошибка API Gemini: {e}"}
+        return _handle_llm_exception("Этап 1", e)
+
+
+async def get_detailed_plan_proposal_async(query: str, confirmed_columns: list[str],
+                                           clarifications: str | None) -> list | dict | None:
+    """Асинхронный вариант get_detailed_plan_proposal (generate_content_async) для ASGI-режима."""
+    with timed("llm.plan_proposal"):
+        backend, error = _prepare_backend(PLAN_PROPOSAL_MODEL)
+        if error:
+            return error
+        prompt = _build_plan_prompt(query, confirmed_columns, clarifications)
+
+        try:
+            current_app.logger.info(f"LLM Этап 1 (async): Запрос к {PLAN_PROPOSAL_MODEL}...")
+            with timed("llm.upstream.plan_proposal"):
+                response = await backend.generate_async(prompt, generation_config=_plan_generation_config())
+            return _parse_plan_response(response)
+        except Exception as e:
+            return _handle_llm_exception("Этап 1", e)
 
-# --- КОНЕЦ НОВОЙ ФУНКЦИИ ---
 
 # Старая функция get_analysis_plan_gemini БОЛЬШЕ НЕ НУЖНА для новой логики,
 # но можно ее пока оставить или закомментировать, если нужна для отладки/сравнения.
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Метрики производительности: тайминги этапов, дельты RSS, попадания в кеши.
+
+Данные хранятся в памяти процесса и отдаются в формате Prometheus (text exposition
+format 0.0.4) на /metrics. Тайминги текущего запроса дополнительно можно получить
+в заголовке Server-Timing (SERVER_TIMING=true, заголовок X-Server-Timing: 1 или ?server_timing=1).
+Процессы-исполнители планов (utils.scheduler) передают накопленные метрики и записи
+Server-Timing родителю (drain_metrics -> merge_metrics), поэтому они видны на /metrics
+процесса приложения.
+"""
+import functools
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, has_app_context, request, before_render_template, template_rendered
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> float
+_gauges = {}      # (name, labels) -> float
+_histograms = {}  # (name, labels) -> {"bounds": (...), "buckets": [...], "sum": float, "count": int}
+_help = {}        # name -> (type, help)
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _register(name: str, metric_type: str, help_text: str | None):
+    if name not in _help:
+        _help[name] = (metric_type, help_text or name)
+
+
+def inc_counter(name: str, value: float = 1.0, help_text: str | None = None, **labels):
+    with _lock:
+        _register(name, "counter", help_text)
+        key = (name, _labels_key(labels))
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def set_gauge(name: str, value: float, help_text: str | None = None, **labels):
+    with _lock:
+        _register(name, "gauge", help_text)
+        _gauges[(name, _labels_key(labels))] = float(value)
+
+
+def observe(name: str, value: float, help_text: str | None = None, buckets=DEFAULT_BUCKETS, **labels):
+    """Добавляет наблюдение в гистограмму."""
+    with _lock:
+        _register(name, "histogram", help_text)
+        key = (name, _labels_key(labels))
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {"bounds": tuple(buckets), "buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(hist["bounds"]):
+            if value <= bound:
+                hist["buckets"][i] += 1
+        hist["sum"] += value
+        hist["count"] += 1
+
+
+def drain_metrics() -> dict:
+    """
+    Забирает накопленные метрики процесса (и записи Server-Timing текущего запроса)
+    и обнуляет их: следующий вызов вернет только новые значения.
+    """
+    with _lock:
+        snapshot = {
+            "help": dict(_help),
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "histograms": _histograms.copy(),
+        }
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+    snapshot["server_timings"] = g.pop('_server_timings', []) if has_app_context() else []
+    return snapshot
+
+
+def merge_metrics(snapshot: dict):
+    """Добавляет метрики, полученные drain_metrics в другом процессе, к метрикам этого процесса."""
+    with _lock:
+        for name, (metric_type, help_text) in snapshot["help"].items():
+            _register(name, metric_type, help_text)
+        for key, value in snapshot["counters"].items():
+            _counters[key] = _counters.get(key, 0.0) + value
+        _gauges.update(snapshot["gauges"])
+        for key, other in snapshot["histograms"].items():
+            hist = _histograms.get(key)
+            if hist is None:
+                _histograms[key] = {**other, "buckets": list(other["buckets"])}
+                continue
+            hist["buckets"] = [a + b for a, b in zip(hist["buckets"], other["buckets"])]
+            hist["sum"] += other["sum"]
+            hist["count"] += other["count"]
+    for name, duration in snapshot["server_timings"]:
+        _add_server_timing(name, duration)
+
+
+def current_rss_bytes() -> int:
+    """Текущий RSS процесса (Linux: /proc; иначе - пиковый RSS из resource или 0)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if os.uname().sysname == 'Darwin' else rss * 1024
+    except (ImportError, AttributeError):
+        return 0
+
+
+def record_cache(cache: str, hit: bool):
+    """Учитывает обращение к кешу (hit/miss)."""
+    inc_counter("statonco_cache_requests_total", help_text="Обращения к внутренним кешам.",
+                cache=cache, result="hit" if hit else "miss")
+
+
+def _add_server_timing(name: str, duration_s: float):
+    if has_app_context():
+        timings = g.setdefault('_server_timings', [])
+        timings.append((name, duration_s))
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Замеряет длительность и изменение RSS блока кода.
+
+    Пишет гистограмму statonco_stage_duration_seconds{stage=...},
+    последнюю дельту RSS и суммарный прирост RSS по этапу, а также запись Server-Timing.
+    """
+    rss_before = current_rss_bytes()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        rss_delta = current_rss_bytes() - rss_before
+        observe("statonco_stage_duration_seconds", duration,
+                help_text="Длительность этапов конвейера анализа, с.", stage=stage)
+        set_gauge("statonco_stage_rss_delta_bytes", rss_delta,
+                  help_text="Изменение RSS за последний запуск этапа, байт.", stage=stage)
+        if rss_delta > 0:
+            inc_counter("statonco_stage_rss_growth_bytes_total", rss_delta,
+                        help_text="Суммарный прирост RSS по этапам, байт.", stage=stage)
+        _add_server_timing(stage, duration)
+
+
+def instrumented(stage: str):
+    """Декоратор: оборачивает вызов функции в timed(stage)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label_value(v)}"' for k, v in items) + "}"
+
+
+def render_prometheus() -> str:
+    """Сериализует все метрики в текстовый формат Prometheus."""
+    set_gauge("statonco_process_resident_memory_bytes", current_rss_bytes(),
+              help_text="Текущий RSS процесса, байт.")
+    lines = []
+    with _lock:
+        for name, (metric_type, help_text) in sorted(_help.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == "counter":
+                for (n, labels), value in sorted(_counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+            elif metric_type == "gauge":
+                for (n, labels), value in sorted(_gauges.items()):
+                    if n == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+            else:
+                for (n, labels), hist in sorted(_histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, count in zip(hist["bounds"], hist["buckets"]):
+                        lines.append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {hist['count']}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {hist['sum']}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {hist['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def _server_timing_requested(app) -> bool:
+    return (app.config.get('SERVER_TIMING', False)
+            or request.headers.get('X-Server-Timing') == '1'
+            or request.args.get('server_timing') == '1')
+
+
+def _server_timing_header(timings: list) -> str:
+    # В Server-Timing имя метрики - token, поэтому заменяем недопустимые символы
+    return ", ".join(f'{re.sub(r"[^A-Za-z0-9_.-]", "-", name)};dur={duration * 1000:.1f}'
+                     for name, duration in timings)
+
+
+def init_app(app):
+    """Подключает /metrics, замер длительности запросов и заголовок Server-Timing."""
+    app.config.setdefault('SERVER_TIMING', os.getenv('SERVER_TIMING', 'False').lower() == 'true')
+
+    @app.before_request
+    def _metrics_start_request():
+        g._request_started = time.perf_counter()
+
+    @app.after_request
+    def _metrics_finish_request(response):
+        started = g.pop('_request_started', None)
+        if started is not None:
+            duration = time.perf_counter() - started
+            observe("statonco_http_request_duration_seconds", duration,
+                    help_text="Длительность HTTP-запросов, с.",
+                    endpoint=request.endpoint or "unknown", method=request.method, status=response.status_code)
+            if _server_timing_requested(app):
+                timings = g.get('_server_timings', []) + [("total", duration)]
+                response.headers['Server-Timing'] = _server_timing_header(timings)
+        return response
+
+    def _template_started(sender, template, context, **extra):
+        g.setdefault('_template_starts', []).append(time.perf_counter())
+
+    def _template_finished(sender, template, context, **extra):
+        starts = g.get('_template_starts')
+        if starts:
+            duration = time.perf_counter() - starts.pop()
+            stage = f"template.{template.name}"
+            observe("statonco_stage_duration_seconds", duration,
+                    help_text="Длительность этапов конвейера анализа, с.", stage=stage)
+            _add_server_timing(stage, duration)
+
+    before_render_template.connect(_template_started, app, weak=False)
+    template_rendered.connect(_template_finished, app, weak=False)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Метрики в формате Prometheus."""
+        return Response(render_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,504 @@
+# -*- coding: utf-8 -*-
+"""
+Общие этапы конвейера анализа (профилирование данных и выполнение плана).
+
+Используются и HTML-маршрутами в app.py, и JSON API (api_v1.py), чтобы
+логика этапов существовала в одном месте.
+"""
+import os
+import traceback
+import numpy as np
+import pandas as pd
+from flask import current_app, flash
+
+from .data_loader import get_data_completeness_report
+from .stats_processor import get_descriptive_stats, perform_t_test, perform_chi_square, compute_correlation_matrix, CORRELATION_METHODS, perform_survival_analysis, compare_groups
+from .metrics import timed, inc_counter
+from .resampling import DEFAULT_RESAMPLES, MIN_RESAMPLES, MAX_RESAMPLES
+from .prompt_builder import build_column_profile
+from .plot_utils import dataframe_to_html
+from .column_index import resolve_names
+from .fragments import content_hash
+
+# Максимальное число страт при стратифицированном выполнении плана
+MAX_STRATA = int(os.getenv('MAX_STRATA', 12))
+
+
+def profile_dataframe(df: pd.DataFrame) -> dict:
+    """
+    Строит профиль полноты данных и список столбцов для отображения/LLM.
+
+    Returns:
+        dict: {
+            "completeness_report": исходный отчет get_data_completeness_report (или None),
+            "completeness_html": HTML таблица для шаблона,
+            "missing_info_str": строка о пропусках для LLM,
+            "report_df": отфильтрованный DataFrame отчета (без 100% пропусков) или None,
+            "columns_to_display": список столбцов без 100% пропусков,
+            "column_profile": компактные метаданные столбцов columns_to_display для промпта LLM,
+            "missing_pct": {столбец: % пропусков} для columns_to_display,
+            "dataset_hash": хеш профиля (таблица полноты, столбцы, пропуски) - ключ кеша фрагментов страниц
+        }
+    """
+    column_names_original = df.columns.tolist()
+    completeness_report = get_data_completeness_report(df)
+
+    completeness_html = "<p class='text-warning'>Не удалось рассчитать отчет о полноте.</p>"
+    missing_info_str = "Не удалось получить информацию о пропусках."
+    columns_to_display = column_names_original[:]
+    report_df_filtered = None
+
+    if completeness_report:
+        completeness_html = completeness_report.get('html_table', completeness_html)
+        missing_info_str = completeness_report.get('missing_info_str', missing_info_str)
+        report_df_full = completeness_report.get('report_df')
+
+        if report_df_full is not None:
+            current_app.logger.info(f"Полный отчет о полноте данных:\n{report_df_full.to_string()}")
+            report_df_filtered = report_df_full[report_df_full['% пропусков'] < 100.0]
+            if not report_df_filtered.empty:
+                columns_to_display = report_df_filtered['Столбец'].tolist()
+            else:
+                current_app.logger.warning("Внимание: Все столбцы имеют 100% пропусков.")
+                columns_to_display = []
+                report_df_filtered = pd.DataFrame(columns=['Столбец', 'Кол-во пропусков', '% пропусков'])
+            current_app.logger.info(f"Столбцы для отображения и LLM ({len(columns_to_display)}): {columns_to_display}")
+        else:
+            current_app.logger.warning("Отчет о полноте не содержит DataFrame.")
+    else:
+        current_app.logger.warning("Не удалось создать отчет о полноте данных.")
+
+    column_profile = build_column_profile(df[columns_to_display], report_df_filtered)
+    missing_pct = {}
+    if report_df_filtered is not None and not report_df_filtered.empty:
+        missing_pct = {str(col): round(float(pct), 2) for col, pct in zip(report_df_filtered['Столбец'], report_df_filtered['% пропусков'])}
+
+    return {
+        "completeness_report": completeness_report,
+        "completeness_html": completeness_html,
+        "missing_info_str": missing_info_str,
+        "report_df": report_df_filtered,
+        "columns_to_display": columns_to_display,
+        "column_profile": column_profile,
+        "missing_pct": missing_pct,
+        "dataset_hash": content_hash([completeness_html, columns_to_display, missing_pct]),
+    }
+
+
+# Ключи шага плана, содержащие одно имя столбца (и 'variables' - список имен)
+PLAN_COLUMN_KEYS = ("variable", "grouping_variable", "variable1", "variable2", "time_variable", "event_variable")
+
+
+def _report_column_fixes(fixes: list[dict], source: str):
+    """Логирует и показывает пользователю исправленные имена столбцов."""
+    if not fixes:
+        return
+    for fix in fixes:
+        inc_counter("statonco_column_name_fixes_total", help_text="Имена столбцов от LLM, исправленные локально, по способу.",
+                    method=fix["method"])
+    current_app.logger.info(f"Исправлены имена столбцов ({source}): {fixes}")
+    described = ", ".join(f"'{fix['from']}' → '{fix['to']}'" for fix in fixes)
+    # Нечеткое совпадение стоит проверить: показываем его как предупреждение
+    category = "warning" if any(fix["method"] == "fuzzy" for fix in fixes) else "info"
+    flash(f"Имена столбцов в {source} сопоставлены с данными: {described}.", category)
+
+
+def resolve_suggested_columns(llm_suggestions: dict | None, columns: list[str]) -> dict | None:
+    """Сопоставляет suggested_columns ответа LLM с реальными столбцами (column_index), сообщая об исправлениях."""
+    if not llm_suggestions or llm_suggestions.get("error"):
+        return llm_suggestions
+    suggested = llm_suggestions.get("suggested_columns") or []
+    resolved, fixes = resolve_names(suggested, columns)
+    _report_column_fixes(fixes, "предложениях LLM")
+    # Исправление может свести два имени к одному столбцу
+    return {**llm_suggestions, "suggested_columns": list(dict.fromkeys(resolved))}
+
+
+def resolve_plan_columns(proposed_plan: list, columns) -> list:
+    """
+    Сопоставляет имена столбцов в шагах плана с реальными столбцами до выполнения,
+    чтобы шаг не завершился ошибкой «Столбец ... не найден» из-за регистра,
+    разделителей или транслитерации. Возвращает новый список шагов.
+    """
+    if not isinstance(proposed_plan, list):
+        return proposed_plan
+    resolved_plan, all_fixes = [], []
+    for step in proposed_plan:
+        if not isinstance(step, dict):
+            resolved_plan.append(step)
+            continue
+        keys = [key for key in PLAN_COLUMN_KEYS if isinstance(step.get(key), str)]
+        names = [step[key] for key in keys]
+        variables = step.get("variables") if isinstance(step.get("variables"), list) else None
+        resolved, fixes = resolve_names(names + (variables or []), columns)
+        if fixes:
+            step = {**step, **dict(zip(keys, resolved))}
+            if variables is not None:
+                step["variables"] = resolved[len(keys):]
+            all_fixes.extend(fixes)
+        resolved_plan.append(step)
+    _report_column_fixes(all_fixes, "плане анализа")
+    return resolved_plan
+
+
+def merge_suggestions_with_profile(llm_suggestions: dict | None, columns_to_display: list[str]) -> dict | None:
+    """
+    Сводит предложения LLM с профилем данных: имена сопоставляются со столбцами
+    (resolve_suggested_columns), затем из suggested_columns убираются столбцы,
+    которых нет среди columns_to_display (например, со 100% пропусков).
+    """
+    if not llm_suggestions or llm_suggestions.get("error"):
+        return llm_suggestions
+    llm_suggestions = resolve_suggested_columns(llm_suggestions, columns_to_display)
+    allowed = set(columns_to_display)
+    suggested = llm_suggestions.get("suggested_columns", [])
+    kept = [col for col in suggested if col in allowed]
+    dropped = [col for col in suggested if col not in allowed]
+    if dropped:
+        current_app.logger.info(f"Из предложений LLM убраны столбцы без данных или не найденные: {dropped}")
+    return {**llm_suggestions, "suggested_columns": kept}
+
+
+def _resampling_options(step: dict) -> tuple[dict, str | None]:
+    """
+    Необязательные ключи ресэмплинга шага: bootstrap, permutation (bool),
+    n_resamples (MIN_RESAMPLES..MAX_RESAMPLES), seed (целое >= 0).
+
+    Returns:
+        (параметры для stats_processor, сообщение об ошибке или None)
+    """
+    options = {"bootstrap": bool(step.get("bootstrap")), "n_resamples": DEFAULT_RESAMPLES, "seed": None}
+    if step.get("analysis_type") == "t-test":
+        options["permutation"] = bool(step.get("permutation"))
+    n_resamples = step.get("n_resamples")
+    if n_resamples is not None:
+        if isinstance(n_resamples, bool) or not isinstance(n_resamples, int) or not MIN_RESAMPLES <= n_resamples <= MAX_RESAMPLES:
+            return options, f"'n_resamples' должно быть целым от {MIN_RESAMPLES} до {MAX_RESAMPLES} (получено {n_resamples!r})."
+        options["n_resamples"] = n_resamples
+    seed = step.get("seed")
+    if seed is not None:
+        if isinstance(seed, bool) or not isinstance(seed, int) or seed < 0:
+            return options, f"'seed' должен быть неотрицательным целым (получено {seed!r})."
+        options["seed"] = seed
+    return options, None
+
+
+def execute_plan_step(df: pd.DataFrame, step) -> dict:
+    """
+    Выполняет один шаг плана и возвращает результат в формате
+    {"plan": step, "status": "success"|"error"|"skipped", "data"?: ..., "message"?: ...}.
+    """
+    analysis_type = step.get("analysis_type") if isinstance(step, dict) else None
+    with timed(f"plan_step.{analysis_type or 'invalid'}"):
+        return _execute_plan_step(df, step)
+
+
+def _execute_plan_step(df: pd.DataFrame, step) -> dict:
+    step_result = {"plan": step, "status": "pending"}
+    try:
+        if not isinstance(step, dict):
+            step_result["status"] = "error"
+            step_result["message"] = f"Ошибка формата: шаг плана не словарь ({type(step)})."
+            current_app.logger.warning(f"Пропуск шага: {step_result['message']}")
+            return step_result
+
+        analysis_type = step.get("analysis_type")
+        if not analysis_type:
+            step_result["status"] = "error"
+            step_result["message"] = "Тип анализа не указан в шаге."
+            current_app.logger.warning(f"Пропуск шага: {step_result['message']}")
+            return step_result
+
+        current_app.logger.info(f"Выполнение шага: {analysis_type}")
+
+        # --- Логика выполнения ---
+        if analysis_type == "error":
+            step_result["status"] = "skipped"
+            step_result["message"] = step.get("message", "Шаг с ошибкой из плана LLM.")
+            flash(f"Пропущен шаг плана (ошибка LLM): {step_result['message']}", "info")
+
+        elif analysis_type == "t-test":
+            variable = step.get("variable")
+            grouping_variable = step.get("grouping_variable")
+            if variable and grouping_variable:
+                error_msg = None
+                if variable not in df.columns: error_msg = f"Столбец '{variable}' не найден."
+                elif grouping_variable not in df.columns: error_msg = f"Столбец '{grouping_variable}' не найден."
+                elif not pd.api.types.is_numeric_dtype(df[variable]): error_msg = f"Столбец '{variable}' не числовой."
+                elif df[grouping_variable].nunique() != 2:
+                    groups = df[grouping_variable].dropna().unique()
+                    error_msg = (f"Столбец '{grouping_variable}' должен иметь 2 группы (найдено {len(groups)}: {list(groups)}). "
+                                 f"Для сравнения 3 и более групп используйте 'anova' или 'kruskal_wallis'.")
+                resampling, resampling_error = _resampling_options(step)
+                error_msg = error_msg or resampling_error
+
+                if error_msg:
+                    step_result["status"] = "error"
+                    step_result["message"] = error_msg
+                    flash(f"Ошибка T-test (валидация): {error_msg}", "danger")
+                else:
+                    result_data = perform_t_test(df, variable, grouping_variable, **resampling)
+                    step_result["data"] = result_data
+                    step_result["status"] = "error" if result_data.get("error") else "success"
+                    if result_data.get("warning"): flash(f"Предупреждение T-test ({variable} по {grouping_variable}): {result_data['warning']}", "warning")
+                    if result_data.get("error"): flash(f"Ошибка T-test ({variable} по {grouping_variable}): {result_data['error']}", "danger")
+            else:
+                step_result["status"] = "error"; step_result["message"] = "Не указаны 'variable' или 'grouping_variable' для t-теста."
+                flash(f"Ошибка конфигурации t-теста: {step_result['message']}", "warning")
+
+        elif analysis_type == "chi-square":
+            variable1 = step.get("variable1")
+            variable2 = step.get("variable2")
+            if variable1 and variable2:
+                error_msg = None
+                if variable1 not in df.columns: error_msg = f"Столбец '{variable1}' не найден."
+                elif variable2 not in df.columns: error_msg = f"Столбец '{variable2}' не найден."
+                elif variable1 == variable2: error_msg = "Нужны два разных столбца."
+
+                if error_msg:
+                    step_result["status"] = "error"; step_result["message"] = error_msg
+                    flash(f"Ошибка Chi-square (валидация): {error_msg}", "danger")
+                else:
+                    result_data = perform_chi_square(df, variable1, variable2)
+                    step_result["data"] = result_data
+                    step_result["status"] = "error" if result_data.get("error") else "success"
+                    if result_data.get("warning"): flash(f"Предупреждение Chi-Square ({variable1} vs {variable2}): {result_data['warning']}", "warning")
+                    if result_data.get("error"): flash(f"Ошибка Chi-Square ({variable1} vs {variable2}): {result_data['error']}", "danger")
+            else:
+                step_result["status"] = "error"; step_result["message"] = "Не указаны 'variable1' или 'variable2' для хи-квадрат."
+                flash(f"Ошибка конфигурации хи-квадрат: {step_result['message']}", "warning")
+
+        elif analysis_type == "descriptive_stats":
+            variable = step.get("variable")
+            if variable:
+                resampling, resampling_error = _resampling_options(step)
+                if variable not in df.columns or resampling_error:
+                    step_result["status"] = "error"; step_result["message"] = resampling_error or f"Столбец '{variable}' не найден."
+                    flash(f"Ошибка опис. стат. (валидация): {step_result['message']}", "danger")
+                else:
+                    result_data = get_descriptive_stats(df, variable, **resampling)
+                    step_result["data"] = result_data
+                    step_result["status"] = "error" if result_data.get("error") else "success"
+                    if result_data.get("warning"): flash(f"Предупреждение опис. стат. ({variable}): {result_data['warning']}", "warning")
+                    if result_data.get("error"): flash(f"Ошибка опис. стат. ({variable}): {result_data['error']}", "danger")
+            else:
+                step_result["status"] = "error"; step_result["message"] = "Не указана 'variable' для описательных статистик."
+                flash(f"Ошибка конфигурации опис. стат.: {step_result['message']}", "warning")
+
+        elif analysis_type == "correlation_matrix":
+            variables = step.get("variables")
+            method = step.get("method") or "pearson"
+            if isinstance(variables, list) and len(variables) >= 2:
+                error_msg = None
+                missing = [v for v in variables if v not in df.columns]
+                if missing: error_msg = f"Столбцы не найдены: {missing}."
+                elif method not in CORRELATION_METHODS: error_msg = f"Неизвестный метод '{method}' (ожидается {list(CORRELATION_METHODS)})."
+
+                if error_msg:
+                    step_result["status"] = "error"; step_result["message"] = error_msg
+                    flash(f"Ошибка корреляционной матрицы (валидация): {error_msg}", "danger")
+                else:
+                    result_data = compute_correlation_matrix(df, variables, method)
+                    step_result["data"] = result_data
+                    step_result["status"] = "error" if result_data.get("error") else "success"
+                    if result_data.get("warning"): flash(f"Предупреждение корреляционной матрицы: {result_data['warning']}", "warning")
+                    if result_data.get("error"): flash(f"Ошибка корреляционной матрицы: {result_data['error']}", "danger")
+            else:
+                step_result["status"] = "error"; step_result["message"] = "Для корреляционной матрицы нужен список 'variables' из не менее 2 столбцов."
+                flash(f"Ошибка конфигурации корреляционной матрицы: {step_result['message']}", "warning")
+
+        elif analysis_type == "survival":
+            time_variable = step.get("time_variable")
+            event_variable = step.get("event_variable")
+            grouping_variable = step.get("grouping_variable") or None
+            if time_variable and event_variable:
+                error_msg = None
+                if time_variable not in df.columns: error_msg = f"Столбец '{time_variable}' не найден."
+                elif event_variable not in df.columns: error_msg = f"Столбец '{event_variable}' не найден."
+                elif grouping_variable and grouping_variable not in df.columns: error_msg = f"Столбец '{grouping_variable}' не найден."
+                elif not pd.api.types.is_numeric_dtype(df[time_variable]): error_msg = f"Столбец '{time_variable}' не числовой."
+
+                if error_msg:
+                    step_result["status"] = "error"; step_result["message"] = error_msg
+                    flash(f"Ошибка анализа выживаемости (валидация): {error_msg}", "danger")
+                else:
+                    result_data = perform_survival_analysis(df, time_variable, event_variable, grouping_variable)
+                    step_result["data"] = result_data
+                    step_result["status"] = "error" if result_data.get("error") else "success"
+                    if result_data.get("warning"): flash(f"Предупреждение анализа выживаемости ({time_variable}): {result_data['warning']}", "warning")
+                    if result_data.get("error"): flash(f"Ошибка анализа выживаемости ({time_variable}): {result_data['error']}", "danger")
+            else:
+                step_result["status"] = "error"; step_result["message"] = "Не указаны 'time_variable' или 'event_variable' для анализа выживаемости."
+                flash(f"Ошибка конфигурации анализа выживаемости: {step_result['message']}", "warning")
+
+        elif analysis_type in ("anova", "kruskal_wallis"):
+            # Несколько показателей ('variables') или один ('variable') по одной группировке
+            variables = step.get("variables") if isinstance(step.get("variables"), list) else [step.get("variable")] if step.get("variable") else None
+            grouping_variable = step.get("grouping_variable")
+            label = "ANOVA" if analysis_type == "anova" else "Краскела-Уоллиса"
+            if variables and grouping_variable:
+                error_msg = None
+                missing = [v for v in variables + [grouping_variable] if v not in df.columns]
+                if missing: error_msg = f"Столбцы не найдены: {missing}."
+                elif grouping_variable in variables: error_msg = f"Столбец '{grouping_variable}' не может быть одновременно показателем и группировкой."
+
+                if error_msg:
+                    step_result["status"] = "error"; step_result["message"] = error_msg
+                    flash(f"Ошибка {label} (валидация): {error_msg}", "danger")
+                else:
+                    result_data = compare_groups(df, variables, grouping_variable, method=analysis_type)
+                    step_result["data"] = result_data
+                    step_result["status"] = "error" if result_data.get("error") else "success"
+                    if result_data.get("warning"): flash(f"Предупреждение {label} (по {grouping_variable}): {result_data['warning']}", "warning")
+                    if result_data.get("error"): flash(f"Ошибка {label} (по {grouping_variable}): {result_data['error']}", "danger")
+            else:
+                step_result["status"] = "error"; step_result["message"] = f"Не указаны 'variables' (или 'variable') или 'grouping_variable' для {label}."
+                flash(f"Ошибка конфигурации {label}: {step_result['message']}", "warning")
+
+        else:
+            step_result["status"] = "skipped"
+            step_result["message"] = f"Неизвестный тип анализа '{analysis_type}' в плане."
+            flash(f"Пропущен шаг: Неизвестный тип анализа '{analysis_type}'", "info")
+            current_app.logger.warning(f"Пропущен шаг с неизвестным типом анализа: {analysis_type}")
+
+    # --- Блок except для ошибок выполнения шага ---
+    except MemoryError:
+        # Лимит памяти задачи (utils.scheduler): шаг не выполнен, следующие шаги продолжаются
+        current_app.logger.error(f"Недостаточно памяти при выполнении шага {step}")
+        step_result["status"] = "error"
+        step_result["message"] = "Недостаточно памяти для выполнения шага: сократите число переменных или повторных выборок."
+        flash(f"Шаг ({step.get('analysis_type', 'N/A')}) превысил лимит памяти.", "danger")
+    except Exception as step_e:
+        error_traceback_step = traceback.format_exc()
+        current_app.logger.error(f"Ошибка при выполнении шага {step}: {step_e}\n{error_traceback_step}")
+        step_result["status"] = "error"
+        step_result["message"] = f"Внутренняя ошибка сервера при выполнении шага: {step_e}"
+        flash(f"Ошибка при выполнении шага ({step.get('analysis_type', 'N/A')}): {step_e}", "danger")
+
+    return step_result
+
+
+def execute_analysis_plan(df: pd.DataFrame, proposed_plan: list, on_step=None) -> list:
+    """
+    Выполняет все шаги плана по порядку и возвращает список результатов шагов.
+    on_step(результат шага), если передан, вызывается после каждого шага (utils.scheduler).
+    """
+    proposed_plan = resolve_plan_columns(proposed_plan, df.columns)
+    final_results = []
+    for step in proposed_plan:
+        final_results.append(execute_plan_step(df, step))
+        if on_step is not None:
+            on_step(final_results[-1])
+    return final_results
+
+
+def validate_strata_column(df: pd.DataFrame, strata_col: str) -> str | None:
+    """Проверяет, что по столбцу можно стратифицировать план. Возвращает сообщение об ошибке или None."""
+    if strata_col not in df.columns:
+        return f"Столбец стратификации '{strata_col}' не найден."
+    n_strata = df[strata_col].nunique()
+    if n_strata < 2:
+        return f"Столбец стратификации '{strata_col}' должен содержать не менее 2 значений (найдено {n_strata})."
+    if n_strata > MAX_STRATA:
+        return f"Слишком много страт в '{strata_col}' ({n_strata}), допускается не более {MAX_STRATA}."
+    return None
+
+
+def split_by_strata(df: pd.DataFrame, strata_col: str) -> tuple[list[tuple[str, pd.DataFrame]], str | None]:
+    """
+    Делит данные на страты одной факторизацией столбца strata_col: строки
+    упорядочиваются по коду страты один раз, каждая страта - непрерывный срез.
+    Строки с пропуском в strata_col не входят ни в одну страту.
+
+    Returns:
+        ([(метка страты, DataFrame), ...] в порядке сортировки меток, сообщение об ошибке или None)
+    """
+    error_msg = validate_strata_column(df, strata_col)
+    if error_msg:
+        return [], error_msg
+    codes, labels = pd.factorize(df[strata_col], sort=True)
+
+    valid = np.flatnonzero(codes >= 0)
+    positions = valid[np.argsort(codes[valid], kind='stable')]
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(codes[valid], minlength=len(labels)))])
+    strata = [(str(label), df.iloc[positions[bounds[i]:bounds[i + 1]]]) for i, label in enumerate(labels)]
+    return strata, None
+
+
+def _comparison_table(strata_results: list[dict]) -> str:
+    """Таблица «показатель x страта» из скалярных metrics/stats успешных результатов страт."""
+    columns = {}
+    for stratum in strata_results:
+        data = stratum.get("data") or {}
+        values = {"N (строк в страте)": stratum["n"]}
+        if stratum.get("status") == "success":
+            for source in (data.get("stats"), data.get("metrics")):
+                if isinstance(source, dict):
+                    values.update({k: v for k, v in source.items() if not isinstance(v, (dict, list))})
+        else:
+            values["Статус"] = stratum.get("message") or (data.get("error") or data.get("warning") or stratum.get("status"))
+        columns[stratum["label"]] = values
+    table = pd.DataFrame(columns)
+    return dataframe_to_html(table.where(table.notna(), "—"))
+
+
+def execute_analysis_plan_stratified(df: pd.DataFrame, proposed_plan: list, strata_col: str, on_step=None) -> list:
+    """
+    Выполняет каждый шаг плана отдельно в каждой страте strata_col.
+
+    Общим для шагов является только деление на страты (split_by_strata, одна
+    факторизация). Сам шаг выполняется циклом по стратам: для каждой страты - отдельный
+    вызов execute_plan_step на срезе данных (свой расчет и свой график), без объединения
+    страт в один векторизованный расчет; время растет линейно с числом страт.
+    Шаг-ошибка из плана LLM и шаг с некорректным форматом обрабатываются один раз.
+    Результат шага: {"plan", "status", "strata_variable", "strata": [{"label", "n", "status", "data"?, "message"?}],
+    "comparison_html"} - статус "success", если шаг успешен хотя бы в одной страте.
+    on_step - как в execute_analysis_plan.
+    """
+    strata, error_msg = split_by_strata(df, strata_col)
+    if error_msg:
+        raise ValueError(error_msg)
+    current_app.logger.info(f"Стратифицированное выполнение по '{strata_col}': {[(label, len(frame)) for label, frame in strata]}")
+    proposed_plan = resolve_plan_columns(proposed_plan, df.columns)
+
+    final_results = []
+    for step in proposed_plan:
+        if not isinstance(step, dict) or step.get("analysis_type") in (None, "error"):
+            final_results.append(execute_plan_step(df, step))
+            if on_step is not None:
+                on_step(final_results[-1])
+            continue
+
+        strata_results = []
+        for label, frame in strata:
+            result = execute_plan_step(frame, step)
+            strata_results.append({"label": label, "n": len(frame), **{k: v for k, v in result.items() if k != "plan"}})
+
+        failed = [s["label"] for s in strata_results if s["status"] != "success"]
+        step_result = {
+            "plan": step,
+            "status": "success" if len(failed) < len(strata_results) else "error",
+            "strata_variable": strata_col,
+            "strata": strata_results,
+            "comparison_html": _comparison_table(strata_results),
+        }
+        if failed:
+            step_result["message"] = f"Шаг не выполнен в стратах: {', '.join(failed)}."
+        final_results.append(step_result)
+        if on_step is not None:
+            on_step(step_result)
+    return final_results
+
+
+def summarize_results(final_results: list, num_steps: int) -> tuple[str, str]:
+    """Формирует итоговое сообщение и категорию flash по результатам шагов."""
+    num_success = sum(1 for r in final_results if r.get("status") == "success")
+    num_errors = sum(1 for r in final_results if r.get("status") == "error")
+    num_skipped = sum(1 for r in final_results if r.get("status") == "skipped")
+
+    summary_message = f"Анализ завершен. Всего шагов в плане: {num_steps}. Успешно: {num_success}."
+    if num_errors > 0: summary_message += f" С ошибками: {num_errors}."
+    if num_skipped > 0: summary_message += f" Пропущено: {num_skipped}."
+
+    flash_category = "success" if num_errors == 0 and num_skipped == 0 else ("warning" if num_errors > 0 else "info")
+    return summary_message, flash_category
@@ -1,29 +1,213 @@
+import matplotlib
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
+import numpy as np
 import io
+import os
 import base64
+import gzip
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from PIL import Image, features
+from .metrics import instrumented, inc_counter
+from . import janitor
 
 plt.switch_backend('Agg') # Используем бэкенд, не требующий GUI
 
+# Форматы вывода графиков:
+#   png  - как раньше (совместимость API);
+#   webp - WebP без потерь: графики из заливок и линий сжимаются в 4-8 раз лучше PNG;
+#   svg  - вектор (текст - текстом, а не кривыми);
+#   auto - по типу графика: SVG для простых столбчатых/box plot при выдаче по URL
+#          (сжатый gzip SVG меньше растра и один файл годится для миниатюры и полного
+#          размера), иначе WebP.
+PLOT_FORMATS = ("png", "webp", "svg", "auto")
+PLOT_FORMAT = os.getenv('PLOT_FORMAT', 'png')
+_WEBP_AVAILABLE = features.check('webp')
+# Усилие кодирования WebP без потерь (0-6): 0 для графиков из заливок бывает крупнее PNG,
+# с 1 размер уже почти минимальный (~1/3 PNG), большие значения в основном добавляют время
+_WEBP_OPTIONS = {"lossless": True, "method": int(os.getenv('PLOT_WEBP_METHOD', 1))}
+_MIME_TYPES = {"png": "image/png", "webp": "image/webp", "svg": "image/svg+xml"}
+
+# Миниатюры: в режиме предпросмотра графики сохраняются с низким разрешением;
+# в режиме уровней (tiers) - уменьшенная копия полного изображения шириной THUMBNAIL_WIDTH
+THUMBNAIL_DPI = 36
+THUMBNAIL_WIDTH = 320
+
+# Хранилище изображений для режима уровней: id (хеш содержимого) -> уровни; ограничено по байтам
+PLOT_URL_PREFIX = "/plots/"
+PLOT_STORE_MAX_BYTES = int(os.getenv('PLOT_STORE_MAX_BYTES', 64 * 1024 * 1024))
+_store = OrderedDict()
+_store_bytes = 0
+_store_lock = threading.Lock()
+
+
+_output = contextvars.ContextVar("statonco_plot_output",
+                                 default={"format": PLOT_FORMAT, "tiers": False, "thumbnails": False})
+
+
+def current_plot_output() -> dict:
+    """Текущие настройки вывода графиков (для передачи в фоновые задачи)."""
+    return dict(_output.get())
+
+
+@contextmanager
+def plot_output(format: str | None = None, tiers: bool | None = None, thumbnails: bool | None = None):
+    """
+    Настройки вывода графиков внутри блока (None - оставить текущее значение).
+
+    format: один из PLOT_FORMATS.
+    tiers: изображения сохраняются в хранилище, plot_data - URL (PLOT_URL_PREFIX + id);
+           миниатюра - тот же URL с ?tier=thumb, полный размер - без параметра.
+    thumbnails: только миниатюра (THUMBNAIL_DPI), встроенная в data URI.
+    """
+    if format is not None and format not in PLOT_FORMATS:
+        raise ValueError(f"Неизвестный формат графиков '{format}'. Допустимые: {', '.join(PLOT_FORMATS)}.")
+    settings = dict(_output.get())
+    for key, value in (("format", format), ("tiers", tiers), ("thumbnails", thumbnails)):
+        if value is not None:
+            settings[key] = value
+    token = _output.set(settings)
+    try:
+        yield
+    finally:
+        _output.reset(token)
+
+
+def thumbnail_plots():
+    """Внутри блока все графики сохраняются миниатюрами (THUMBNAIL_DPI)."""
+    return plot_output(thumbnails=True)
+
+
 def dataframe_to_html(df):
     """Конвертирует DataFrame в HTML таблицу с базовыми стилями."""
     if df is None:
         return ""
+    if isinstance(df, pd.Series): # У Series нет to_html (например, таблица описательных статистик)
+        df = df.to_frame()
     # Добавляем классы для возможного CSS-стилирования
     return df.to_html(classes=['table', 'table-striped', 'table-bordered', 'table-hover', 'dataframe'], index=True, border=0)
 
 
-def plot_to_base64(fig):
-    """Конвертирует фигуру Matplotlib в строку Base64."""
+def _resolve_format(kind: str, settings: dict) -> str:
+    """Формат для графика вида kind ('vector' - простые столбцы/box plot, 'raster' - остальное)."""
+    fmt = settings["format"]
+    if fmt == "auto":
+        fmt = "svg" if kind == "vector" and settings["tiers"] and not settings["thumbnails"] else "webp"
+    if fmt == "webp" and not _WEBP_AVAILABLE:
+        fmt = "png"
+    return fmt
+
+
+def _save_figure(fig, fmt: str, dpi=None) -> bytes:
     buf = io.BytesIO()
-    fig.savefig(buf, format='png', bbox_inches='tight')
-    plt.close(fig) # Закрываем фигуру, чтобы освободить память
-    buf.seek(0)
-    img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-    buf.close()
-    return f"data:image/png;base64,{img_base64}"
+    options = {"pil_kwargs": _WEBP_OPTIONS} if fmt == "webp" else {}
+    with matplotlib.rc_context({"svg.fonttype": "none", "svg.hashsalt": "statonco"}):
+        fig.savefig(buf, format=fmt, bbox_inches='tight', dpi=dpi, **options)
+    return buf.getvalue()
+
+
+def _thumbnail(data: bytes, fmt: str) -> bytes:
+    """Уменьшенная копия растрового изображения (без повторной отрисовки фигуры)."""
+    image = Image.open(io.BytesIO(data))
+    image.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 4))
+    buf = io.BytesIO()
+    image.save(buf, format=fmt.upper(), **(_WEBP_OPTIONS if fmt == "webp" else {"optimize": True}))
+    return buf.getvalue()
+
+
+def _store_plot(tiers: dict) -> str:
+    """Кладет уровни изображения в хранилище (вытесняя давние при превышении лимита), возвращает id."""
+    global _store_bytes
+    plot_id = hashlib.sha1(tiers["full"]["data"]).hexdigest()[:24]
+    size = sum(len(tier["data"]) for tier in tiers.values())
+    evicted_ids = []
+    with _store_lock:
+        if plot_id in _store:
+            _store.move_to_end(plot_id)
+            return plot_id
+        _store[plot_id] = tiers
+        _store_bytes += size
+        while _store_bytes > PLOT_STORE_MAX_BYTES and len(_store) > 1:
+            evicted_id, evicted = _store.popitem(last=False)
+            _store_bytes -= sum(len(tier["data"]) for tier in evicted.values())
+            evicted_ids.append(evicted_id)
+    janitor.track(f"plot:{plot_id}", "plot", size, evict=lambda: _drop_plot(plot_id))
+    for evicted_id in evicted_ids:
+        janitor.forget(f"plot:{evicted_id}")
+    return plot_id
+
+
+def _drop_plot(plot_id: str):
+    """Удаление изображения уборщиком (utils.janitor) по сроку жизни."""
+    global _store_bytes
+    with _store_lock:
+        tiers = _store.pop(plot_id, None)
+        if tiers is not None:
+            _store_bytes -= sum(len(tier["data"]) for tier in tiers.values())
+
+
+def drain_stored_plots() -> dict:
+    """Забирает все изображения из хранилища (процесс-исполнитель передает их родителю)."""
+    global _store, _store_bytes
+    with _store_lock:
+        drained, _store, _store_bytes = dict(_store), OrderedDict(), 0
+    return drained
+
 
+def add_stored_plots(plots: dict):
+    """Добавляет изображения, полученные от процесса-исполнителя, в хранилище."""
+    for tiers in plots.values():
+        _store_plot(tiers)
+
+
+def get_stored_plot(plot_id: str, tier: str = "full") -> dict | None:
+    """Уровень изображения из хранилища: {"data", "mimetype", "encoding"} или None."""
+    with _store_lock:
+        tiers = _store.get(plot_id)
+        if tiers is not None:
+            _store.move_to_end(plot_id)
+    if tiers is None:
+        return None
+    janitor.touch(f"plot:{plot_id}")
+    return tiers.get(tier) or tiers["full"]
+
+
+def plot_to_base64(fig, kind: str = "raster") -> str:
+    """
+    Сохраняет фигуру Matplotlib по текущим настройкам plot_output и закрывает ее.
+
+    Returns:
+        str: data URI (по умолчанию) или URL изображения в хранилище (режим tiers).
+    """
+    settings = _output.get()
+    fmt = _resolve_format(kind, settings)
+    try:
+        data = _save_figure(fig, fmt, dpi=THUMBNAIL_DPI if settings["thumbnails"] else None)
+    finally:
+        plt.close(fig) # Закрываем фигуру, чтобы освободить память
+    mimetype = _MIME_TYPES[fmt]
+    inc_counter("statonco_plot_bytes_total", len(data), help_text="Размер сохраненных графиков, байт, по формату.",
+                format=fmt)
+
+    if not settings["tiers"] or settings["thumbnails"]:
+        return f"data:{mimetype};base64,{base64.b64encode(data).decode('ascii')}"
+
+    if fmt == "svg":
+        # Вектор масштабируется: один файл для обоих уровней, хранится сжатым
+        full = {"data": gzip.compress(data, compresslevel=6), "mimetype": mimetype, "encoding": "gzip"}
+        tiers = {"full": full}
+    else:
+        tiers = {"full": {"data": data, "mimetype": mimetype, "encoding": None},
+                 "thumb": {"data": _thumbnail(data, fmt), "mimetype": mimetype, "encoding": None}}
+    return PLOT_URL_PREFIX + _store_plot(tiers)
+
+
+@instrumented("plot.histogram")
 def plot_histogram(series: pd.Series, title: str) -> str | None:
     """Строит гистограмму и возвращает ее в Base64."""
     if not pd.api.types.is_numeric_dtype(series):
@@ -41,6 +225,7 @@ def plot_histogram(series: pd.Series, title: str) -> str | None:
     fig.tight_layout()
     return plot_to_base64(fig)
 
+@instrumented("plot.boxplot")
 def plot_boxplot(df: pd.DataFrame, variable_col: str, group_col: str, title: str) -> str | None:
     """Строит boxplot для сравнения групп и возвращает Base64."""
     if not pd.api.types.is_numeric_dtype(df[variable_col]):
@@ -56,8 +241,9 @@ def plot_boxplot(df: pd.DataFrame, variable_col: str, group_col: str, title: str
     ax.set_xlabel(group_col)
     ax.set_ylabel(variable_col)
     fig.tight_layout()
-    return plot_to_base64(fig)
+    return plot_to_base64(fig, kind="vector")
 
+@instrumented("plot.countplot")
 def plot_countplot(series: pd.Series, title: str) -> str | None:
     """Строит столбчатую диаграмму частот и возвращает Base64."""
     if series.dropna().empty:
@@ -76,8 +262,9 @@ def plot_countplot(series: pd.Series, title: str) -> str | None:
         ax.bar_label(container)
 
     fig.tight_layout()
-    return plot_to_base64(fig)
+    return plot_to_base64(fig, kind="vector")
 
+@instrumented("plot.contingency_table")
 def plot_contingency_table(cont_table: pd.DataFrame, title: str) -> str | None:
     """Строит тепловую карту или столбчатую диаграмму для таблицы сопряженности."""
     if cont_table.empty:
@@ -98,9 +285,58 @@ def plot_contingency_table(cont_table: pd.DataFrame, title: str) -> str | None:
         ax.set_ylabel('Частота')
         ax.legend(title=cont_table.columns.name) # Имя колонки как заголовок легенды
         fig.tight_layout()
-        return plot_to_base64(fig)
+        return plot_to_base64(fig, kind="vector")
     except Exception as e:
         print(f"Ошибка при построении графика для таблицы сопряженности: {e}")
         # Может возникнуть, если данные не подходят для bar plot
         # Возвращаем None или пробуем heatmap как запасной вариант
         return None
+
+@instrumented("plot.correlation_heatmap")
+def plot_correlation_heatmap(corr: pd.DataFrame, title: str) -> str | None:
+    """Строит тепловую карту корреляционной матрицы (нижний треугольник) и возвращает Base64."""
+    if corr.empty or corr.isna().all().all():
+        print("Нет данных для построения тепловой карты корреляций.")
+        return None
+
+    size = len(corr.columns)
+    annotate = size <= 15  # При большом числе переменных подписи значений нечитаемы
+    fig, ax = plt.subplots(figsize=(min(4 + 0.6 * size, 20), min(3 + 0.5 * size, 16)))
+    upper = np.triu(np.ones(corr.shape, dtype=bool), k=1)
+    sns.heatmap(corr, mask=upper, annot=annotate, fmt=".2f", cmap="RdBu_r", vmin=-1, vmax=1, center=0,
+                square=True, linewidths=0.5, cbar_kws={"shrink": 0.8}, ax=ax)
+    ax.set_title(title)
+    fig.tight_layout()
+    return plot_to_base64(fig)
+
+@instrumented("plot.kaplan_meier")
+def plot_kaplan_meier(curves: dict, title: str, xlabel: str) -> str | None:
+    """
+    Строит ступенчатые кривые Каплана-Мейера с 95% ДИ и метками цензурирования.
+    curves: {группа: {"times", "survival", "lower", "upper", "censored"}} (массивы одной длины).
+    """
+    if not curves or all(len(c["times"]) == 0 for c in curves.values()):
+        print("Нет данных для построения кривых выживаемости.")
+        return None
+
+    fig, ax = plt.subplots(figsize=(9, 6))
+    show_ci = len(curves) <= 5  # Для многих групп интервалы перекрываются и мешают
+    for label, curve in curves.items():
+        # Кривая начинается с S(0) = 1
+        times = np.concatenate([[0.0], curve["times"]])
+        survival = np.concatenate([[1.0], curve["survival"]])
+        line, = ax.step(times, survival, where='post', label=label)
+        if show_ci:
+            ax.fill_between(times, np.concatenate([[1.0], curve["lower"]]), np.concatenate([[1.0], curve["upper"]]),
+                            step='post', alpha=0.15, color=line.get_color())
+        censored = curve["censored"]
+        ax.plot(curve["times"][censored], curve["survival"][censored], '|', markersize=8, color=line.get_color())
+
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel('Доля без события')
+    ax.set_ylim(0, 1.05)
+    if len(curves) > 1:
+        ax.legend()
+    fig.tight_layout()
+    return plot_to_base64(fig)
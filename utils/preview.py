@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Быстрый предпросмотр результатов на выборке и точный расчет в фоне.
+
+Предпросмотр выполняет план (теми же функциями stats_processor и в том же
+формате результатов) на стратифицированной случайной выборке из
+PREVIEW_SAMPLE_ROWS строк: страты - группирующий столбец плана, поэтому малые
+группы не теряются. Графики - миниатюры, число повторных выборок бутстрепа
+ограничено PREVIEW_RESAMPLES. Одновременно точный расчет по всем данным
+запускается в фоне через очередь и с лимитами utils.scheduler; его результат
+забирается по id задачи.
+"""
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+from flask import current_app, get_flashed_messages
+
+from .background import PoolBusy, submit_in_detached_request_context
+from .metrics import inc_counter, timed
+from .pipeline import execute_analysis_plan, execute_analysis_plan_stratified, summarize_results
+from .plot_utils import thumbnail_plots, plot_output, current_plot_output
+from .scheduler import QueueTimeout, client_key, run_plan
+
+PREVIEW_SAMPLE_ROWS = int(os.getenv('PREVIEW_SAMPLE_ROWS', 2000))
+PREVIEW_RESAMPLES = int(os.getenv('PREVIEW_RESAMPLES', 200))
+# Минимум строк из каждой страты выборки (если в страте их столько есть)
+MIN_ROWS_PER_STRATUM = 30
+# Столбцы с большим числом значений не используются как страты выборки
+_MAX_SAMPLE_STRATA = 50
+# Ключи шага, которые задают группы (в порядке приоритета для стратификации выборки)
+_GROUPING_KEYS = ("grouping_variable", "variable2", "variable1", "variable")
+
+_lock = threading.Lock()
+_jobs = {}  # id задачи -> {"future", "cancel", "created_at"}
+
+
+def sample_strata_column(df: pd.DataFrame, plan: list, strata_variable: str | None = None) -> str | None:
+    """Столбец для стратификации выборки: столбец страт плана или первый группирующий столбец шагов."""
+    candidates = [strata_variable] if strata_variable else []
+    for key in _GROUPING_KEYS:
+        candidates += [step.get(key) for step in plan if isinstance(step, dict)]
+    for col in candidates:
+        if isinstance(col, str) and col in df.columns and df[col].nunique() <= _MAX_SAMPLE_STRATA:
+            return col
+    return None
+
+
+def stratified_sample(df: pd.DataFrame, size: int, strata_col: str | None = None, seed: int = 0) -> pd.DataFrame:
+    """
+    Случайная выборка около size строк. Со strata_col - пропорционально размерам страт,
+    но не менее MIN_ROWS_PER_STRATUM строк из каждой (пропуск - отдельная страта).
+    Порядок строк исходный.
+    """
+    if len(df) <= size:
+        return df
+    rng = np.random.default_rng(seed)
+    if strata_col is None:
+        return df.iloc[np.sort(rng.choice(len(df), size=size, replace=False))]
+
+    codes, _ = pd.factorize(df[strata_col], use_na_sentinel=False)
+    counts = np.bincount(codes)
+    quota = np.maximum(np.floor(size * counts / len(df)), np.minimum(counts, MIN_ROWS_PER_STRATUM)).astype(int)
+    # Случайный порядок внутри страт: сортировка по (страта, случайный ключ), затем номер строки в страте
+    order = np.lexsort((rng.random(len(df)), codes))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank_in_stratum = np.arange(len(df)) - starts[codes[order]]
+    keep = order[rank_in_stratum < quota[codes[order]]]
+    return df.iloc[np.sort(keep)]
+
+
+def _preview_plan(plan: list) -> list:
+    """Копия плана с ограниченным числом повторных выборок (бутстреп/перестановки)."""
+    preview = []
+    for step in plan:
+        if isinstance(step, dict) and (step.get("bootstrap") or step.get("permutation")):
+            step = {**step, "n_resamples": min(step.get("n_resamples") or PREVIEW_RESAMPLES, PREVIEW_RESAMPLES)}
+        preview.append(step)
+    return preview
+
+
+def _execute(df: pd.DataFrame, plan: list, strata_variable: str | None) -> list:
+    if strata_variable:
+        return execute_analysis_plan_stratified(df, plan, strata_variable)
+    return execute_analysis_plan(df, plan)
+
+
+def run_preview(df: pd.DataFrame, plan: list, strata_variable: str | None = None) -> dict:
+    """
+    Выполняет план на стратифицированной выборке с миниатюрами графиков.
+
+    Returns:
+        dict: {"results": результаты шагов (формат execute_analysis_plan), "sample_rows",
+               "total_rows", "sample_strata": столбец стратификации выборки или None}
+    """
+    strata_col = sample_strata_column(df, plan, strata_variable)
+    with timed("preview.run"):
+        sample = stratified_sample(df, PREVIEW_SAMPLE_ROWS, strata_col)
+        # Шаги на выборке сохраняют исходный план, но с уменьшенным n_resamples
+        with thumbnail_plots():
+            results = _execute(sample, _preview_plan(plan), strata_variable)
+    for result, step in zip(results, plan):
+        result["plan"] = step
+    return {"results": results, "sample_rows": len(sample), "total_rows": len(df), "sample_strata": strata_col}
+
+
+def _purge_expired(ttl_s: float):
+    now = time.time()
+    for key in [k for k, v in _jobs.items() if now - v["created_at"] > ttl_s]:
+        job = _jobs.pop(key)
+        job["cancel"].set()
+        job["future"].cancel()
+
+
+def _run_exact(df: pd.DataFrame, plan: list, strata_variable: str | None, plot_settings: dict, client: str,
+               cancel: threading.Event) -> dict:
+    """Точный расчет (в фоновом потоке, в отдельном контексте запроса, с настройками графиков запроса)."""
+    with timed("preview.exact_run"), plot_output(**{**plot_settings, "thumbnails": False}):
+        results = run_plan(df, plan, strata_variable, client=client, cancel_event=cancel)
+    summary_message, summary_category = summarize_results(results, len(plan))
+    return {
+        "results": results,
+        "summary": {"message": summary_message, "category": summary_category},
+        "messages": [{"category": c, "message": m} for c, m in get_flashed_messages(with_categories=True)],
+    }
+
+
+def start_exact_run(df: pd.DataFrame, plan: list, strata_variable: str | None = None, on_done=None) -> str:
+    """
+    Запускает точный расчет плана по всем данным в фоне и возвращает id задачи.
+    on_done(outcome), если передан, вызывается в фоновом потоке с результатом get_exact_run.
+    Графики сохраняются по настройкам plot_output вызывающего запроса.
+
+    Raises:
+        QueueTimeout: очередь точных расчетов заполнена.
+    """
+    plot_settings, client, cancel = current_plot_output(), client_key(), threading.Event()
+
+    def run():
+        try:
+            outcome = {"status": "done", **_run_exact(df, plan, strata_variable, plot_settings, client, cancel)}
+        except Exception as e:
+            current_app.logger.error(f"Ошибка точного расчета после предпросмотра: {e}")
+            outcome = {"status": "error", "error": str(e)}
+        inc_counter("statonco_preview_exact_runs_total", help_text="Точные расчеты после предпросмотра: done и error.",
+                    outcome=outcome["status"])
+        if on_done is not None:
+            on_done(outcome)
+        return outcome
+
+    job_id = uuid.uuid4().hex
+    try:
+        future = submit_in_detached_request_context("exact", run)
+    except PoolBusy:
+        raise QueueTimeout("Сервер занят выполнением других анализов. Попробуйте позже.", retry_after=10)
+    with _lock:
+        _purge_expired(current_app.config.get('PREVIEW_JOB_TTL_S', 600))
+        _jobs[job_id] = {"future": future, "cancel": cancel, "created_at": time.time()}
+    return job_id
+
+
+def get_exact_run(job_id: str | None) -> dict | None:
+    """
+    Состояние точного расчета: {"status": "pending"}, {"status": "done", "results", "summary", "messages"}
+    или {"status": "error", "error"}. None - задача не найдена (или устарела).
+    """
+    with _lock:
+        job = _jobs.get(job_id) if job_id else None
+    if job is None:
+        return None
+    if not job["future"].done():
+        return {"status": "pending"}
+    return job["future"].result()
+
+
+def discard_exact_run(job_id: str | None):
+    """Забывает задачу (результат уже показан или начат новый анализ); незавершенный расчет отменяется."""
+    if not job_id:
+        return
+    with _lock:
+        job = _jobs.pop(job_id, None)
+    if job:
+        job["cancel"].set()
+        job["future"].cancel()
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Контекст multiprocessing для процессов, запускаемых из работающего сервера:
+исполнителей планов (utils.scheduler), пулов ресэмплинга (utils.resampling) и
+разбора листов (utils.data_loader).
+
+fork из процесса с потоками (сервер, фоновые пулы, уборщик) небезопасен: блокировка,
+захваченная другим потоком, например в обработчике логов или matplotlib, остается
+захваченной в потомке навсегда. Поэтому процессы запускаются через forkserver (иначе
+spawn) - JOB_START_METHOD. Сервер форков общий на процесс приложения и заранее
+импортирует модули анализа, но не модуль запуска ('__main__'): иначе он выполнил бы
+инициализацию приложения.
+"""
+import multiprocessing
+import os
+import threading
+
+START_METHOD = os.getenv('JOB_START_METHOD') or (
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+FORKSERVER_PRELOAD = ['utils.pipeline', 'utils.scheduler']
+
+_context = None
+_lock = threading.Lock()
+
+
+def process_context():
+    """Контекст multiprocessing (START_METHOD) для пулов и процессов приложения."""
+    global _context
+    with _lock:
+        if _context is None:
+            context = multiprocessing.get_context(START_METHOD)
+            if START_METHOD == 'forkserver':
+                context.set_forkserver_preload(FORKSERVER_PRELOAD)
+            _context = context
+        return _context
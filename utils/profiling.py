@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Профилирование отдельных запросов по требованию.
+
+Режимы включения (по умолчанию все выключены):
+    * по запросу: заголовок X-Profile или параметр ?profile= со значением
+      'sample' (или '1') - сэмплирующий профилировщик, 'cprofile' - cProfile.
+      Требует PROFILING_ON_DEMAND=true.
+    * по порогу: PROFILE_SLOW_THRESHOLD_S > 0 - каждый запрос сэмплируется,
+      а профиль сохраняется только если запрос длился дольше порога.
+
+Профилируется вся работа запроса, а не только поток, принявший запрос: план в
+процессе-исполнителе (utils.scheduler) профилируется в исполнителе тем же режимом,
+и его стеки (cProfile - статистика) передаются родителю; в ASGI-режиме код
+представлений выполняется в пуле потоков, и эти потоки добавляются к профилю
+на время выполнения (profile_current_thread).
+
+Профили сохраняются в PROFILE_DIR вместе с JSON-метаданными (id анализа, план).
+Сэмплирующий режим пишет стеки в "folded"-формате (flamegraph.pl, speedscope),
+cProfile - файл .prof для pstats/snakeviz. Список и скачивание: /admin/profiles
+(только заголовок X-Admin-Token со значением ADMIN_TOKEN: параметр запроса
+попадал бы в журналы доступа). Старые профили удаляет уборщик (utils.janitor:
+JANITOR_TTL_PROFILE_S, JANITOR_MAX_PROFILES).
+"""
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import abort, g, has_request_context, jsonify, request, send_from_directory, session
+
+from .metrics import inc_counter
+
+_SKIP_ENDPOINTS = {'metrics', 'static', 'admin_profiles', 'admin_profile_download'}
+
+
+class StackSampler(threading.Thread):
+    """Фоновый поток, периодически снимающий стеки указанных потоков (add_thread/remove_thread)."""
+
+    def __init__(self, target_thread_id: int, interval_s: float):
+        super().__init__(name="statonco-profiler", daemon=True)
+        self.thread_ids = {target_thread_id}
+        self.interval_s = interval_s
+        self.samples = Counter()
+        self._stop_event = threading.Event()
+
+    def add_thread(self, thread_id: int):
+        self.thread_ids = self.thread_ids | {thread_id}
+
+    def remove_thread(self, thread_id: int):
+        self.thread_ids = self.thread_ids - {thread_id}
+
+    def run(self):
+        while not self._stop_event.wait(self.interval_s):
+            frames = sys._current_frames()
+            for thread_id in self.thread_ids:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ','))
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=1.0)
+
+    def folded(self) -> str:
+        """Стеки в формате 'frame;frame;frame count' (по строке на стек)."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class _LoadedStats:
+    """Готовая статистика cProfile (словарь Profile.stats) для pstats.Stats.add."""
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def start_process_profile(mode: str | None, interval_s: float) -> dict | None:
+    """Профилирование текущего потока вне запроса (процесс-исполнитель плана)."""
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return {"mode": mode, "profiler": profiler}
+    if mode == 'sample':
+        sampler = StackSampler(threading.get_ident(), interval_s)
+        sampler.start()
+        return {"mode": mode, "sampler": sampler}
+    return None
+
+
+def finish_process_profile(state: dict) -> tuple[str, object]:
+    """Останавливает start_process_profile: (режим, статистика cProfile или стеки folded)."""
+    if state['mode'] == 'cprofile':
+        state['profiler'].disable()
+        state['profiler'].create_stats()
+        return 'cprofile', state['profiler'].stats
+    state['sampler'].stop()
+    return 'sample', state['sampler'].folded()
+
+
+def current_profile_request() -> tuple[str, float] | None:
+    """(режим, интервал сэмплирования), если текущий запрос профилируется - для процесса-исполнителя плана."""
+    state = g.get('_profiling') if has_request_context() else None
+    return (state['mode'], state['interval_s']) if state else None
+
+
+def add_worker_profile(profile: tuple[str, object]):
+    """Профиль процесса-исполнителя (finish_process_profile) - в профиль текущего запроса."""
+    state = g.get('_profiling') if has_request_context() else None
+    if state is not None and profile[0] == state['mode']:
+        state.setdefault('worker_profiles', []).append(profile[1])
+
+
+@contextmanager
+def profile_current_thread():
+    """
+    Добавляет текущий поток к профилю запроса на время блока: код запроса,
+    выполняемый в пуле потоков (ASGI, utils.flow), попадает в профиль.
+    """
+    state = g.get('_profiling') if has_request_context() else None
+    if state is None or state['thread'] == threading.get_ident():
+        yield
+        return
+    if state['mode'] == 'cprofile':
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # профилировщик уже активен в этом потоке
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            state.setdefault('thread_profilers', []).append(profiler)
+    else:
+        thread_id = threading.get_ident()
+        state['sampler'].add_thread(thread_id)
+        try:
+            yield
+        finally:
+            state['sampler'].remove_thread(thread_id)
+
+
+def _requested_mode(app) -> str | None:
+    """Режим профилирования, явно запрошенный клиентом (или None)."""
+    if not app.config.get('PROFILING_ON_DEMAND'):
+        return None
+    value = (request.headers.get('X-Profile') or request.args.get('profile') or '').strip().lower()
+    if value in ('1', 'true', 'sample'):
+        return 'sample'
+    if value == 'cprofile':
+        return 'cprofile'
+    return None
+
+
+def _analysis_context() -> tuple[str | None, object]:
+    """ID анализа и план для метаданных профиля (HTML-сессия или ресурсы API)."""
+    from .dataset_store import get_artifact  # локальный импорт: профилировщик не зависит от API
+
+    view_args = request.view_args or {}
+    if 'plan_id' in view_args:
+        plan = get_artifact('plans', view_args['plan_id'])
+        return view_args['plan_id'], plan.get('proposed_plan') if plan else None
+    if 'dataset_id' in view_args:
+        return view_args['dataset_id'], None
+    return session.get('analysis_id'), session.get('proposed_plan')
+
+
+def _safe_token(value) -> str:
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(value))[:64]
+
+
+def _save_profile(app, state: dict, duration_s: float):
+    profile_dir = app.config['PROFILE_DIR']
+    os.makedirs(profile_dir, exist_ok=True)
+    analysis_id, plan = _analysis_context()
+    # Суффикс uuid: запросы одного эндпоинта в одну секунду не перезаписывают профили друг друга
+    base_name = (f"{time.strftime('%Y%m%d-%H%M%S')}_{_safe_token(request.endpoint)}_"
+                 f"{_safe_token(analysis_id or 'none')}_{uuid.uuid4().hex[:8]}")
+
+    worker_profiles = state.get('worker_profiles', [])
+    if state['mode'] == 'cprofile':
+        data_file = f"{base_name}.prof"
+        stats = pstats.Stats(state['profiler'])
+        for profiler in state.get('thread_profilers', []):
+            stats.add(profiler)
+        for worker_stats in worker_profiles:
+            stats.add(_LoadedStats(worker_stats))
+        stats.dump_stats(os.path.join(profile_dir, data_file))
+    else:
+        data_file = f"{base_name}.folded"
+        with open(os.path.join(profile_dir, data_file), 'w', encoding='utf-8') as f:
+            f.write(state['sampler'].folded())
+            # Стеки исполнителя плана - отдельной ветвью flamegraph
+            for folded in worker_profiles:
+                f.writelines(f"plan_worker;{line}\n" for line in folded.splitlines())
+
+    meta = {
+        "name": base_name,
+        "file": data_file,
+        "mode": state['mode'],
+        "trigger": state['trigger'],
+        "endpoint": request.endpoint,
+        "path": request.path,
+        "method": request.method,
+        "duration_s": round(duration_s, 3),
+        "worker_profiles": len(worker_profiles),
+        "created_at": time.time(),
+        "analysis_id": analysis_id,
+        "plan": plan,
+    }
+    with open(os.path.join(profile_dir, f"{base_name}.json"), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2, default=str)
+    inc_counter("statonco_profiles_saved_total", help_text="Сохраненные профили запросов.",
+                mode=state['mode'], trigger=state['trigger'])
+    app.logger.info(f"Профиль запроса сохранен: {data_file} ({duration_s:.2f} с)")
+
+
+def _check_admin_token(app):
+    expected = app.config.get('ADMIN_TOKEN')
+    provided = request.headers.get('X-Admin-Token') or ''
+    if not expected:
+        abort(404)
+    if not hmac.compare_digest(provided.encode('utf-8'), expected.encode('utf-8')):
+        abort(403)
+
+
+def init_app(app):
+    """Подключает хуки профилирования и административные маршруты /admin/profiles."""
+    app.config.setdefault('PROFILING_ON_DEMAND', os.getenv('PROFILING_ON_DEMAND', 'False').lower() == 'true')
+    app.config.setdefault('PROFILE_SLOW_THRESHOLD_S', float(os.getenv('PROFILE_SLOW_THRESHOLD_S', '0')))
+    app.config.setdefault('PROFILE_SAMPLE_INTERVAL_S', float(os.getenv('PROFILE_SAMPLE_INTERVAL_S', '0.005')))
+    app.config.setdefault('PROFILE_DIR', os.getenv('PROFILE_DIR', 'profiles'))
+    app.config.setdefault('ADMIN_TOKEN', os.getenv('ADMIN_TOKEN'))
+
+    @app.before_request
+    def _profiling_start():
+        # Быстрый выход: при выключенном профилировании - только чтение конфигурации
+        threshold = app.config['PROFILE_SLOW_THRESHOLD_S']
+        if not threshold and not app.config['PROFILING_ON_DEMAND']:
+            return
+        if request.endpoint in _SKIP_ENDPOINTS:
+            return
+
+        mode = _requested_mode(app)
+        trigger = 'on_demand' if mode else 'threshold'
+        if mode is None:
+            if not threshold:
+                return
+            mode = 'sample'
+
+        state = {"mode": mode, "trigger": trigger, "started": time.perf_counter(), "thread": threading.get_ident(),
+                 "interval_s": app.config['PROFILE_SAMPLE_INTERVAL_S']}
+        if mode == 'cprofile':
+            state['profiler'] = cProfile.Profile()
+            state['profiler'].enable()
+        else:
+            state['sampler'] = StackSampler(state['thread'], state['interval_s'])
+            state['sampler'].start()
+        g._profiling = state
+
+    @app.teardown_request
+    def _profiling_finish(exc):
+        state = g.pop('_profiling', None)
+        if state is None:
+            return
+        duration = time.perf_counter() - state['started']
+        if state['mode'] == 'cprofile':
+            state['profiler'].disable()
+        else:
+            state['sampler'].stop()
+
+        threshold = app.config['PROFILE_SLOW_THRESHOLD_S']
+        if state['trigger'] == 'threshold' and duration < threshold:
+            return
+        try:
+            _save_profile(app, state, duration)
+        except Exception as e:
+            app.logger.error(f"Не удалось сохранить профиль запроса: {e}", exc_info=True)
+
+    @app.route('/admin/profiles', methods=['GET'])
+    def admin_profiles():
+        """Список сохраненных профилей (новые первыми)."""
+        _check_admin_token(app)
+        profile_dir = app.config['PROFILE_DIR']
+        items = []
+        if os.path.isdir(profile_dir):
+            for filename in os.listdir(profile_dir):
+                if not filename.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(profile_dir, filename), encoding='utf-8') as f:
+                        items.append(json.load(f))
+                except (OSError, ValueError) as e:
+                    app.logger.warning(f"Не удалось прочитать метаданные профиля '{filename}': {e}")
+        items.sort(key=lambda item: item.get('created_at', 0), reverse=True)
+        return jsonify(profiles=items)
+
+    @app.route('/admin/profiles/<path:filename>', methods=['GET'])
+    def admin_profile_download(filename):
+        """Скачивание файла профиля (.folded, .prof или .json)."""
+        _check_admin_token(app)
+        return send_from_directory(os.path.abspath(app.config['PROFILE_DIR']), filename, as_attachment=True)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Компактное описание столбцов для промптов LLM.
+
+Для широких таблиц (сотни столбцов) полный список имен и построчное описание
+пропусков раздувают промпт. Здесь столбцы локально ранжируются по лексической
+близости к запросу, заполненности и типу, кодируются одной короткой строкой
+на столбец и обрезаются под бюджет токенов.
+"""
+import json
+import re
+
+import pandas as pd
+
+# Грубая оценка: для смеси кириллицы и латиницы ~3 символа на токен
+CHARS_PER_TOKEN = 3
+DEFAULT_COLUMN_TOKEN_BUDGET = 2000
+
+_TOKEN_RE = re.compile(r"[^\w]+", re.UNICODE)
+# Имена, которые нельзя вывести как есть: разделитель полей, кавычка/обратная косая черта
+# в начале (признак JSON-строки), перевод строки, '(' в начале (строка-примечание блока),
+# пробелы по краям
+_QUOTED_NAME_RE = re.compile(r'[|\n\r]|^[("\\]|^\s|\s$')
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _tokens(text: str) -> list[str]:
+    return [t for t in _TOKEN_RE.split(str(text).lower().replace('_', ' ')) if t]
+
+
+def _trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _lexical_score(query_tokens: list[str], query_trigrams: set[str], column: str) -> float:
+    """
+    Близость имени столбца к запросу в диапазоне [0, 1].
+
+    Совпадение токенов по общему префиксу (>= 4 символов) - дешевая замена
+    стемминга для русских словоформ ('возраст' / 'возрастом'); триграммы
+    ловят сокращения и опечатки.
+    """
+    column_tokens = _tokens(column)
+    if not column_tokens or not query_tokens:
+        return 0.0
+    matched = 0
+    for ct in column_tokens:
+        for qt in query_tokens:
+            prefix = min(len(ct), len(qt), 5)
+            if ct == qt or (prefix >= 4 and ct[:prefix] == qt[:prefix]):
+                matched += 1
+                break
+    token_score = matched / len(column_tokens)
+    column_trigrams = _trigrams(" ".join(column_tokens))
+    trigram_score = len(column_trigrams & query_trigrams) / len(column_trigrams) if column_trigrams else 0.0
+    return max(token_score, 0.8 * trigram_score)
+
+
+def build_column_profile(df: pd.DataFrame, report_df: pd.DataFrame | None = None) -> list[dict]:
+    """
+    Метаданные столбцов для промпта: тип, % пропусков, число уникальных значений.
+
+    Returns:
+        list[dict]: [{"name", "kind" ('n'|'c'|'d'|'b'), "missing_pct", "n_unique"}, ...]
+    """
+    missing_pct = {}
+    if report_df is not None and not report_df.empty:
+        missing_pct = dict(zip(report_df['Столбец'], report_df['% пропусков']))
+    n_rows = len(df)
+    profile = []
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_bool_dtype(series):
+            kind = 'b'
+        elif pd.api.types.is_numeric_dtype(series):
+            kind = 'n'
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            kind = 'd'
+        else:
+            kind = 'c'
+        pct = missing_pct.get(col)
+        if pct is None:
+            pct = float(series.isna().mean() * 100) if n_rows else 0.0
+        profile.append({"name": col, "kind": kind, "missing_pct": float(pct), "n_unique": int(series.nunique())})
+    return profile
+
+
+def header_column_profile(column_names: list[str]) -> list[dict]:
+    """Профиль столбцов, известных только по заголовкам (до разбора данных)."""
+    return [{"name": name, "kind": None, "missing_pct": 0.0, "n_unique": 0} for name in column_names]
+
+
+def rank_columns(query: str, column_profile: list[dict]) -> list[tuple[float, dict]]:
+    """Сортирует столбцы по убыванию релевантности запросу."""
+    query_tokens = _tokens(query)
+    query_trigrams = set().union(*(_trigrams(t) for t in query_tokens)) if query_tokens else set()
+    ranked = []
+    for meta in column_profile:
+        lexical = _lexical_score(query_tokens, query_trigrams, meta["name"])
+        completeness = 1.0 - min(meta["missing_pct"], 100.0) / 100.0
+        # Столбцы-идентификаторы (почти все значения уникальны, текст) редко нужны для анализа
+        id_penalty = 0.2 if meta["kind"] == 'c' and meta["n_unique"] > 50 else 0.0
+        ranked.append((0.75 * lexical + 0.25 * completeness - id_penalty, meta))
+    ranked.sort(key=lambda item: item[0], reverse=True)
+    return ranked
+
+
+def encode_column_name(name) -> str:
+    """Имя столбца для компактного блока: как есть либо JSON-строкой, если оно ломает разбор строки."""
+    name = str(name)
+    return json.dumps(name, ensure_ascii=False) if _QUOTED_NAME_RE.search(name) else name
+
+
+def parse_column_line(line: str) -> str:
+    """Имя столбца из строки компактного блока (обратно к _encode_column)."""
+    if line.startswith('"'):
+        try:
+            name, _ = json.JSONDecoder().raw_decode(line)
+            return name
+        except ValueError:
+            pass
+    return line.split('|')[0]
+
+
+def _encode_column(meta: dict) -> str:
+    name = encode_column_name(meta["name"])
+    kind = meta["kind"]
+    if kind is None:
+        return name
+    if kind == 'c':
+        kind = f"c{meta['n_unique']}"
+    pct = meta["missing_pct"]
+    return f"{name}|{kind}|{pct:.0f}%" if pct > 0 else f"{name}|{kind}"
+
+
+def build_columns_block(query: str, column_profile: list[dict], token_budget: int = DEFAULT_COLUMN_TOKEN_BUDGET) -> dict:
+    """
+    Компактный блок описания столбцов для промпта в пределах бюджета токенов.
+
+    Столбцы идут в порядке релевантности; не поместившиеся в бюджет отбрасываются.
+
+    Returns:
+        dict: {"text": блок для промпта, "included": [имена], "omitted": int, "tokens": int,
+               "has_metadata": False, если известны только имена (header_column_profile)}
+    """
+    has_metadata = any(meta["kind"] is not None for meta in column_profile)
+    if has_metadata:
+        legend = ("Формат: имя|тип|% пропусков (если есть). Типы: n - число, c<k> - категория "
+                  "с k уникальными значениями, d - дата, b - логический. Имена с символом | и другими "
+                  "служебными символами даны JSON-строкой в кавычках.")
+    else:
+        legend = "Имена столбцов (по одному на строку; имена со служебными символами - JSON-строкой в кавычках):"
+    lines = []
+    used = estimate_tokens(legend)
+    included = []
+    for _, meta in rank_columns(query, column_profile):
+        line = _encode_column(meta)
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            break
+        lines.append(line)
+        included.append(meta["name"])
+        used += cost
+    omitted = len(column_profile) - len(included)
+    text = legend + "\n" + "\n".join(lines)
+    if omitted:
+        text += f"\n(ещё {omitted} столбцов опущено как наименее релевантные запросу)"
+    return {"text": text, "included": included, "omitted": omitted, "tokens": estimate_tokens(text),
+            "has_metadata": has_metadata}
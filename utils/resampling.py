@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Векторизованный ресэмплинг: бутстреп-интервалы и перестановочные тесты.
+
+Повторные выборки генерируются блоками - матрицами индексов (перестановок)
+размером блок x n, статистика считается по строкам матрицы средствами NumPy.
+Размер блока ограничен RESAMPLING_BLOCK_ELEMENTS элементов, чтобы память не росла с B.
+
+Воспроизводимость: каждый блок получает свой дочерний SeedSequence от seed,
+поэтому результат зависит только от seed и B, а не от числа процессов.
+Если seed не задан, в результате возвращается использованная энтропия - по ней
+расчет можно повторить. Большие задачи (B x n >= RESAMPLING_PARALLEL_MIN_ELEMENTS)
+делятся по блокам между процессами пула (RESAMPLING_WORKERS; процессы запускаются
+через forkserver/spawn, utils.processes, а не fork из сервера с потоками). Внутри
+процесса-исполнителя плана (utils.scheduler, демонический процесс) пул не
+используется никогда: блоки считаются последовательно.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from .metrics import instrumented
+from .processes import process_context
+
+DEFAULT_RESAMPLES = 2000
+MIN_RESAMPLES = 100
+MAX_RESAMPLES = 100_000
+
+_BLOCK_ELEMENTS = int(os.getenv('RESAMPLING_BLOCK_ELEMENTS', 2_000_000))
+_PARALLEL_MIN_ELEMENTS = int(os.getenv('RESAMPLING_PARALLEL_MIN_ELEMENTS', 20_000_000))
+
+_STATISTICS = {
+    "mean": lambda a: a.mean(axis=1),
+    "median": lambda a: np.median(a, axis=1),
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=int(os.getenv('RESAMPLING_WORKERS', min(4, os.cpu_count() or 1))),
+                                        mp_context=process_context())
+        return _pool
+
+
+def _resample_block(kind: str, samples: tuple, statistics: tuple, size: int, seed: np.random.SeedSequence) -> np.ndarray:
+    """
+    Один блок из size повторных выборок. Без Flask - выполняется и в рабочем процессе.
+
+    kind:
+        "bootstrap" - samples=(x,), статистики statistics по выборке с возвращением;
+        "bootstrap_diff" - samples=(x, y), разность статистик независимых выборок с возвращением;
+        "permutation" - samples=(pooled, n1), разность средних после перестановки меток групп.
+
+    Returns:
+        np.ndarray: size x len(statistics) (для permutation - size x 1).
+    """
+    rng = np.random.default_rng(seed)
+    if kind == "bootstrap":
+        (x,) = samples
+        resampled = x[rng.integers(0, len(x), size=(size, len(x)))]
+        return np.column_stack([_STATISTICS[name](resampled) for name in statistics])
+    if kind == "bootstrap_diff":
+        x, y = samples
+        resampled_x = x[rng.integers(0, len(x), size=(size, len(x)))]
+        resampled_y = y[rng.integers(0, len(y), size=(size, len(y)))]
+        return np.column_stack([_STATISTICS[name](resampled_x) - _STATISTICS[name](resampled_y) for name in statistics])
+    if kind == "permutation":
+        pooled, n1 = samples
+        permuted = rng.permuted(np.tile(pooled, (size, 1)), axis=1)
+        return (permuted[:, :n1].mean(axis=1) - permuted[:, n1:].mean(axis=1))[:, None]
+    raise ValueError(f"Неизвестный вид ресэмплинга '{kind}'")
+
+
+def _run_blocks(kind: str, samples: tuple, statistics: tuple, n_resamples: int, n_elements: int,
+                seed: int | None) -> tuple[np.ndarray, int]:
+    """
+    Выполняет n_resamples повторных выборок блоками (последовательно или в пуле процессов).
+
+    Returns:
+        (матрица n_resamples x k статистик, энтропия SeedSequence для воспроизведения)
+    """
+    global _pool
+    seed_sequence = np.random.SeedSequence(seed)
+    block = max(1, _BLOCK_ELEMENTS // max(n_elements, 1))
+    sizes = [block] * (n_resamples // block) + ([n_resamples % block] if n_resamples % block else [])
+    tasks = list(zip(sizes, seed_sequence.spawn(len(sizes))))
+
+    def sequential():
+        return [_resample_block(kind, samples, statistics, size, seed) for size, seed in tasks]
+
+    # В процессах-исполнителях планов (utils.scheduler, демонические) дочерние процессы
+    # запрещены: блоки считаются последовательно, задача не выходит за свой слот
+    if (len(tasks) > 1 and n_resamples * n_elements >= _PARALLEL_MIN_ELEMENTS
+            and not multiprocessing.current_process().daemon):
+        try:
+            pool = _get_pool()
+            futures = [pool.submit(_resample_block, kind, samples, statistics, size, seed) for size, seed in tasks]
+            blocks = [future.result() for future in futures]
+        except BrokenProcessPool:
+            with _pool_lock:
+                _pool = None
+            blocks = sequential()
+    else:
+        blocks = sequential()
+    return np.concatenate(blocks), seed_sequence.entropy
+
+
+def _check_resamples(n_resamples: int) -> int:
+    n_resamples = int(n_resamples)
+    if not MIN_RESAMPLES <= n_resamples <= MAX_RESAMPLES:
+        raise ValueError(f"Число повторных выборок должно быть от {MIN_RESAMPLES} до {MAX_RESAMPLES} (получено {n_resamples}).")
+    return n_resamples
+
+
+def _percentile_interval(values: np.ndarray, confidence: float) -> tuple[float, float]:
+    alpha = (1.0 - confidence) / 2 * 100
+    low, high = np.percentile(values, [alpha, 100 - alpha])
+    return float(low), float(high)
+
+
+@instrumented("resampling.bootstrap")
+def bootstrap_ci(sample, statistics: tuple[str, ...] = ("mean",), n_resamples: int = DEFAULT_RESAMPLES,
+                 confidence: float = 0.95, seed: int | None = None) -> dict:
+    """
+    Перцентильные бутстреп-интервалы для статистик одной выборки (mean, median).
+    Все статистики считаются по одним и тем же повторным выборкам.
+
+    Returns:
+        dict: {"intervals": {статистика: {"estimate", "ci_low", "ci_high"}},
+               "n_resamples", "confidence", "seed"}
+    """
+    x = np.asarray(sample, dtype=float)
+    n_resamples = _check_resamples(n_resamples)
+    values, entropy = _run_blocks("bootstrap", (x,), tuple(statistics), n_resamples, len(x), seed)
+    intervals = {}
+    for i, name in enumerate(statistics):
+        low, high = _percentile_interval(values[:, i], confidence)
+        intervals[name] = {"estimate": float(_STATISTICS[name](x[None, :])[0]), "ci_low": low, "ci_high": high}
+    return {"intervals": intervals, "n_resamples": n_resamples, "confidence": confidence, "seed": entropy}
+
+
+@instrumented("resampling.bootstrap_diff")
+def bootstrap_diff_ci(x, y, statistic: str = "mean", n_resamples: int = DEFAULT_RESAMPLES,
+                      confidence: float = 0.95, seed: int | None = None) -> dict:
+    """
+    Перцентильный бутстреп-интервал для разности статистики двух независимых выборок (x - y).
+
+    Returns:
+        dict: {"estimate", "ci_low", "ci_high", "n_resamples", "confidence", "seed"}
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n_resamples = _check_resamples(n_resamples)
+    values, entropy = _run_blocks("bootstrap_diff", (x, y), (statistic,), n_resamples, len(x) + len(y), seed)
+    low, high = _percentile_interval(values[:, 0], confidence)
+    estimate = float(_STATISTICS[statistic](x[None, :])[0] - _STATISTICS[statistic](y[None, :])[0])
+    return {"estimate": estimate, "ci_low": low, "ci_high": high, "n_resamples": n_resamples,
+            "confidence": confidence, "seed": entropy}
+
+
+@instrumented("resampling.permutation")
+def permutation_test(x, y, n_resamples: int = DEFAULT_RESAMPLES, seed: int | None = None) -> dict:
+    """
+    Двусторонний перестановочный тест разности средних двух независимых выборок.
+    p-value = (число перестановок с |разностью| >= наблюдаемой + 1) / (B + 1).
+
+    Returns:
+        dict: {"statistic", "p_value", "n_resamples", "seed"}
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n_resamples = _check_resamples(n_resamples)
+    observed = float(x.mean() - y.mean())
+    pooled = np.concatenate([x, y])
+    values, entropy = _run_blocks("permutation", (pooled, len(x)), (), n_resamples, len(pooled), seed)
+    # Допуск на погрешность суммирования: перестановка, совпадающая с исходной, должна считаться
+    extreme = np.count_nonzero(np.abs(values[:, 0]) >= abs(observed) - 1e-12 * max(abs(observed), 1.0))
+    return {"statistic": observed, "p_value": (extreme + 1) / (n_resamples + 1), "n_resamples": n_resamples,
+            "seed": entropy}
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+Планировщик выполнения планов анализа: справедливая очередь между пользователями,
+ограничение одновременных анализов на сессию, лимиты памяти и времени на задачу.
+
+Очередь. Одновременно выполняется не более JOB_SLOTS планов на процесс приложения,
+у одного клиента (сессия браузера, для API - X-Client-Id или адрес) - не более
+JOB_MAX_PER_CLIENT. Освободившийся слот получает ожидающий клиент с наименьшим числом
+выполняемых планов, среди равных - дольше всех не получавший слот (по кругу): серия
+планов одного пользователя не задерживает остальных дольше одного плана. Сверх
+JOB_MAX_QUEUED_PER_CLIENT ожидающих планов клиента - отказ (QuotaExceeded), после
+JOB_QUEUE_TIMEOUT_S ожидания - отказ (QueueTimeout).
+
+Исполнение. План выполняется в отдельном процессе из пула заранее запущенных
+исполнителей (forkserver, иначе spawn - JOB_START_METHOD, см. utils.processes). DataFrame и план
+передаются исполнителю сериализацией (pickle) через канал. Исполнитель ограничивает
+свое адресное пространство на JOB_MEMORY_LIMIT_MB сверх занятого при запуске и сам
+прерывает план по JOB_TIME_LIMIT_S; родитель дополнительно останавливает процесс
+после срока. Результаты шагов, сообщения flash, изображения графиков и метрики
+(тайминги шагов, анализов и графиков для /metrics и Server-Timing) передаются
+родителю по мере готовности, профиль исполнителя (если запрос профилируется,
+utils.profiling) - перед завершением, поэтому при превышении лимита, аварийном завершении
+или отмене возвращаются готовые шаги; прерванный шаг получает статус "error",
+оставшиеся - "skipped". Каждый исполнитель выполняет один план и завершается, пул
+(JOB_WARM_WORKERS) пополняется в фоне. Без изоляции (JOB_ISOLATION=false или не POSIX)
+план выполняется в текущем процессе, лимит времени и отмена проверяются между шагами,
+лимит памяти не применяется.
+"""
+import itertools
+import logging
+import os
+import signal
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import Flask, current_app, flash, request, session
+
+from .metrics import drain_metrics, inc_counter, merge_metrics, observe, set_gauge
+from .pipeline import execute_analysis_plan, execute_analysis_plan_stratified
+from .processes import process_context
+from .plot_utils import add_stored_plots, current_plot_output, drain_stored_plots, plot_output
+from .profiling import add_worker_profile, current_profile_request, finish_process_profile, start_process_profile
+
+JOB_SLOTS = int(os.getenv('JOB_SLOTS', os.cpu_count() or 1))
+JOB_MAX_PER_CLIENT = int(os.getenv('JOB_MAX_PER_CLIENT', 1))
+JOB_MAX_QUEUED_PER_CLIENT = int(os.getenv('JOB_MAX_QUEUED_PER_CLIENT', 2))
+JOB_QUEUE_TIMEOUT_S = float(os.getenv('JOB_QUEUE_TIMEOUT_S', 120))
+JOB_TIME_LIMIT_S = float(os.getenv('JOB_TIME_LIMIT_S', 300))
+JOB_MEMORY_LIMIT_MB = int(os.getenv('JOB_MEMORY_LIMIT_MB', 2048))
+JOB_WARM_WORKERS = int(os.getenv('JOB_WARM_WORKERS', min(JOB_SLOTS, 2)))
+JOB_ISOLATION = os.getenv('JOB_ISOLATION', 'True').lower() == 'true' and os.name == 'posix'
+
+# Причины остановки плана -> сообщение для прерванного шага
+_STOP_MESSAGES = {
+    "timeout": "Превышен лимит времени выполнения плана ({limit:g} с).",
+    "memory": "Превышен лимит памяти задачи ({memory} МБ).",
+    "crashed": "Процесс выполнения плана завершился аварийно (возможно, из-за нехватки памяти).",
+    "cancelled": "Выполнение плана отменено.",
+}
+
+
+class SchedulerBusy(Exception):
+    """План не принят к выполнению; retry_after - через сколько секунд стоит повторить."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QuotaExceeded(SchedulerBusy):
+    """У клиента уже максимум выполняемых и ожидающих планов."""
+
+
+class QueueTimeout(SchedulerBusy):
+    """Слот не освободился за JOB_QUEUE_TIMEOUT_S."""
+
+
+class _FairQueue:
+    """Слоты выполнения с очередью, упорядоченной по числу выполняемых планов клиента."""
+
+    def __init__(self, slots: int, max_per_client: int, max_queued_per_client: int):
+        self.slots = slots
+        self.max_per_client = max_per_client
+        self.max_queued_per_client = max_queued_per_client
+        self._cond = threading.Condition()
+        self._running = Counter()  # клиент -> выполняемые планы
+        self._waiting = []         # [(номер, клиент)] в порядке поступления
+        self._last_grant = {}      # клиент -> номер последнего выданного слота (для очереди по кругу)
+        self._seq = itertools.count()
+
+    def _next_ticket(self):
+        if sum(self._running.values()) >= self.slots:
+            return None
+        eligible = [t for t in self._waiting if self._running[t[1]] < self.max_per_client]
+        # Меньше выполняемых планов, затем дольше не получавший слот, затем раньше вставший в очередь
+        return min(eligible, key=lambda t: (self._running[t[1]], self._last_grant.get(t[1], -1), t[0]), default=None)
+
+    def _publish(self):
+        set_gauge("statonco_plan_jobs_running", sum(self._running.values()), help_text="Выполняемые планы анализа.")
+        set_gauge("statonco_plan_jobs_queued", len(self._waiting), help_text="Планы анализа в очереди.")
+
+    @contextmanager
+    def slot(self, client: str, timeout_s: float):
+        ticket = (next(self._seq), client)
+        start = time.monotonic()
+        with self._cond:
+            if sum(1 for _, c in self._waiting if c == client) >= self.max_queued_per_client:
+                raise QuotaExceeded("Слишком много анализов этого пользователя уже выполняется или ожидает очереди. "
+                                    "Дождитесь их завершения.", retry_after=5)
+            self._waiting.append(ticket)
+            self._publish()
+            try:
+                while self._next_ticket() != ticket:
+                    remaining = timeout_s - (time.monotonic() - start)
+                    if remaining <= 0:
+                        raise QueueTimeout("Сервер занят выполнением других анализов. Попробуйте позже.",
+                                           retry_after=int(min(timeout_s, 30)))
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting.remove(ticket)
+                self._publish()
+                # Удаление из очереди (в т.ч. по таймауту) может открыть путь следующему
+                self._cond.notify_all()
+            self._running[client] += 1
+            self._last_grant[client] = ticket[0]
+            self._publish()
+        observe("statonco_plan_job_queue_seconds", time.monotonic() - start, help_text="Ожидание слота планом анализа, с.")
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running[client] -= 1
+                if not self._running[client]:
+                    del self._running[client]
+                    if all(c != client for _, c in self._waiting):
+                        self._last_grant.pop(client, None)
+                self._publish()
+                self._cond.notify_all()
+
+
+_queue = _FairQueue(JOB_SLOTS, JOB_MAX_PER_CLIENT, JOB_MAX_QUEUED_PER_CLIENT)
+
+
+def client_key() -> str:
+    """Клиент для справедливой доли: сессия браузера; для JSON API - X-Client-Id или адрес клиента."""
+    if request.blueprint == 'api_v1':
+        return "api:" + (request.headers.get('X-Client-Id') or request.remote_addr or "unknown")
+    return "session:" + session.setdefault('client_id', uuid.uuid4().hex)
+
+
+def _reflash(messages: list):
+    for category, message in messages:
+        flash(message, category)
+
+
+def _execute(df, plan: list, strata_variable: str | None, on_step):
+    if strata_variable:
+        return execute_analysis_plan_stratified(df, plan, strata_variable, on_step=on_step)
+    return execute_analysis_plan(df, plan, on_step=on_step)
+
+
+def _limit_memory(limit_mb: int):
+    """Ограничивает адресное пространство процесса: уже занятое + limit_mb."""
+    try:
+        import resource
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+        limit = current + limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, OSError, ValueError):
+        pass
+
+
+class _JobTimeout(BaseException):
+    """Срок плана истек в исполнителе (BaseException: не перехватывается обработкой ошибок шага)."""
+
+
+def _on_alarm(signum, frame):
+    raise _JobTimeout()
+
+
+def _worker_main(conn, memory_limit_mb: int):
+    """
+    Процесс-исполнитель: ждет задачу (DataFrame, план, страты, настройки графиков, срок,
+    профилирование), выполняет ее, отправляя ("step", результат, графики, flash, метрики)
+    после каждого шага, затем ("profile", ...) и итоговое сообщение, и завершается.
+    """
+    _limit_memory(memory_limit_mb)
+    drain_metrics()  # метрики запуска исполнителя к плану не относятся
+    try:
+        df, plan, strata_variable, plot_settings, time_limit_s, profile_request = conn.recv()
+    except MemoryError:
+        conn.send(("memory", None, {}, [], drain_metrics()))
+        return
+    except (EOFError, OSError):
+        return  # родитель завершился или пул закрыт
+
+    logging.basicConfig(level=logging.INFO)
+    app = Flask("statonco_worker")
+    app.config['SECRET_KEY'] = os.urandom(16)
+    signal.signal(signal.SIGALRM, _on_alarm)
+    with app.test_request_context(), plot_output(**plot_settings):
+        def send(kind, payload):
+            conn.send((kind, payload, drain_stored_plots(), session.pop('_flashes', []), drain_metrics()))
+
+        profile = start_process_profile(*profile_request) if profile_request else None
+        try:
+            try:
+                signal.setitimer(signal.ITIMER_REAL, time_limit_s)
+                _execute(df, plan, strata_variable, on_step=lambda result: send("step", result))
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+            final = ("done", None)
+        except _JobTimeout:
+            final = ("timeout", None)
+        except MemoryError:
+            final = ("memory", None)
+        except Exception as e:
+            # Ошибки данных (ValueError) передаются как есть, прочие - текстом (могут не сериализоваться)
+            final = ("error", e if isinstance(e, ValueError) else RuntimeError(str(e)))
+        if profile is not None:
+            send("profile", finish_process_profile(profile))
+        send(*final)
+    conn.close()
+
+
+class _WorkerPool:
+    """Заранее запущенные одноразовые исполнители: импорт модулей анализа не входит во время плана."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._lock = threading.Lock()
+        self._idle = []  # [(процесс, канал)]
+        self._refilling = False
+
+    def _start_worker(self):
+        context = process_context()
+        conn, child_conn = context.Pipe()
+        process = context.Process(target=_worker_main, args=(child_conn, JOB_MEMORY_LIMIT_MB), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, conn
+
+    def _refill(self):
+        try:
+            while True:
+                with self._lock:
+                    self._idle = [(p, c) for p, c in self._idle if p.is_alive()]
+                    if len(self._idle) >= self.size:
+                        return
+                worker = self._start_worker()
+                with self._lock:
+                    self._idle.append(worker)
+        except Exception as e:
+            logging.getLogger(__name__).error(f"Не удалось запустить процесс-исполнитель планов: {e}")
+        finally:
+            with self._lock:
+                self._refilling = False
+
+    def _refill_async(self):
+        with self._lock:
+            if self._refilling or self.size <= 0:
+                return
+            self._refilling = True
+        threading.Thread(target=self._refill, name="statonco-job-pool", daemon=True).start()
+
+    def acquire(self):
+        """Свободный исполнитель (процесс, канал); если готовых нет - запускается новый."""
+        worker = None
+        with self._lock:
+            while self._idle and worker is None:
+                process, conn = self._idle.pop()
+                if process.is_alive():
+                    worker = (process, conn)
+                else:
+                    conn.close()
+        if worker is None:
+            worker = self._start_worker()
+        self._refill_async()
+        return worker
+
+
+_pool = _WorkerPool(JOB_WARM_WORKERS)
+
+
+def _stop_process(process):
+    process.terminate()
+    process.join(2)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+
+def _run_isolated(df, plan: list, strata_variable: str | None, time_limit_s: float,
+                  cancel_event: threading.Event | None) -> tuple[list, str | None]:
+    """Выполняет план в процессе-исполнителе. Returns: (готовые результаты шагов, причина остановки или None)."""
+    process, conn = _pool.acquire()
+    # Исполнитель прерывает план сам; запас родителя - на отправку готовых результатов
+    deadline = time.monotonic() + time_limit_s + 5
+    results, stop_reason = [], None
+    try:
+        try:
+            conn.send((df, plan, strata_variable, current_plot_output(), time_limit_s, current_profile_request()))
+        except (BrokenPipeError, EOFError, OSError):
+            return results, "crashed"
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                stop_reason = "cancelled"
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                stop_reason = "timeout"
+                break
+            if not conn.poll(min(remaining, 0.5)):
+                continue
+            try:
+                kind, payload, plots, messages, metrics = conn.recv()
+            except (EOFError, OSError):
+                stop_reason = "crashed"
+                break
+            merge_metrics(metrics)
+            add_stored_plots(plots)
+            _reflash(messages)
+            if kind == "step":
+                results.append(payload)
+            elif kind == "profile":
+                add_worker_profile(payload)
+            elif kind == "done":
+                break
+            elif kind in ("memory", "timeout"):
+                stop_reason = kind
+                break
+            else:
+                raise payload
+    finally:
+        conn.close()
+        _stop_process(process)
+    return results, stop_reason
+
+
+class _Stopped(Exception):
+    pass
+
+
+def _run_inline(df, plan: list, strata_variable: str | None, time_limit_s: float,
+                cancel_event: threading.Event | None) -> tuple[list, str | None]:
+    """Выполняет план в текущем процессе; лимит времени и отмена проверяются между шагами."""
+    deadline = time.monotonic() + time_limit_s
+    results = []
+
+    def on_step(result):
+        results.append(result)
+        if cancel_event is not None and cancel_event.is_set():
+            raise _Stopped("cancelled")
+        if time.monotonic() > deadline:
+            raise _Stopped("timeout")
+
+    try:
+        _execute(df, plan, strata_variable, on_step)
+    except _Stopped as e:
+        return results, str(e)
+    except MemoryError:
+        return results, "memory"
+    return results, None
+
+
+def _complete_partial(plan: list, results: list, stop_reason: str, time_limit_s: float) -> list:
+    """Дополняет готовые шаги прерванным ("error") и невыполненными ("skipped") в формате результатов шагов."""
+    message = _STOP_MESSAGES[stop_reason].format(limit=time_limit_s, memory=JOB_MEMORY_LIMIT_MB)
+    completed = list(results)
+    for i, step in enumerate(plan[len(results):]):
+        if i == 0:
+            completed.append({"plan": step, "status": "error", "message": message})
+        else:
+            completed.append({"plan": step, "status": "skipped", "message": "Шаг не выполнен: выполнение плана прервано."})
+    return completed
+
+
+def run_plan(df, plan: list, strata_variable: str | None = None, client: str | None = None,
+             cancel_event: threading.Event | None = None, time_limit_s: float | None = None) -> list:
+    """
+    Выполняет план (со стратами, если задан strata_variable) через очередь и с лимитами.
+    Формат результата - как у execute_analysis_plan; при остановке по лимиту или отмене
+    результаты дополняются (_complete_partial), а пользователь получает предупреждение.
+
+    Raises:
+        SchedulerBusy: план не принят (квота клиента или таймаут очереди).
+        ValueError: ошибка данных, например некорректный столбец страт.
+    """
+    client = client or client_key()
+    time_limit_s = time_limit_s or JOB_TIME_LIMIT_S
+    with _queue.slot(client, JOB_QUEUE_TIMEOUT_S):
+        run = _run_isolated if JOB_ISOLATION else _run_inline
+        try:
+            results, stop_reason = run(df, plan, strata_variable, time_limit_s, cancel_event)
+        except Exception:
+            inc_counter("statonco_plan_jobs_total", help_text="Выполнения планов анализа по исходу.", outcome="error")
+            raise
+
+    inc_counter("statonco_plan_jobs_total", help_text="Выполнения планов анализа по исходу.",
+                outcome=stop_reason or "done")
+    if stop_reason is None:
+        return results
+    current_app.logger.warning(f"План остановлен ({stop_reason}) после {len(results)} из {len(plan)} шагов, клиент {client}.")
+    if stop_reason != "cancelled":
+        flash(f"{_STOP_MESSAGES[stop_reason].format(limit=time_limit_s, memory=JOB_MEMORY_LIMIT_MB)} "
+              f"Показаны результаты {len(results)} завершенных шагов из {len(plan)}.", "warning")
+    return _complete_partial(plan, results, stop_reason, time_limit_s)
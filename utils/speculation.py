@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Спекулятивная генерация плана анализа.
+
+Как только на этапе 0 приходят suggested_columns, в фоне запрашивается план для
+этих столбцов без уточнений. Если пользователь подтверждает ровно эти столбцы и
+ничего не уточняет, план отдается из кеша; иначе спекуляция отменяется.
+"""
+import threading
+import time
+
+from flask import current_app
+
+from .background import PoolBusy, submit_in_app_context
+from .llm_handler import get_detailed_plan_proposal
+from .metrics import inc_counter
+
+_lock = threading.Lock()
+_pending = {}  # ключ анализа -> {"future", "query", "columns", "created_at"}
+
+
+def _record(outcome: str):
+    inc_counter("statonco_speculative_plans_total",
+                help_text="Спекулятивные планы: started, hit, miss_* и error.", outcome=outcome)
+
+
+def _purge_expired(ttl_s: float):
+    now = time.time()
+    for key in [k for k, v in _pending.items() if now - v["created_at"] > ttl_s]:
+        _pending.pop(key)["future"].cancel()
+        _record("expired")
+
+
+def start_speculative_plan(key: str, query: str, columns: list[str]):
+    """Запускает фоновую генерацию плана для столбцов, предложенных LLM."""
+    if not current_app.config.get('SPECULATIVE_PLANNING', True) or not key or not columns:
+        return
+    try:
+        future = submit_in_app_context("speculation", get_detailed_plan_proposal, query, list(columns), "")
+    except PoolBusy:
+        # Спекуляция необязательна: при занятом пуле план запросится при подтверждении
+        _record("skipped_busy")
+        return
+    with _lock:
+        _purge_expired(current_app.config.get('SPECULATION_TTL_S', 600))
+        previous = _pending.pop(key, None)
+        if previous:
+            previous["future"].cancel()
+        _pending[key] = {"future": future, "query": query, "columns": frozenset(columns), "created_at": time.time()}
+    _record("started")
+    current_app.logger.info(f"Спекулятивный план запущен для {len(columns)} предложенных столбцов.")
+
+
+def discard_speculative_plan(key: str | None):
+    """Отменяет спекуляцию (например, при начале нового анализа)."""
+    if not key:
+        return
+    with _lock:
+        entry = _pending.pop(key, None)
+    if entry:
+        entry["future"].cancel()
+        _record("miss_discarded")
+
+
+def take_speculative_plan(key: str | None, query: str, confirmed_columns: list[str], clarifications: str | None):
+    """
+    Возвращает спекулятивный план, если он подходит к подтвержденному выбору, иначе None.
+
+    План подходит, если запрос тот же, набор столбцов совпадает и уточнений нет.
+    Если спекулятивный запрос еще выполняется, ожидаем его - это все равно быстрее нового.
+    """
+    if not key:
+        return None
+    with _lock:
+        entry = _pending.pop(key, None)
+    if entry is None:
+        return None
+
+    if clarifications and clarifications.strip():
+        entry["future"].cancel()
+        _record("miss_clarifications")
+        return None
+    if entry["query"] != query or entry["columns"] != frozenset(confirmed_columns):
+        entry["future"].cancel()
+        _record("miss_columns")
+        return None
+
+    try:
+        plan = entry["future"].result(timeout=current_app.config.get('SPECULATION_WAIT_S', 120))
+    except Exception as e:
+        current_app.logger.warning(f"Спекулятивный план не получен: {e}")
+        _record("error")
+        return None
+    if not isinstance(plan, list):
+        _record("error")
+        return None
+    _record("hit")
+    current_app.logger.info("Использован спекулятивный план (столбцы подтверждены без изменений).")
+    return plan
@@ -1,13 +1,17 @@
 import pandas as pd
-from scipy import stats
+from scipy import sparse, stats
 import numpy as np
 from .plot_utils import (
     plot_histogram,
     plot_boxplot,
     plot_countplot,
     plot_contingency_table,
+    plot_correlation_heatmap,
+    plot_kaplan_meier,
     dataframe_to_html
 )
+from .metrics import instrumented
+from .resampling import DEFAULT_RESAMPLES, bootstrap_ci, bootstrap_diff_ci, permutation_test
 
 def format_p_value(p_value):
     """Форматирует p-value для вывода."""
@@ -16,9 +20,17 @@ def format_p_value(p_value):
     else:
         return f"{p_value:.3f}" # Округляем до 3 знаков
 
-def get_descriptive_stats(df: pd.DataFrame, variable_col: str) -> dict | None:
+def _format_interval(interval: dict) -> str:
+    return f"{interval['estimate']:.2f} [{interval['ci_low']:.2f}; {interval['ci_high']:.2f}]"
+
+
+@instrumented("analysis.descriptive_stats")
+def get_descriptive_stats(df: pd.DataFrame, variable_col: str, bootstrap: bool = False,
+                          n_resamples: int = DEFAULT_RESAMPLES, seed: int | None = None) -> dict | None:
     """
     Рассчитывает описательные статистики и генерирует график.
+    bootstrap=True добавляет для числовых данных бутстреп 95% ДИ среднего и медианы
+    (n_resamples повторных выборок, seed - для воспроизводимости).
     Возвращает словарь с результатами и данными графика (base64).
     """
     if variable_col not in df.columns:
@@ -44,6 +56,12 @@ def get_descriptive_stats(df: pd.DataFrame, variable_col: str) -> dict | None:
             "75% Квантиль": f"{column_data.quantile(0.75):.2f}",
             "Максимум": f"{column_data.max():.2f}",
         }
+        if bootstrap:
+            resampling = bootstrap_ci(column_data.to_numpy(), statistics=("mean", "median"), n_resamples=n_resamples, seed=seed)
+            stats_data["Среднее, 95% ДИ (бутстреп)"] = _format_interval(resampling["intervals"]["mean"])
+            stats_data["Медиана, 95% ДИ (бутстреп)"] = _format_interval(resampling["intervals"]["median"])
+            stats_data["Повторных выборок (seed)"] = f"{resampling['n_resamples']} ({resampling['seed']})"
+            results["resampling"] = resampling
         results["stats"] = stats_data
         results["plot_data"] = plot_histogram(column_data, title=plot_title)
         results["table_html"] = dataframe_to_html(pd.Series(stats_data, name="Статистика"))
@@ -67,9 +85,13 @@ def get_descriptive_stats(df: pd.DataFrame, variable_col: str) -> dict | None:
     return results
 
 
-def perform_t_test(df: pd.DataFrame, variable_col: str, group_col: str) -> dict | None:
+@instrumented("analysis.t-test")
+def perform_t_test(df: pd.DataFrame, variable_col: str, group_col: str, bootstrap: bool = False,
+                   permutation: bool = False, n_resamples: int = DEFAULT_RESAMPLES, seed: int | None = None) -> dict | None:
     """
     Выполняет t-тест, генерирует график.
+    Необязательно: bootstrap - бутстреп 95% ДИ разности средних, permutation -
+    перестановочный p-value разности средних (n_resamples повторных выборок, seed).
     Возвращает словарь с результатами и данными графика (base64).
     """
     if variable_col not in df.columns:
@@ -108,13 +130,13 @@ def perform_t_test(df: pd.DataFrame, variable_col: str, group_col: str) -> dict
             "Группа": groups[0],
             "N": len(group1_data),
             "Среднее": f"{group1_data.mean():.2f}",
-            "Стд.откл.": f"{group1_data.std():.2f}"
+            "Стд.откл.": f"{group1_data.std():.2f}" if len(group1_data) > 1 else "—"
         }
         group2_stats = {
              "Группа": groups[1],
             "N": len(group2_data),
             "Среднее": f"{group2_data.mean():.2f}",
-            "Стд.откл.": f"{group2_data.std():.2f}"
+            "Стд.откл.": f"{group2_data.std():.2f}" if len(group2_data) > 1 else "—"
         }
         results["stats"]["group1"] = group1_stats
         results["stats"]["group2"] = group2_stats
@@ -124,6 +146,23 @@ def perform_t_test(df: pd.DataFrame, variable_col: str, group_col: str) -> dict
             "p-value": format_p_value(p_value)
         }
 
+        if bootstrap or permutation:
+            x, y = group1_data.to_numpy(), group2_data.to_numpy()
+            if seed is None:
+                # Один seed на бутстреп и перестановочный тест: показанный seed воспроизводит оба
+                seed = np.random.SeedSequence().entropy
+            results["resampling"] = {}
+            if bootstrap:
+                diff_ci = bootstrap_diff_ci(x, y, n_resamples=n_resamples, seed=seed)
+                results["resampling"]["bootstrap"] = diff_ci
+                results["metrics"]["Разность средних, 95% ДИ (бутстреп)"] = _format_interval(diff_ci)
+            if permutation:
+                perm = permutation_test(x, y, n_resamples=n_resamples, seed=seed)
+                results["resampling"]["permutation"] = perm
+                results["metrics"]["p-value (перестановочный)"] = format_p_value(perm["p_value"])
+            used = results["resampling"].get("bootstrap") or results["resampling"].get("permutation")
+            results["metrics"]["Повторных выборок (seed)"] = f"{used['n_resamples']} ({seed})"
+
         if p_value < 0.05:
             results["interpretation"] = f"Обнаружены статистически значимые различия в '{variable_col}' между группами '{groups[0]}' и '{groups[1]}' (p={format_p_value(p_value)})."
             results["significance"] = True
@@ -145,6 +184,7 @@ def perform_t_test(df: pd.DataFrame, variable_col: str, group_col: str) -> dict
         return {"error": f"Ошибка при выполнении t-теста: {e}"}
 
 
+@instrumented("analysis.chi-square")
 def perform_chi_square(df: pd.DataFrame, var1_col: str, var2_col: str) -> dict | None:
     """
     Выполняет тест хи-квадрат, генерирует график таблицы сопряженности.
@@ -208,3 +248,571 @@ def perform_chi_square(df: pd.DataFrame, var1_col: str, var2_col: str) -> dict |
     except Exception as e:
         print(f"Ошибка при выполнении теста хи-квадрат: {e}")
         return {"error": f"Ошибка при выполнении теста хи-квадрат: {e}"}
+
+
+CORRELATION_METHODS = ("pearson", "spearman")
+
+
+def _masked_pearson(values: np.ndarray, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Попарный коэффициент Пирсона по парно-полным наблюдениям для всех столбцов сразу.
+
+    values - матрица n x k (пропуски заменены нулями), mask - 1.0 там, где значение есть.
+    Все суммы по парам (число наблюдений, суммы, суммы квадратов, смешанные произведения)
+    получаются матричными произведениями с маской, без цикла по парам столбцов.
+
+    Returns:
+        (r, n): матрицы k x k коэффициентов (NaN, если пара недостаточна) и числа пар наблюдений.
+    """
+    n = mask.T @ mask
+    sum_x = values.T @ mask            # [i, j]: сумма x_i по строкам, где есть и x_i, и x_j
+    sum_xx = (values * values).T @ mask
+    sum_xy = values.T @ values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sum_xy - sum_x * sum_x.T / n
+        var_i = sum_xx - sum_x ** 2 / n
+        r = cov / np.sqrt(var_i * var_i.T)
+    r[(n < 3) | ~np.isfinite(r)] = np.nan
+    np.clip(r, -1.0, 1.0, out=r)
+    return r, n
+
+
+def _rerank_spearman_pairs(spearman_r: np.ndarray, values: np.ndarray, present: np.ndarray, n: np.ndarray):
+    """
+    Точный коэффициент Спирмена для пар, где ранги по всему столбцу не годятся.
+
+    Если в паре отброшены строки с пропуском только в одном из столбцов, ранги
+    оставшихся значений не совпадают с рангами по всему столбцу - такие пары
+    пересчитываются по своим строкам (spearman_r изменяется на месте).
+    """
+    column_n = np.diag(n)
+    rows, cols = np.nonzero(np.triu((n < column_n[:, None]) | (n < column_n[None, :]), k=1))
+    for i, j in zip(rows, cols):
+        if n[i, j] < 3:
+            continue
+        pair = present[:, i] & present[:, j]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rho = np.corrcoef(stats.rankdata(values[pair, i]), stats.rankdata(values[pair, j]))[0, 1]
+        spearman_r[i, j] = spearman_r[j, i] = np.clip(rho, -1.0, 1.0) if np.isfinite(rho) else np.nan
+
+
+def _correlation_p_values(r: np.ndarray, n: np.ndarray) -> np.ndarray:
+    """p-value (двусторонний) для матрицы коэффициентов по t-распределению с n-2 степенями свободы."""
+    dof = n - 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_stat = r * np.sqrt(dof / (1.0 - r ** 2))
+    p = 2 * stats.t.sf(np.abs(t_stat), np.where(dof > 0, dof, np.nan))
+    p[np.abs(r) >= 1.0] = 0.0
+    return p
+
+
+def _matrix_to_dict(matrix: np.ndarray, columns: list[str]) -> dict:
+    """Матрица k x k -> {столбец: {столбец: значение}}; NaN -> None (для JSON API)."""
+    return {
+        col_i: {col_j: None if np.isnan(matrix[i, j]) else round(float(matrix[i, j]), 4) for j, col_j in enumerate(columns)}
+        for i, col_i in enumerate(columns)
+    }
+
+
+@instrumented("analysis.correlation_matrix")
+def compute_correlation_matrix(df: pd.DataFrame, variable_cols: list[str] | None = None,
+                               method: str = "pearson") -> dict | None:
+    """
+    Корреляционная матрица Пирсона и Спирмена для набора числовых столбцов за один проход.
+
+    Пропуски обрабатываются попарно (для каждой пары - строки, где заданы оба значения).
+    Для Спирмена ранги считаются один раз по всем значениям столбца, затем к ним
+    применяется тот же попарный расчет Пирсона; для пар, где из-за пропусков в другом
+    столбце отбрасываются строки, ранги пересчитываются по строкам этой пары.
+    Строится одна тепловая карта (по method) вместо графика на каждую пару.
+    """
+    if method not in CORRELATION_METHODS:
+        return {"error": f"Неизвестный метод корреляции '{method}' (ожидается один из {list(CORRELATION_METHODS)})."}
+    if variable_cols is None:
+        variable_cols = [col for col in df.columns if pd.api.types.is_numeric_dtype(df[col])]
+
+    missing = [col for col in variable_cols if col not in df.columns]
+    if missing:
+        return {"error": f"Столбцы не найдены: {missing}."}
+    non_numeric = [col for col in variable_cols if not pd.api.types.is_numeric_dtype(df[col])]
+    columns = list(dict.fromkeys(col for col in variable_cols if col not in non_numeric))
+    warning_message = f"Нечисловые столбцы исключены из корреляционного анализа: {non_numeric}." if non_numeric else None
+    if len(columns) < 2:
+        return {"error": f"Для корреляционной матрицы нужно не менее 2 числовых столбцов (найдено {len(columns)}: {columns})."}
+
+    try:
+        data = df[columns].astype(float)
+        mask = data.notna().to_numpy(dtype=float)
+        # Центрирование по среднему столбца уменьшает потерю точности в разностях сумм
+        centered = (data - data.mean()).fillna(0.0).to_numpy()
+        ranks = data.rank(method='average')
+        ranks = (ranks - ranks.mean()).fillna(0.0).to_numpy()
+
+        pearson_r, n_pairs = _masked_pearson(centered, mask)
+        spearman_r, _ = _masked_pearson(ranks, mask)
+        _rerank_spearman_pairs(spearman_r, data.to_numpy(), mask.astype(bool), n_pairs)
+        pearson_p = _correlation_p_values(pearson_r, n_pairs)
+        spearman_p = _correlation_p_values(spearman_r, n_pairs)
+
+        rows, cols = np.triu_indices(len(columns), k=1)
+        pairs_df = pd.DataFrame({
+            "Переменная 1": [columns[i] for i in rows],
+            "Переменная 2": [columns[j] for j in cols],
+            "N": n_pairs[rows, cols].astype(int),
+            "Пирсон r": pearson_r[rows, cols],
+            "p (Пирсон)": pearson_p[rows, cols],
+            "Спирмен ρ": spearman_r[rows, cols],
+            "p (Спирмен)": spearman_p[rows, cols],
+        })
+        key_r = "Пирсон r" if method == "pearson" else "Спирмен ρ"
+        key_p = "p (Пирсон)" if method == "pearson" else "p (Спирмен)"
+        pairs_df = pairs_df.iloc[pairs_df[key_r].abs().fillna(-1).argsort()[::-1]].reset_index(drop=True)
+        valid_pairs = pairs_df.dropna(subset=[key_r])
+        significant = valid_pairs[valid_pairs[key_p] < 0.05]
+
+        table_df = pairs_df.copy()
+        for col in ("Пирсон r", "Спирмен ρ"):
+            table_df[col] = table_df[col].map(lambda v: "—" if pd.isna(v) else f"{v:.3f}")
+        for col in ("p (Пирсон)", "p (Спирмен)"):
+            table_df[col] = table_df[col].map(lambda v: "—" if pd.isna(v) else format_p_value(v))
+
+        method_label = "Пирсона" if method == "pearson" else "Спирмена"
+        results = {
+            "test_type": f"Корреляционная матрица ({method_label})",
+            "variables": columns,
+            "method": method,
+            "metrics": {
+                "Переменных": len(columns),
+                "Пар": len(pairs_df),
+                "Значимых пар (p < 0.05)": len(significant),
+            },
+            "matrix": {"pearson": _matrix_to_dict(pearson_r, columns), "spearman": _matrix_to_dict(spearman_r, columns)},
+            "interpretation": "",
+            "warning": warning_message,
+            "table_title": "Корреляции по парам (по убыванию модуля коэффициента)",
+            "table_html": dataframe_to_html(table_df.set_index(["Переменная 1", "Переменная 2"])),
+            "plot_data": None,
+        }
+
+        if valid_pairs.empty:
+            results["warning"] = " ".join(filter(None, [warning_message, "Ни для одной пары недостаточно совместных наблюдений (нужно не менее 3)."]))
+        else:
+            top = valid_pairs.iloc[0]
+            results["interpretation"] = (
+                f"Значимых корреляций ({method_label}, p < 0.05): {len(significant)} из {len(valid_pairs)} пар. "
+                f"Наиболее сильная связь: '{top['Переменная 1']}' и '{top['Переменная 2']}' "
+                f"({key_r} = {top[key_r]:.3f}, p={format_p_value(top[key_p])}, N={top['N']})."
+            )
+            results["significance"] = not significant.empty
+
+        heatmap_r = pearson_r if method == "pearson" else spearman_r
+        results["plot_data"] = plot_correlation_heatmap(
+            pd.DataFrame(heatmap_r, index=columns, columns=columns),
+            title=f"Корреляционная матрица ({method_label})")
+
+        return results
+
+    except Exception as e:
+        print(f"Ошибка при расчете корреляционной матрицы: {e}")
+        return {"error": f"Ошибка при расчете корреляционной матрицы: {e}"}
+
+
+MAX_SURVIVAL_GROUPS = 20
+
+
+def _survival_tables(times: np.ndarray, events: np.ndarray, codes: np.ndarray, n_groups: int) -> dict:
+    """
+    Таблицы риска по всем группам за одну сортировку.
+
+    Времена сортируются один раз (np.unique), события и наблюдения раскладываются
+    по (группа, время) через bincount, число под риском - обратная кумулятивная сумма.
+
+    Returns:
+        dict: "times" (T уникальных времен), матрицы G x T "deaths", "censored", "at_risk".
+    """
+    unique_times, time_idx = np.unique(times, return_inverse=True)
+    flat = codes * len(unique_times) + time_idx
+    size = n_groups * len(unique_times)
+    deaths = np.bincount(flat, weights=events, minlength=size).reshape(n_groups, -1)
+    observed = np.bincount(flat, minlength=size).reshape(n_groups, -1).astype(float)
+    at_risk = np.cumsum(observed[:, ::-1], axis=1)[:, ::-1]
+    return {"times": unique_times, "deaths": deaths, "censored": observed - deaths, "at_risk": at_risk}
+
+
+def _kaplan_meier(tables: dict) -> dict:
+    """
+    Оценки Каплана-Мейера для всех групп сразу: произведение (1 - d/n) по времени,
+    дисперсия Гринвуда и 95% ДИ с log(-log) преобразованием.
+    """
+    deaths, at_risk = tables["deaths"], tables["at_risk"]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hazard = np.where(at_risk > 0, deaths / at_risk, 0.0)
+        survival = np.cumprod(1.0 - hazard, axis=1)
+        greenwood = np.cumsum(np.where(at_risk > deaths, deaths / (at_risk * (at_risk - deaths)), 0.0), axis=1)
+        log_survival = np.log(survival)
+        se_loglog = np.sqrt(greenwood) / np.abs(log_survival)
+        z = stats.norm.ppf(0.975)
+        lower = survival ** np.exp(z * se_loglog)
+        upper = survival ** np.exp(-z * se_loglog)
+    # Где S = 1 (до первого события) или S = 0, интервал вырожден
+    degenerate = ~np.isfinite(se_loglog)
+    lower = np.where(degenerate, survival, lower)
+    upper = np.where(degenerate, survival, upper)
+    return {"survival": survival, "lower": lower, "upper": upper}
+
+
+def _median_survival(times: np.ndarray, survival: np.ndarray) -> np.ndarray:
+    """Первое время, где S(t) <= 0.5, для каждой группы (NaN, если медиана не достигнута)."""
+    reached = survival <= 0.5
+    first = reached.argmax(axis=1)
+    return np.where(reached.any(axis=1), times[first], np.nan)
+
+
+def _log_rank(tables: dict) -> tuple[float, int, float]:
+    """
+    Лог-ранговый критерий для G групп: наблюдаемые и ожидаемые события и ковариационная
+    матрица собираются матричными операциями по таблицам риска.
+
+    Returns:
+        (chi2, dof, p_value)
+    """
+    deaths, at_risk = tables["deaths"], tables["at_risk"]
+    d_total = deaths.sum(axis=0)
+    n_total = at_risk.sum(axis=0)
+    valid = n_total > 0
+    deaths, at_risk, d_total, n_total = deaths[:, valid], at_risk[:, valid], d_total[valid], n_total[valid]
+
+    share = at_risk / n_total                       # G x T: доля группы среди находящихся под риском
+    observed_minus_expected = (deaths - share * d_total).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = np.where(n_total > 1, d_total * (n_total - d_total) / (n_total - 1), 0.0)
+    covariance = np.diag((share * weight).sum(axis=1)) - (share * weight) @ share.T
+
+    # Ковариационная матрица вырождена (сумма O-E по группам равна 0) - берем G-1 групп
+    dof = len(observed_minus_expected) - 1
+    diff = observed_minus_expected[:dof]
+    chi2 = float(diff @ np.linalg.pinv(covariance[:dof, :dof]) @ diff)
+    return chi2, dof, float(stats.chi2.sf(chi2, dof))
+
+
+@instrumented("analysis.survival")
+def perform_survival_analysis(df: pd.DataFrame, time_col: str, event_col: str,
+                              group_col: str | None = None) -> dict | None:
+    """
+    Кривые Каплана-Мейера, медианы выживаемости и лог-ранговый критерий между группами.
+
+    time_col - время наблюдения (число >= 0), event_col - индикатор события (1 - событие,
+    0 - цензурирование), group_col - необязательная группировка (до MAX_SURVIVAL_GROUPS групп).
+    Возвращает словарь с результатами и данными графика (base64).
+    """
+    for col in filter(None, (time_col, event_col, group_col)):
+        if col not in df.columns:
+            return {"error": f"Столбец '{col}' не найден."}
+    if not pd.api.types.is_numeric_dtype(df[time_col]):
+        return {"error": f"Столбец времени '{time_col}' должен быть числовым."}
+
+    columns = [time_col, event_col] + ([group_col] if group_col else [])
+    data = df[columns].dropna()
+    if data.empty:
+        return {"warning": f"Нет наблюдений без пропусков в столбцах {columns}."}
+
+    event_values = pd.to_numeric(data[event_col], errors='coerce') if not pd.api.types.is_bool_dtype(data[event_col]) else data[event_col].astype(int)
+    if event_values.isna().any() or not event_values.isin([0, 1]).all():
+        found = list(data[event_col].unique()[:5])
+        return {"error": f"Столбец события '{event_col}' должен содержать 0 (цензурирование) и 1 (событие), найдено: {found}."}
+    if (data[time_col] < 0).any():
+        return {"error": f"Столбец времени '{time_col}' содержит отрицательные значения."}
+
+    if group_col:
+        group_labels, codes = np.unique(data[group_col].astype(str).to_numpy(), return_inverse=True)
+        if len(group_labels) > MAX_SURVIVAL_GROUPS:
+            return {"error": f"Слишком много групп в '{group_col}' ({len(group_labels)}), допускается не более {MAX_SURVIVAL_GROUPS}."}
+    else:
+        group_labels, codes = np.array(["Все пациенты"]), np.zeros(len(data), dtype=int)
+
+    try:
+        times = data[time_col].to_numpy(dtype=float)
+        events = event_values.to_numpy(dtype=float)
+        tables = _survival_tables(times, events, codes, len(group_labels))
+        km = _kaplan_meier(tables)
+        medians = _median_survival(tables["times"], km["survival"])
+
+        n_per_group = tables["at_risk"][:, 0].astype(int)
+        events_per_group = tables["deaths"].sum(axis=1).astype(int)
+        summary_df = pd.DataFrame({
+            "N": n_per_group,
+            "События": events_per_group,
+            "Цензурировано": n_per_group - events_per_group,
+            "Медиана выживаемости": ["не достигнута" if np.isnan(m) else f"{m:.2f}" for m in medians],
+        }, index=pd.Index(group_labels, name=group_col or "Группа"))
+
+        results = {
+            "test_type": "Анализ выживаемости (Каплан-Мейер)",
+            "time_variable": time_col,
+            "event_variable": event_col,
+            "grouping_variable": group_col,
+            "groups": [str(g) for g in group_labels],
+            "metrics": {
+                "N": int(n_per_group.sum()),
+                "События": int(events_per_group.sum()),
+            },
+            "interpretation": "",
+            "warning": None,
+            "table_title": "Сводка по группам",
+            "table_html": dataframe_to_html(summary_df),
+            "plot_data": None,
+        }
+        if events_per_group.sum() == 0:
+            results["warning"] = f"В данных нет событий ('{event_col}' = 1): кривые выживаемости не убывают."
+
+        if len(group_labels) >= 2:
+            chi2, dof, p = _log_rank(tables)
+            results["metrics"].update({
+                "Лог-ранговый χ²": f"{chi2:.3f}",
+                "Степени свободы (dof)": dof,
+                "p-value": format_p_value(p),
+            })
+            if p < 0.05:
+                results["interpretation"] = f"Обнаружены статистически значимые различия выживаемости между группами '{group_col}' (лог-ранговый критерий, p={format_p_value(p)})."
+                results["significance"] = True
+            else:
+                results["interpretation"] = f"Статистически значимых различий выживаемости между группами '{group_col}' не обнаружено (лог-ранговый критерий, p={format_p_value(p)})."
+                results["significance"] = False
+        else:
+            median_text = "не достигнута" if np.isnan(medians[0]) else f"{medians[0]:.2f}"
+            results["interpretation"] = f"Медиана выживаемости: {median_text} (N={n_per_group[0]}, событий: {events_per_group[0]})."
+            if group_col:
+                results["warning"] = f"В '{group_col}' только одна группа: лог-ранговый критерий не рассчитывается."
+
+        curves = {}
+        for g, label in enumerate(group_labels):
+            present = tables["at_risk"][g] > 0
+            curves[str(label)] = {
+                "times": tables["times"][present],
+                "survival": km["survival"][g][present],
+                "lower": km["lower"][g][present],
+                "upper": km["upper"][g][present],
+                "censored": tables["censored"][g][present] > 0,
+            }
+        title = f"Кривые выживаемости по '{group_col}'" if group_col else "Кривая выживаемости (Каплан-Мейер)"
+        results["plot_data"] = plot_kaplan_meier(curves, title=title, xlabel=time_col)
+
+        return results
+
+    except Exception as e:
+        print(f"Ошибка при анализе выживаемости: {e}")
+        return {"error": f"Ошибка при анализе выживаемости: {e}"}
+
+
+GROUP_COMPARISON_METHODS = ("anova", "kruskal_wallis")
+MAX_COMPARISON_GROUPS = 20
+
+
+def _group_sums(indicator: sparse.csr_matrix, values: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Число наблюдений, суммы и суммы квадратов по группам для всех показателей сразу
+    (матрица индикаторов групп G x n умножается на значения n x K; NaN - пропуск).
+
+    Returns:
+        (n, sums, sums_sq) - матрицы G x K
+    """
+    mask = ~np.isnan(values)
+    filled = np.where(mask, values, 0.0)
+    return indicator @ mask.astype(float), indicator @ filled, indicator @ (filled * filled)
+
+
+def _tie_sums(values: np.ndarray) -> np.ndarray:
+    """Σ(t³ - t) по группам совпадающих значений для каждого столбца (поправка на связи)."""
+    n, k = values.shape
+    ordered = np.sort(values, axis=0)  # NaN в конце, каждый NaN - отдельный блок размера 1
+    new_block = np.ones_like(ordered, dtype=bool)
+    new_block[1:] = ordered[1:] != ordered[:-1]
+    block_id = np.cumsum(new_block, axis=0) - 1 + np.arange(k) * n
+    sizes = np.bincount(block_id.T.ravel(), minlength=n * k).reshape(k, n).astype(float)
+    return (sizes ** 3 - sizes).sum(axis=1)
+
+
+def _holm(p_values: np.ndarray) -> np.ndarray:
+    """Поправка Холма по строкам матрицы p-values (NaN не учитываются)."""
+    order = np.argsort(p_values, axis=1)  # NaN в конце
+    sorted_p = np.take_along_axis(p_values, order, axis=1)
+    m = np.isfinite(p_values).sum(axis=1, keepdims=True)
+    adjusted = np.minimum(np.maximum.accumulate(sorted_p * (m - np.arange(p_values.shape[1])), axis=1), 1.0)
+    result = np.empty_like(adjusted)
+    np.put_along_axis(result, order, adjusted, axis=1)
+    return result
+
+
+def _anova(n: np.ndarray, sums: np.ndarray, sums_sq: np.ndarray, pairs: tuple) -> dict:
+    """Однофакторный ANOVA и попарные сравнения (объединенная дисперсия, Холм) по агрегатам групп."""
+    total_n = n.sum(axis=0)
+    n_groups = (n > 0).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / n
+        grand_mean = sums.sum(axis=0) / total_n
+        ss_between = np.nansum(n * (means - grand_mean) ** 2, axis=0)
+        ss_within = np.maximum(sums_sq.sum(axis=0) - np.nansum(n * means ** 2, axis=0), 0.0)
+        df_between, df_within = n_groups - 1, total_n - n_groups
+        ms_within = ss_within / df_within
+        statistic = (ss_between / df_between) / ms_within
+        effect = ss_between / (ss_between + ss_within)
+        sd = np.sqrt(np.maximum(sums_sq - n * means ** 2, 0.0) / (n - 1))
+
+        i, j = pairs
+        diff = means[i] - means[j]                                   # P x K
+        t = diff / np.sqrt(ms_within * (1.0 / n[i] + 1.0 / n[j]))
+    valid = (df_between > 0) & (df_within > 0)
+    p_value = np.where(valid, stats.f.sf(statistic, df_between, df_within), np.nan)
+    pair_p = np.where(np.isfinite(t), 2 * stats.t.sf(np.abs(t), df_within), np.nan)
+    return {"statistic": np.where(valid, statistic, np.nan), "df": df_between, "p": p_value, "effect": effect,
+            "means": means, "sd": sd, "pair_diff": diff, "pair_p": _holm(pair_p.T)}
+
+
+def _kruskal_wallis(values: np.ndarray, indicator: sparse.csr_matrix, pairs: tuple) -> dict:
+    """Критерий Краскела-Уоллиса и попарные сравнения Данна (Холм) по суммам рангов групп."""
+    ranks = pd.DataFrame(values).rank(method='average').to_numpy()
+    n, rank_sums, _ = _group_sums(indicator, ranks)
+    total_n = n.sum(axis=0)
+    n_groups = (n > 0).sum(axis=0)
+    ties = _tie_sums(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_ranks = rank_sums / n
+        statistic = 12.0 / (total_n * (total_n + 1)) * np.nansum(rank_sums ** 2 / n, axis=0) - 3 * (total_n + 1)
+        statistic = statistic / (1.0 - ties / (total_n ** 3 - total_n))
+        effect = statistic / (total_n - 1)
+
+        i, j = pairs
+        diff = mean_ranks[i] - mean_ranks[j]
+        variance = (total_n * (total_n + 1) / 12.0 - ties / (12.0 * (total_n - 1))) * (1.0 / n[i] + 1.0 / n[j])
+        z = diff / np.sqrt(variance)
+    df_between = n_groups - 1
+    valid = (df_between > 0) & np.isfinite(statistic)
+    p_value = np.where(valid, stats.chi2.sf(statistic, df_between), np.nan)
+    pair_p = np.where(np.isfinite(z), 2 * stats.norm.sf(np.abs(z)), np.nan)
+    return {"statistic": np.where(valid, statistic, np.nan), "df": df_between, "p": p_value, "effect": effect,
+            "n": n, "pair_diff": diff, "pair_p": _holm(pair_p.T)}
+
+
+@instrumented("analysis.group_comparison")
+def compare_groups(df: pd.DataFrame, variable_cols: list[str], group_col: str, method: str = "anova") -> dict | None:
+    """
+    Сравнение 2+ групп по многим числовым показателям: однофакторный ANOVA или
+    критерий Краскела-Уоллиса, с попарными сравнениями групп.
+
+    Группирующий столбец факторизуется один раз; суммы (и суммы квадратов) значений
+    или рангов по группам для всех показателей считаются одним умножением матрицы
+    индикаторов групп на матрицу значений. Попарные сравнения берутся из тех же
+    агрегатов: для ANOVA - t-критерий с объединенной дисперсией (MS внутри групп),
+    для Краскела-Уоллиса - критерий Данна; p-values с поправкой Холма внутри показателя.
+    Пропуски исключаются отдельно для каждого показателя.
+    """
+    if method not in GROUP_COMPARISON_METHODS:
+        return {"error": f"Неизвестный метод сравнения групп '{method}' (ожидается один из {list(GROUP_COMPARISON_METHODS)})."}
+    missing = [col for col in list(variable_cols) + [group_col] if col not in df.columns]
+    if missing:
+        return {"error": f"Столбцы не найдены: {missing}."}
+    non_numeric = [col for col in variable_cols if not pd.api.types.is_numeric_dtype(df[col])]
+    columns = list(dict.fromkeys(col for col in variable_cols if col not in non_numeric and col != group_col))
+    warnings = [f"Нечисловые столбцы исключены из сравнения групп: {non_numeric}."] if non_numeric else []
+    if not columns:
+        return {"error": f"Нет числовых показателей для сравнения групп по '{group_col}'."}
+
+    codes, group_labels = pd.factorize(df[group_col], sort=True)
+    if len(group_labels) < 2:
+        return {"error": f"В столбце '{group_col}' меньше 2 групп (найдено {len(group_labels)})."}
+    if len(group_labels) > MAX_COMPARISON_GROUPS:
+        return {"error": f"Слишком много групп в '{group_col}' ({len(group_labels)}), допускается не более {MAX_COMPARISON_GROUPS}."}
+
+    try:
+        present = codes >= 0
+        codes = codes[present]
+        values = df.loc[present, columns].to_numpy(dtype=float)
+        indicator = sparse.csr_matrix((np.ones(len(codes)), (codes, np.arange(len(codes)))),
+                                      shape=(len(group_labels), len(codes)))
+        pairs = np.triu_indices(len(group_labels), k=1)
+
+        if method == "anova":
+            # Центрирование по среднему столбца уменьшает потерю точности в суммах квадратов
+            counts = (~np.isnan(values)).sum(axis=0)
+            column_means = np.where(counts > 0, np.nansum(values, axis=0) / np.maximum(counts, 1), 0.0)
+            n, sums, sums_sq = _group_sums(indicator, values - column_means)
+            result = _anova(n, sums, sums_sq, pairs)
+            result["means"] = result["means"] + column_means
+            test_type, statistic_label, effect_label = "Однофакторный дисперсионный анализ (ANOVA)", "F", "η²"
+            diff_label = "Разность средних"
+            # SD одной точки не определено - "—", как пропуски в других таблицах
+            group_cells = [[f"{m:.2f} ± {'—' if c < 2 else f'{s:.2f}'} (n={int(c)})" if c > 0 else "—"
+                            for m, s, c in zip(result["means"][:, k], result["sd"][:, k], n[:, k])]
+                           for k in range(len(columns))]
+        else:
+            result = _kruskal_wallis(values, indicator, pairs)
+            n = result["n"]
+            test_type, statistic_label, effect_label = "Критерий Краскела-Уоллиса", "H", "ε²"
+            diff_label = "Разность средних рангов"
+            medians = pd.DataFrame(values, columns=columns).groupby(codes).median().reindex(range(len(group_labels)))
+            group_cells = [[f"{m:.2f} (n={int(c)})" if c > 0 else "—" for m, c in zip(medians[col].to_numpy(), n[:, k])]
+                           for k, col in enumerate(columns)]
+
+        labels = [str(g) for g in group_labels]
+        statistic, p_value = result["statistic"], result["p"]
+        summary_df = pd.DataFrame(group_cells, index=pd.Index(columns, name="Показатель"),
+                                  columns=[f"{label}: {'среднее ± SD' if method == 'anova' else 'медиана'}" for label in labels])
+        summary_df.insert(0, "N", n.sum(axis=0).astype(int))
+        summary_df[statistic_label] = ["—" if np.isnan(v) else f"{v:.3f}" for v in statistic]
+        summary_df["df"] = result["df"].astype(int)
+        summary_df["p-value"] = ["—" if np.isnan(v) else format_p_value(v) for v in p_value]
+        summary_df[effect_label] = ["—" if np.isnan(v) else f"{v:.3f}" for v in result["effect"]]
+
+        significant = np.flatnonzero(p_value < 0.05)
+        untestable = [col for col, v in zip(columns, p_value) if np.isnan(v)]
+        if untestable:
+            warnings.append(f"Недостаточно наблюдений для сравнения (нужно не менее 2 групп с данными): {untestable}.")
+
+        # Попарные сравнения - только для показателей со значимым общим критерием
+        posthoc_rows = [
+            {"Показатель": columns[k], "Группа 1": labels[i], "Группа 2": labels[j],
+             diff_label: f"{result['pair_diff'][pair, k]:.3f}",
+             "p (Холм)": "—" if np.isnan(result["pair_p"][k, pair]) else format_p_value(result["pair_p"][k, pair])}
+            for k in significant for pair, (i, j) in enumerate(zip(*pairs))
+        ]
+
+        results = {
+            "test_type": test_type,
+            "variables": columns,
+            "grouping_variable": group_col,
+            "groups": labels,
+            "metrics": {
+                "Показателей": len(columns),
+                "Групп": len(labels),
+                "Значимых различий (p < 0.05)": len(significant),
+            },
+            "interpretation": "",
+            "warning": " ".join(warnings) or None,
+            "table_title": f"Сравнение групп '{group_col}' по показателям",
+            "table_html": dataframe_to_html(summary_df),
+            "posthoc_title": f"Попарные сравнения групп ({'t-критерий с объединенной дисперсией' if method == 'anova' else 'критерий Данна'}, поправка Холма)",
+            "posthoc_table_html": dataframe_to_html(pd.DataFrame(posthoc_rows).set_index(["Показатель", "Группа 1", "Группа 2"])) if posthoc_rows else None,
+            "plot_data": None,
+            "significance": len(significant) > 0,
+        }
+        if len(columns) == 1 and not np.isnan(p_value[0]):
+            results["metrics"].update({statistic_label: f"{statistic[0]:.3f}", "p-value": format_p_value(p_value[0])})
+
+        method_label = "ANOVA" if method == "anova" else "критерий Краскела-Уоллиса"
+        if len(significant):
+            names = ", ".join(f"'{columns[k]}' (p={format_p_value(p_value[k])})" for k in significant[:5])
+            more = f" и еще {len(significant) - 5}" if len(significant) > 5 else ""
+            results["interpretation"] = f"Статистически значимые различия между группами '{group_col}' ({method_label}): {names}{more}."
+        else:
+            results["interpretation"] = f"Статистически значимых различий между группами '{group_col}' не обнаружено ({method_label}, p ≥ 0.05)."
+
+        # Один график: показатель с наименьшим p-value
+        if np.isfinite(p_value).any():
+            top = columns[int(np.nanargmin(p_value))]
+            results["plot_data"] = plot_boxplot(df, top, group_col, title=f"'{top}' по группам '{group_col}'")
+
+        return results
+
+    except Exception as e:
+        print(f"Ошибка при сравнении групп: {e}")
+        return {"error": f"Ошибка при сравнении групп: {e}"}